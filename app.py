@@ -7,8 +7,7 @@ from flask_mail import Mail
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 class Base(DeclarativeBase):
     pass
@@ -25,8 +24,15 @@ def create_app():
     # Load configuration
     app.config.from_pyfile('config.py')
     
+    # Queue-based JSON logging tagged with request/user ids (replaces basicConfig)
+    from utils.logs import setup_logging
+    setup_logging(app)
+    
     # Initialize extensions
     db.init_app(app)
+    from utils.database import configure_sqlite
+    with app.app_context():
+        configure_sqlite(db.engine)
     login_manager.init_app(app)
     mail.init_app(app)
     
@@ -38,7 +44,9 @@ def create_app():
     @login_manager.user_loader
     def load_user(user_id):
         from models import User
-        return User.query.get(int(user_id))
+        user = User.query.get(int(user_id))
+        # An account being purged is already logged out everywhere
+        return user if user is not None and user.deleted_at is None else None
     
     # Register blueprints
     from auth.routes import auth_bp
@@ -49,16 +57,53 @@ def create_app():
     app.register_blueprint(main_bp)
     app.register_blueprint(binance_bp)
     
-    # Create tables
+    # Create tables (workers can skip this with AUTO_INIT_DB=0 once `flask --app app init-db` has run)
+    if app.config['AUTO_INIT_DB']:
+        init_db(app)
+    
+    import click
+    
+    @app.cli.command('init-db')
+    @click.option('--vacuum', is_flag=True, help='Rebuild an existing SQLite database once so purges can reclaim space.')
+    def init_db_command(vacuum):
+        """Create missing tables, columns and data directories."""
+        init_db(app, rebuild=vacuum)
+        logger.info('Database initialized')
+    
+    # Heavy ML/report/exchange modules load on first use; warm them up in the background
+    if app.config['WARM_UP_ON_START']:
+        from utils.startup import start_warm_up
+        start_warm_up()
+    
+    # Old uploads, reports and live captures are removed or compressed in the background
+    if app.config['RETENTION_INTERVAL_SECONDS'] > 0:
+        from utils.retention import ensure_sweeper
+        ensure_sweeper(app)
+    
+    return app
+
+def init_db(app, rebuild=False):
     with app.app_context():
         import models
+        from utils.database import ensure_schema, enable_incremental_vacuum
+        # Before create_all, so a new SQLite file starts in incremental-vacuum mode
+        enable_incremental_vacuum(db.engine, rebuild=rebuild)
         db.create_all()
+        ensure_schema(db)
         
         # Create upload directories
         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
         os.makedirs('models', exist_ok=True)
         os.makedirs('database', exist_ok=True)
-    
-    return app
 
-app = create_app()
+_app = None
+
+def __getattr__(name):
+    # `app` is created on first access (e.g. `gunicorn app:app`), so importing db or
+    # create_app (run.py) does not build an application as a side effect
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
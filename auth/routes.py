@@ -16,7 +16,7 @@ def login():
         return redirect(url_for('main.dashboard'))
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
+        user = User.query.filter_by(username=form.username.data, deleted_at=None).first()
         if user and user.check_password(form.password.data):
             if not user.is_verified:
                 # Generate and send verification code
@@ -24,7 +24,8 @@ def login():
                 user.verification_code = code
                 user.verification_expiry = datetime.utcnow() + timedelta(minutes=10)
                 db.session.commit()
-                send_email(user.email, 'Your Login Verification Code', f'Your verification code is: {code}')
+                send_email(user.email, 'Your Login Verification Code', f'Your verification code is: {code}',
+                           user_id=user.id, kind='verification')
                 session['pending_user_id'] = user.id
                 log_activity(user.id, 'Login Verification Code Sent', 'Verification code sent for login.')
                 flash('Your account is not verified. A verification code has been sent to your email.', 'info')
@@ -65,7 +66,8 @@ def register():
             db.session.commit()
             log_activity(user.id, 'User Registration', f'New user {user.username} registered')
             # Send verification email
-            send_email(user.email, 'Your Verification Code', f'Your verification code is: {code}')
+            send_email(user.email, 'Your Verification Code', f'Your verification code is: {code}',
+                       user_id=user.id, kind='verification')
             session['pending_user_id'] = user.id
             flash('Registration successful! Please check your email for the verification code.', 'info')
             return redirect(url_for('auth.verify'))
@@ -109,7 +111,7 @@ def forgot_password():
     from auth.forms import ForgotPasswordForm
     form = ForgotPasswordForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
+        user = User.query.filter_by(email=form.email.data, deleted_at=None).first()
         if user:
             # Generate reset code
             import random
@@ -118,7 +120,8 @@ def forgot_password():
             user.verification_code = code
             user.verification_expiry = datetime.utcnow() + timedelta(minutes=10)
             db.session.commit()
-            send_email(user.email, 'Password Reset Code', f'Your password reset code is: {code}')
+            send_email(user.email, 'Password Reset Code', f'Your password reset code is: {code}',
+                       user_id=user.id, kind='verification')
             session['reset_user_id'] = user.id
             flash('A password reset code has been sent to your email.', 'info')
             return redirect(url_for('auth.reset_password'))
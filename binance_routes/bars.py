@@ -0,0 +1,195 @@
+"""Incremental OHLCV bars built from the trades this process already polls.
+
+``/live-data`` fetches the latest trades for a symbol every few seconds.
+Every batch is also folded into a ``BarBuilder`` for that symbol.  The
+builder keeps 1s/1m/5m/1h bars (``BAR_INTERVALS``) with open, high, low,
+close, volume, quote volume, VWAP and trade count.  Each interval lives in a
+fixed-size ring buffer, so memory does not grow with uptime and the oldest
+bars are overwritten.  A batch costs a few vectorized reductions per
+interval.  Trades that are fetched again (same trade id) are skipped.
+
+The bars serve the live price chart (``/market-data``) in the same format
+as Binance klines, and their multi-timescale features go into the live
+analysis results.  Trades between two polls that were never fetched are not
+in the bars: prices stay right, but volumes are a lower bound
+(``missed_trades`` counts the gap).  When a symbol has not been polled for
+``BAR_STALE_SECONDS``, ``/market-data`` re-seeds its hourly ring from one
+kline request.
+"""
+import time
+import threading
+import numpy as np
+from config import BAR_INTERVALS
+
+INTERVAL_MS = {'1s': 1000, '1m': 60000, '5m': 300000, '15m': 900000, '1h': 3600000, '4h': 14400000,
+               '1d': 86400000}
+COLUMNS = ('start', 'open', 'high', 'low', 'close', 'volume', 'quote_volume', 'trades')
+START, OPEN, HIGH, LOW, CLOSE, VOLUME, QUOTE, TRADES = range(len(COLUMNS))
+
+_builders = {}
+_builders_lock = threading.Lock()
+
+
+class BarRing:
+    """Fixed-capacity ring of bars for one interval; the newest bar is still open."""
+
+    def __init__(self, interval_ms, capacity):
+        self.interval_ms = interval_ms
+        self.capacity = capacity
+        # float64 holds millisecond timestamps exactly, so one array holds every column
+        self.data = np.zeros((capacity, len(COLUMNS)))
+        self.head = -1  # row of the newest bar
+        self.size = 0
+        self.watermark = 0  # trades before this time (ms) are ignored
+        self.updated_at = None  # wall-clock time (s) of the last change
+
+    def __len__(self):
+        return self.size
+
+    def _append(self, row):
+        self.head = (self.head + 1) % self.capacity
+        self.data[self.head] = row
+        self.size = min(self.size + 1, self.capacity)
+
+    def add(self, times, prices, qtys, quotes):
+        """Fold trades in time order into the bars; returns how many were used"""
+        keep = times >= self.watermark
+        if not keep.all():
+            times, prices, qtys, quotes = times[keep], prices[keep], qtys[keep], quotes[keep]
+        if not len(times):
+            return 0
+        starts = times - times % self.interval_ms
+        first = np.concatenate(([0], np.flatnonzero(np.diff(starts)) + 1))
+        last = np.append(first[1:] - 1, len(times) - 1)
+        bars = np.column_stack((
+            starts[first], prices[first], np.maximum.reduceat(prices, first), np.minimum.reduceat(prices, first),
+            prices[last], np.add.reduceat(qtys, first), np.add.reduceat(quotes, first), last - first + 1
+        ))
+        for row in bars:
+            current = self.data[self.head] if self.size else None
+            if current is not None and current[START] == row[START]:
+                current[HIGH] = max(current[HIGH], row[HIGH])
+                current[LOW] = min(current[LOW], row[LOW])
+                current[CLOSE] = row[CLOSE]
+                current[VOLUME:] += row[VOLUME:]
+            else:
+                self._append(row)
+        self.watermark = times[-1]
+        self.updated_at = time.time()
+        return len(times)
+
+    def load(self, klines, watermark):
+        """Replace the bars with Binance kline rows; trades before ``watermark`` are already in them"""
+        self.head, self.size = -1, 0
+        for k in klines[-self.capacity:]:
+            self._append([float(k[0]), float(k[1]), float(k[2]), float(k[3]), float(k[4]), float(k[5]),
+                          float(k[7]), float(k[8])])
+        self.watermark = watermark
+        self.updated_at = time.time()
+
+    def bars(self, limit=None):
+        """Bars oldest first as a (n, len(COLUMNS)) array"""
+        n = self.size if limit is None else min(limit, self.size)
+        return self.data[(self.head - np.arange(n)[::-1]) % self.capacity]
+
+
+class BarBuilder:
+    """All bar intervals for one symbol."""
+
+    def __init__(self, symbol, intervals=None):
+        self.symbol = symbol
+        self.rings = {name: BarRing(INTERVAL_MS[name], capacity)
+                      for name, capacity in (intervals or BAR_INTERVALS).items()}
+        self.last_trade_id = None
+        self.last_trade_time = None
+        self.trades = 0
+        self.missed_trades = 0
+        self.lock = threading.Lock()
+
+    def add_trades(self, df):
+        """Fold a trade frame (id, time, price, qty, quoteQty) into every interval; returns new trades"""
+        ids = df['id'].to_numpy(dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        ids = ids[order]
+        with self.lock:
+            if self.last_trade_id is not None:
+                new = ids > self.last_trade_id
+                order, ids = order[new], ids[new]
+            if not len(ids):
+                return 0
+            if self.last_trade_id is not None:
+                self.missed_trades += int(ids[0] - self.last_trade_id - 1)
+            times = df['time'].to_numpy(dtype=np.float64)[order]
+            prices = df['price'].to_numpy(dtype=np.float64)[order]
+            qtys = df['qty'].to_numpy(dtype=np.float64)[order]
+            quotes = df['quoteQty'].to_numpy(dtype=np.float64)[order] if 'quoteQty' in df.columns else prices * qtys
+            for ring in self.rings.values():
+                ring.add(times, prices, qtys, quotes)
+            self.last_trade_id = int(ids[-1])
+            self.last_trade_time = float(times[-1])
+            self.trades += len(ids)
+        return len(ids)
+
+    def is_fresh(self, interval, max_age_seconds):
+        """True when ``interval`` has bars and was updated in the last ``max_age_seconds``"""
+        ring = self.rings.get(interval)
+        return (ring is not None and len(ring) > 0 and ring.updated_at is not None
+                and time.time() - ring.updated_at <= max_age_seconds)
+
+    def seed(self, interval, klines):
+        """Load ``interval`` from a klines payload fetched just now; later trades extend it"""
+        with self.lock:
+            self.rings[interval].load(klines, watermark=time.time() * 1000)
+
+    def klines(self, interval, limit):
+        """Bars in Binance's kline layout, so chart code can use either"""
+        ring = self.rings[interval]
+        with self.lock:
+            bars = ring.bars(limit)
+        return [[int(b[START]), f"{b[OPEN]:.8f}", f"{b[HIGH]:.8f}", f"{b[LOW]:.8f}", f"{b[CLOSE]:.8f}",
+                 f"{b[VOLUME]:.8f}", int(b[START]) + ring.interval_ms - 1, f"{b[QUOTE]:.8f}", int(b[TRADES])]
+                for b in bars]
+
+    def features(self):
+        """Per-interval features of the newest bars: close, VWAP, last return, volatility, volume z-score"""
+        result = {}
+        with self.lock:
+            for name, ring in self.rings.items():
+                bars = ring.bars()
+                if not len(bars):
+                    continue
+                latest = bars[-1]
+                returns = np.diff(np.log(bars[:, CLOSE]))
+                history = bars[:-1, VOLUME]
+                volume_std = history.std() if len(history) > 1 else 0.0
+                result[name] = {
+                    'bars': len(bars),
+                    'close': float(latest[CLOSE]),
+                    'vwap': float(latest[QUOTE] / latest[VOLUME]) if latest[VOLUME] else float(latest[CLOSE]),
+                    'return': float(returns[-1]) if len(returns) else 0.0,
+                    'volatility': float(returns.std()) if len(returns) > 1 else 0.0,
+                    'volume_z': float((latest[VOLUME] - history.mean()) / volume_std) if volume_std else 0.0
+                }
+        return result
+
+    def snapshot(self):
+        return {
+            'symbol': self.symbol,
+            'trades': self.trades,
+            'missed_trades': self.missed_trades,
+            'last_trade_id': self.last_trade_id,
+            'bars': {name: len(ring) for name, ring in self.rings.items()}
+        }
+
+
+def get_builder(symbol):
+    """The process-wide bar builder for ``symbol``, created on first use"""
+    builder = _builders.get(symbol)
+    if builder is None:
+        with _builders_lock:
+            builder = _builders.setdefault(symbol, BarBuilder(symbol))
+    return builder
+
+
+def all_snapshots():
+    return {symbol: builder.snapshot() for symbol, builder in list(_builders.items())}
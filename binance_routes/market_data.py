@@ -0,0 +1,165 @@
+"""Concurrent client for Binance's public market-data endpoints.
+
+``get_market_data`` used to make three sequential python-binance calls on a
+new client, so its latency was the sum of three round trips.  This client
+issues them concurrently on a shared thread pool over one pooled keep-alive
+``requests.Session``.  Each call has connect/read timeouts and retries
+transient failures (connection errors, timeouts, 429/418 and 5xx) with
+exponential backoff and jitter.  A call that still fails is reported in
+``errors`` while the others are returned, so the page can render a partial
+response.
+
+The payloads are the raw REST responses, i.e. the same JSON python-binance's
+``get_ticker``, ``get_order_book`` and ``get_klines`` return.
+"""
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from config import (BINANCE_API_URL, BINANCE_API_KEY, MARKET_DATA_TIMEOUT, MARKET_DATA_RETRIES,
+                    MARKET_DATA_BACKOFF, EXCHANGE_INFO_TTL_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {418, 429, 500, 502, 503, 504}
+POOL_SIZE = 16
+
+
+class MarketDataError(Exception):
+    """An upstream call failed after all retries."""
+
+
+class MarketDataClient:
+    """Thread-safe pooled client; share one instance per process."""
+
+    def __init__(self, base_url=BINANCE_API_URL, api_key=BINANCE_API_KEY, timeout=MARKET_DATA_TIMEOUT,
+                 retries=MARKET_DATA_RETRIES, backoff=MARKET_DATA_BACKOFF, max_workers=POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if api_key:
+            # Not needed for public data, but requests then count against the key's own limits
+            self.session.headers['X-MBX-APIKEY'] = api_key
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='market-data')
+        self._symbols = None
+        self._symbols_at = 0.0
+        self._symbols_lock = threading.Lock()
+
+    def get(self, path, params=None):
+        """GET a JSON endpoint, retrying transient failures with exponential backoff"""
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.json()
+                error = f"HTTP {response.status_code}"
+                retry_after = response.headers.get('Retry-After')
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = f"{type(e).__name__}: {e}"
+                retry_after = None
+            except requests.RequestException as e:
+                raise MarketDataError(f"{path}: {e}") from e
+            if attempt == self.retries:
+                break
+            delay = self.backoff * (2 ** attempt) * (1 + random.random())
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            logger.warning(f"Market data {path} failed ({error}); retry {attempt + 1} in {delay:.2f}s")
+            time.sleep(delay)
+        raise MarketDataError(f"{path}: {error} after {self.retries + 1} attempts")
+
+    def ticker(self, symbol):
+        return self.get('/api/v3/ticker/24hr', {'symbol': symbol})
+
+    def order_book(self, symbol, limit=10):
+        return self.get('/api/v3/depth', {'symbol': symbol, 'limit': limit})
+
+    def klines(self, symbol, interval='1h', limit=24):
+        return self.get('/api/v3/klines', {'symbol': symbol, 'interval': interval, 'limit': limit})
+
+    def trading_symbols(self, max_age=EXCHANGE_INFO_TTL_SECONDS):
+        """Symbols currently trading, from ``exchangeInfo`` cached for ``max_age`` seconds.
+
+        A failed refresh keeps serving the previous list; with no list yet it
+        raises ``MarketDataError``.
+        """
+        with self._symbols_lock:
+            if self._symbols is None or time.monotonic() - self._symbols_at >= max_age:
+                try:
+                    info = self.get('/api/v3/exchangeInfo')
+                except MarketDataError as e:
+                    if self._symbols is None:
+                        raise
+                    logger.warning(f"Keeping cached exchange symbols: {e}")
+                else:
+                    self._symbols = frozenset(s['symbol'] for s in info.get('symbols', [])
+                                              if s.get('status') == 'TRADING')
+                    self._symbols_at = time.monotonic()
+            return self._symbols
+
+    def fetch_many(self, calls, deadline=None):
+        """Run ``{name: (callable, args)}`` concurrently; returns (results, errors) keyed by name.
+
+        Calls still running at ``deadline`` seconds are reported as timed out.
+        """
+        futures = {self.executor.submit(fn, *args): name for name, (fn, args) in calls.items()}
+        done, pending = wait(futures, timeout=deadline)
+        results, errors = {}, {}
+        for future, name in futures.items():
+            if future in pending:
+                future.cancel()
+                results[name] = None
+                errors[name] = 'timed out'
+                continue
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = None
+                errors[name] = str(e)
+        return results, errors
+
+    def market_snapshot(self, symbol, deadline=None, klines=True, order_book=True):
+        """Ticker plus (unless switched off) top-of-book and 24h hourly klines, fetched concurrently"""
+        calls = {'ticker': (self.ticker, (symbol,))}
+        if order_book:
+            calls['order_book'] = (self.order_book, (symbol, 10))
+        if klines:
+            calls['price_chart'] = (self.klines, (symbol, '1h', 24))
+        return self.fetch_many(calls, deadline=deadline)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide client, so connections stay warm between requests"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MarketDataClient()
+    return _client
+
+
+def binance_client():
+    """python-binance client for recent trades, pointed at ``BINANCE_API_URL`` like ``MarketDataClient``"""
+    from binance.client import Client
+    # Recent trades are public: no API key, and no ping round trip on every new client
+    client = Client(ping=False)
+    client.API_URL = f"{BINANCE_API_URL.rstrip('/')}/api"
+    return client
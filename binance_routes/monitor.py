@@ -0,0 +1,246 @@
+"""Server-side live monitors for Binance symbols.
+
+A pool of worker processes polls recent trades and scores them with the
+ensemble, independently of any browser tab.  Symbols are sharded across
+workers with a stable hash, so each worker owns a fixed subset of the
+active symbols (``MONITOR_SYMBOLS`` plus every symbol a user subscribed to)
+and keeps per-symbol state: the last trade id seen and the trailing trades
+the rolling features need.  Every worker loads the model artifact once;
+with the memory-mapped artifact the model arrays are shared between them.
+
+Detected anomalies are stored as ``MonitorAnomaly`` rows and each subscriber
+of the symbol gets one alert per batch.  Users only subscribe to symbols, so
+adding users adds no upstream fetches, and adding symbols or workers spreads
+the load across cores.
+
+Run the pool alongside the web server with::
+
+    python -m binance_routes.monitor --workers 4
+"""
+import os
+import re
+import time
+import zlib
+import logging
+import multiprocessing
+from datetime import datetime
+from config import MONITOR_SYMBOLS, MONITOR_WORKERS, MONITOR_POLL_SECONDS, MONITOR_TRADE_LIMIT
+
+logger = logging.getLogger(__name__)
+
+SYMBOL_PATTERN = re.compile(r'^[A-Z0-9]{5,20}$')
+DEFAULT_SYMBOL = 'BTCUSDT'
+# prepare_features uses 5-trade rolling windows; carry the last 4 trades into the next batch
+FEATURE_CONTEXT_ROWS = 4
+RESTART_BACKOFF_SECONDS = 5
+
+
+def normalize_symbol(symbol, default=DEFAULT_SYMBOL):
+    """Upper-case and validate a trading pair such as 'btcusdt'; raises ValueError"""
+    symbol = (symbol or default).strip().upper()
+    if not SYMBOL_PATTERN.match(symbol):
+        raise ValueError(f"Invalid symbol: {symbol}")
+    return symbol
+
+
+def shard_for(symbol, n_shards):
+    """Stable worker index for a symbol (crc32, unlike hash(), is the same in every process)"""
+    return zlib.crc32(symbol.encode('utf-8')) % n_shards
+
+
+def active_symbols():
+    """Configured symbols plus every symbol with at least one subscriber"""
+    from app import db
+    from models import MonitorSubscription
+    subscribed = [row[0] for row in db.session.query(MonitorSubscription.symbol).distinct()]
+    return sorted(set(MONITOR_SYMBOLS) | set(subscribed))
+
+
+class SymbolState:
+    """Per-symbol scoring state owned by one worker."""
+
+    def __init__(self, symbol, last_trade_id=None):
+        self.symbol = symbol
+        self.last_trade_id = last_trade_id
+        self.context = None  # trailing trades for the rolling features
+        self.trades_scored = 0
+        self.anomalies = 0
+        self.errors = 0
+        self.last_poll = None
+
+
+def trades_to_frame(trades):
+    """Binance recent-trades payload -> the DataFrame layout get_live_data scores"""
+    import pandas as pd
+    return pd.DataFrame({
+        'id': [int(t['id']) for t in trades],
+        'price': [float(t['price']) for t in trades],
+        'qty': [float(t['qty']) for t in trades],
+        'quoteQty': [float(t['quoteQty']) for t in trades],
+        'time': [int(t['time']) for t in trades],
+    })
+
+
+def score_new_trades(analyzer, state, trades):
+    """Score trades newer than the state's last trade; returns the anomalous ones"""
+    import pandas as pd
+    if state.last_trade_id is not None:
+        trades = [t for t in trades if int(t['id']) > state.last_trade_id]
+    if not trades:
+        return []
+    new = trades_to_frame(trades)
+    context_rows = 0 if state.context is None else len(state.context)
+    frame = new if not context_rows else pd.concat([state.context, new], ignore_index=True)
+
+    X_scaled = analyzer.scaler.transform(analyzer.prepare_features(frame.drop(columns=['id'])))
+    drift = analyzer.observe_drift(f'monitor:{state.symbol}', X_scaled[context_rows:])
+    # Context rows were seen by the tick detector last batch; it returns their earlier scores
+    scored = analyzer.score(X_scaled, tick_probabilities=analyzer.score_ticks(frame, f'monitor:{state.symbol}'),
+                            supervised=analyzer.in_training_domain(drift))
+    prediction = scored['prediction'][context_rows:]
+    scores = scored['scores'][context_rows:]
+
+    state.context = frame.tail(FEATURE_CONTEXT_ROWS).reset_index(drop=True)
+    state.last_trade_id = int(new['id'].iloc[-1])
+    state.trades_scored += len(new)
+    anomalies = []
+    for row, flagged, score in zip(new.itertuples(index=False), prediction, scores):
+        if flagged:
+            anomalies.append({
+                'trade_id': int(row.id),
+                'price': float(row.price),
+                'qty': float(row.qty),
+                'score': float(score),
+                'trade_time': datetime.utcfromtimestamp(row.time / 1000),
+            })
+    state.anomalies += len(anomalies)
+    return anomalies
+
+
+def record_anomalies(symbol, anomalies):
+    """Persist a batch of anomalies and alert the symbol's subscribers in one commit"""
+    from app import db
+    from models import MonitorAnomaly, MonitorSubscription
+    from utils.alerts import raise_alert
+    if not anomalies:
+        return
+    db.session.add_all(MonitorAnomaly(symbol=symbol, **anomaly) for anomaly in anomalies)
+    top = max(anomalies, key=lambda a: a['score'])
+    message = (f"Monitor detected {len(anomalies)} anomalous {symbol} trade(s); "
+               f"strongest at {top['price']:.8g} x {top['qty']:.8g} (score {top['score']:.2f})")
+    subscribers = [row[0] for row in db.session.query(MonitorSubscription.user_id).filter_by(symbol=symbol)]
+    # One alert per subscriber and incident: later batches update it instead of adding rows
+    for user_id in subscribers:
+        raise_alert(user_id, 'anomaly', message, 'high', key=f'monitor:{symbol}', quantity=len(anomalies),
+                    noun=f'anomalous {symbol} trades', commit=False)
+    db.session.commit()
+
+
+def initial_state(symbol):
+    """Resume after the newest stored anomaly so restarts don't store duplicates"""
+    from app import db
+    from models import MonitorAnomaly
+    last_trade_id = db.session.query(db.func.max(MonitorAnomaly.trade_id)).filter_by(symbol=symbol).scalar()
+    return SymbolState(symbol, last_trade_id)
+
+
+def run_worker(index, n_workers, stop_event, poll_seconds=MONITOR_POLL_SECONDS, limit=MONITOR_TRADE_LIMIT):
+    """Worker process: poll and score every active symbol in this worker's shard"""
+    from app import app, db
+    from binance_routes.market_data import binance_client
+    from ml.analyzer import MLAnalyzer
+
+    logger.info(f"Monitor worker {index}/{n_workers} starting (pid {os.getpid()})")
+    with app.app_context():
+        analyzer = MLAnalyzer()
+        client = binance_client()
+        states = {}
+        while not stop_event.is_set():
+            started = time.monotonic()
+            try:
+                symbols = [s for s in active_symbols() if shard_for(s, n_workers) == index]
+            except Exception as e:
+                logger.error(f"Monitor worker {index}: could not load symbols: {str(e)}")
+                db.session.rollback()
+                symbols = list(states)
+            for symbol in list(states):
+                if symbol not in symbols:
+                    del states[symbol]
+            for symbol in symbols:
+                if stop_event.is_set():
+                    break
+                try:
+                    state = states.get(symbol)
+                    if state is None:
+                        state = states[symbol] = initial_state(symbol)
+                    trades = client.get_recent_trades(symbol=symbol, limit=limit)
+                    record_anomalies(symbol, score_new_trades(analyzer, state, trades))
+                    state.last_poll = datetime.utcnow()
+                except Exception as e:
+                    db.session.rollback()
+                    if symbol in states:
+                        states[symbol].errors += 1
+                    logger.error(f"Monitor worker {index}: {symbol} failed: {str(e)}")
+            db.session.remove()
+            stop_event.wait(max(0.0, poll_seconds - (time.monotonic() - started)))
+    logger.info(f"Monitor worker {index} stopped")
+
+
+class MonitorPool:
+    """Starts one process per shard and restarts workers that die."""
+
+    def __init__(self, n_workers=None, poll_seconds=MONITOR_POLL_SECONDS, limit=MONITOR_TRADE_LIMIT):
+        self.n_workers = n_workers or MONITOR_WORKERS or os.cpu_count() or 1
+        self.poll_seconds = poll_seconds
+        self.limit = limit
+        # spawn: workers build their own app, engine and model maps instead of inheriting sockets
+        self.ctx = multiprocessing.get_context('spawn')
+        self.stop_event = self.ctx.Event()
+        self.workers = [None] * self.n_workers
+
+    def _start_worker(self, index):
+        process = self.ctx.Process(target=run_worker, name=f'monitor-{index}',
+                                   args=(index, self.n_workers, self.stop_event, self.poll_seconds, self.limit))
+        process.start()
+        self.workers[index] = process
+
+    def start(self):
+        for index in range(self.n_workers):
+            self._start_worker(index)
+
+    def supervise(self):
+        """Block until stopped, restarting any worker that exits"""
+        while not self.stop_event.is_set():
+            for index, process in enumerate(self.workers):
+                if process is not None and not process.is_alive() and not self.stop_event.is_set():
+                    logger.warning(f"Monitor worker {index} exited with {process.exitcode}; restarting")
+                    self._start_worker(index)
+            self.stop_event.wait(RESTART_BACKOFF_SECONDS)
+
+    def stop(self, timeout=30):
+        self.stop_event.set()
+        for process in self.workers:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the server-side symbol monitors')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: MONITOR_WORKERS or CPU count)')
+    parser.add_argument('--interval', type=float, default=MONITOR_POLL_SECONDS, help='seconds between polls of a symbol')
+    parser.add_argument('--limit', type=int, default=MONITOR_TRADE_LIMIT, help='recent trades fetched per poll')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pool = MonitorPool(args.workers, poll_seconds=args.interval, limit=args.limit)
+    pool.start()
+    try:
+        pool.supervise()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
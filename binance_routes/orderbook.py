@@ -0,0 +1,369 @@
+"""Local order books kept in sync from one snapshot plus depth diffs.
+
+``/market-data`` used to fetch a 10-level REST snapshot on every refresh.
+A ``DepthFeed`` instead subscribes to a symbol's diff depth stream
+(``<symbol>@depth@100ms``) once.  It loads one REST snapshot and then
+applies each update to an ``OrderBook``, following Binance's
+synchronisation rules:
+
+* events that end at or before the snapshot's ``lastUpdateId`` are dropped;
+* every applied event must start at most one id after the book's last
+  update, otherwise updates were lost and the book is rebuilt from a new
+  snapshot.
+
+Each side keeps its prices in a sorted list (bids by negated price, so both
+sides sort best first) next to a price -> quantity dict.  Best bid/ask is
+O(1), depth at a price is a dict lookup, and summing the top N levels reads
+N entries.  ``features`` turns the book into spread, top-N imbalance and a
+depth shock (log ratio of top-N depth to its exponentially weighted
+baseline) for the live analysis results.
+
+Raw messages can be recorded to a JSON-lines file and replayed into a book::
+
+    python -m binance_routes.orderbook record BTCUSDT --seconds 60 --out btcusdt.jsonl
+    python -m binance_routes.orderbook replay btcusdt.jsonl
+"""
+import json
+import math
+import time
+import logging
+import threading
+from bisect import bisect_left, insort
+from config import (ORDER_BOOK_SNAPSHOT_LEVELS, ORDER_BOOK_FEATURE_LEVELS, ORDER_BOOK_HALF_LIFE_UPDATES,
+                    ORDER_BOOK_STREAM)
+
+logger = logging.getLogger(__name__)
+
+STREAM_INTERVAL_MS = 100
+MAX_BUFFERED_EVENTS = 10000  # diffs held while a snapshot is being fetched
+FEED_RETRY_SECONDS = 60
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+_socket_manager = None
+_manager_lock = threading.Lock()
+
+
+class OrderBookGap(Exception):
+    """A depth update does not follow the book's last update; the book must be resynced."""
+
+
+class BookSide:
+    """Price levels of one side, best price first."""
+
+    def __init__(self, descending):
+        self.sign = -1.0 if descending else 1.0
+        self.keys = []  # sign * price, ascending
+        self.quantities = {}  # price -> quantity
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        self.keys = []
+        self.quantities = {}
+
+    def set(self, price, quantity):
+        """Set a level's quantity; 0 removes the level"""
+        if quantity == 0:
+            if self.quantities.pop(price, None) is not None:
+                key = self.sign * price
+                del self.keys[bisect_left(self.keys, key)]
+            return
+        if price not in self.quantities:
+            insort(self.keys, self.sign * price)
+        self.quantities[price] = quantity
+
+    def best(self):
+        """(price, quantity) of the best level, or None"""
+        if not self.keys:
+            return None
+        price = self.sign * self.keys[0]
+        return price, self.quantities[price]
+
+    def levels(self, n):
+        return [(self.sign * key, self.quantities[self.sign * key]) for key in self.keys[:n]]
+
+    def depth(self, n):
+        """Total quantity in the best ``n`` levels"""
+        return sum(self.quantities[self.sign * key] for key in self.keys[:n])
+
+
+class OrderBook:
+    """Both sides of one symbol's book plus the id of the last update applied."""
+
+    def __init__(self, symbol, feature_levels=ORDER_BOOK_FEATURE_LEVELS, half_life=ORDER_BOOK_HALF_LIFE_UPDATES):
+        self.symbol = symbol
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.last_update_id = None
+        self.feature_levels = feature_levels
+        self.alpha = 1.0 - 0.5 ** (1.0 / half_life)
+        self.depth_baseline = None  # EWMA of the top-N depth of both sides
+        self.updates = 0
+        self.resyncs = 0
+        self.updated_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def synced(self):
+        return self.last_update_id is not None
+
+    def load_snapshot(self, snapshot):
+        """Replace the book with a REST depth snapshot"""
+        with self.lock:
+            self.bids.clear()
+            self.asks.clear()
+            for price, quantity in snapshot['bids']:
+                self.bids.set(float(price), float(quantity))
+            for price, quantity in snapshot['asks']:
+                self.asks.set(float(price), float(quantity))
+            self.last_update_id = int(snapshot['lastUpdateId'])
+            self.updated_at = time.time()
+
+    def apply(self, event):
+        """Apply a ``depthUpdate`` event; returns False for events already in the book.
+
+        Raises ``OrderBookGap`` when the event skips updates (or there is no snapshot yet).
+        """
+        with self.lock:
+            if self.last_update_id is None:
+                raise OrderBookGap(f"{self.symbol}: no snapshot loaded")
+            first, final = int(event['U']), int(event['u'])
+            if final <= self.last_update_id:
+                return False
+            if first > self.last_update_id + 1:
+                raise OrderBookGap(f"{self.symbol}: expected update {self.last_update_id + 1}, got {first}")
+            for price, quantity in event['b']:
+                self.bids.set(float(price), float(quantity))
+            for price, quantity in event['a']:
+                self.asks.set(float(price), float(quantity))
+            self.last_update_id = final
+            self.updates += 1
+            self.updated_at = time.time()
+            depth = self.bids.depth(self.feature_levels) + self.asks.depth(self.feature_levels)
+            if self.depth_baseline is None:
+                self.depth_baseline = depth
+            else:
+                self.depth_baseline += self.alpha * (depth - self.depth_baseline)
+            return True
+
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def depth_at(self, price):
+        """Quantity resting at ``price`` on either side (0 when there is no level)"""
+        price = float(price)
+        return self.bids.quantities.get(price) or self.asks.quantities.get(price) or 0.0
+
+    def imbalance(self, levels=None):
+        """(bid depth - ask depth) / total over the best ``levels``, in [-1, 1]"""
+        levels = levels or self.feature_levels
+        bid, ask = self.bids.depth(levels), self.asks.depth(levels)
+        return (bid - ask) / (bid + ask) if bid + ask else 0.0
+
+    def features(self):
+        """Spread, imbalance and depth shock of the current book, or None when it is empty"""
+        with self.lock:
+            bid, ask = self.bids.best(), self.asks.best()
+            if bid is None or ask is None:
+                return None
+            mid = (bid[0] + ask[0]) / 2
+            depth = self.bids.depth(self.feature_levels) + self.asks.depth(self.feature_levels)
+            return {
+                'best_bid': bid[0],
+                'best_ask': ask[0],
+                'spread_bps': (ask[0] - bid[0]) / mid * 1e4,
+                'imbalance': self.imbalance(),
+                'depth': depth,
+                # Below 0 when liquidity was pulled from the top of the book, above 0 when it piled up
+                'depth_shock': math.log(depth / self.depth_baseline) if depth and self.depth_baseline else 0.0,
+                'levels': self.feature_levels,
+                'last_update_id': self.last_update_id
+            }
+
+    def to_rest(self, limit=10):
+        """The book in the REST ``/api/v3/depth`` layout"""
+        with self.lock:
+            return {
+                'lastUpdateId': self.last_update_id,
+                'bids': [[f"{p:.8f}", f"{q:.8f}"] for p, q in self.bids.levels(limit)],
+                'asks': [[f"{p:.8f}", f"{q:.8f}"] for p, q in self.asks.levels(limit)]
+            }
+
+
+class DepthFeed:
+    """Keeps one ``OrderBook`` in sync from the diff depth stream."""
+
+    def __init__(self, symbol, recorder=None):
+        self.symbol = symbol
+        self.book = OrderBook(symbol)
+        self.buffer = []  # events received while the snapshot is being fetched
+        self.syncing = False
+        self.recorder = recorder
+        self.lock = threading.Lock()
+        self.socket = None
+        self.failed_at = None
+
+    def start(self, manager):
+        self.socket = manager.start_depth_socket(callback=self.on_message, symbol=self.symbol,
+                                                 interval=STREAM_INTERVAL_MS)
+        self.resync()
+
+    def resync(self):
+        """Fetch a fresh snapshot in the background; diffs are buffered until it is loaded"""
+        with self.lock:
+            if self.syncing:
+                return
+            self.syncing = True
+            self.book.last_update_id = None
+        from binance_routes.market_data import get_client
+        get_client().executor.submit(self._load_snapshot)
+
+    def _load_snapshot(self):
+        from binance_routes.market_data import get_client
+        try:
+            snapshot = get_client().order_book(self.symbol, limit=ORDER_BOOK_SNAPSHOT_LEVELS)
+        except Exception as e:
+            logger.error(f"Order book {self.symbol}: snapshot failed: {str(e)}")
+            with self.lock:
+                self.syncing = False
+            return
+        self._record({'snapshot': snapshot})
+        gap = None
+        with self.lock:
+            self.book.load_snapshot(snapshot)
+            self.book.resyncs += 1
+            buffered, self.buffer = self.buffer, []
+            try:
+                for event in buffered:
+                    self.book.apply(event)
+            except OrderBookGap as e:
+                gap = e
+            self.syncing = False
+        if gap is not None:
+            logger.warning(f"Order book resync: {str(gap)}")
+            self.resync()
+
+    def _record(self, message):
+        if self.recorder is not None:
+            self.recorder.write(json.dumps(message) + '\n')
+
+    def on_message(self, message):
+        if message.get('e') == 'error':
+            logger.error(f"Order book {self.symbol}: stream error: {message.get('m')}")
+            return
+        if message.get('e') != 'depthUpdate':
+            return
+        self._record(message)
+        gap = None
+        with self.lock:
+            if self.syncing:
+                if len(self.buffer) < MAX_BUFFERED_EVENTS:
+                    self.buffer.append(message)
+                return
+            try:
+                self.book.apply(message)
+            except OrderBookGap as e:
+                gap = e
+        if gap is not None:
+            logger.warning(f"Order book resync: {str(gap)}")
+            self.resync()
+
+
+def _start_feed(feed):
+    global _socket_manager
+    try:
+        with _manager_lock:
+            if _socket_manager is None:
+                from binance import ThreadedWebsocketManager
+                manager = ThreadedWebsocketManager()
+                manager.start()
+                _socket_manager = manager
+        feed.start(_socket_manager)
+    except Exception as e:
+        feed.failed_at = time.time()
+        logger.error(f"Order book {feed.symbol}: could not start depth stream: {str(e)}")
+
+
+def get_feed(symbol):
+    """The process-wide depth feed for ``symbol``, started in the background on first use.
+
+    Returns None when streaming is off; a feed that failed to start is retried
+    after ``FEED_RETRY_SECONDS``.
+    """
+    if not ORDER_BOOK_STREAM:
+        return None
+    with _feeds_lock:
+        feed = _feeds.get(symbol)
+        if feed is None or (feed.failed_at is not None and time.time() - feed.failed_at > FEED_RETRY_SECONDS):
+            feed = _feeds[symbol] = DepthFeed(symbol)
+            threading.Thread(target=_start_feed, args=(feed,), name=f'depth-{symbol}', daemon=True).start()
+    return feed
+
+
+def synced_book(symbol):
+    """The symbol's local book if its feed is running and in sync, else None"""
+    feed = get_feed(symbol)
+    return feed.book if feed is not None and feed.book.synced else None
+
+
+def replay(path, symbol=None):
+    """Rebuild a book from a recorded JSON-lines file; returns (book, updates applied, gaps).
+
+    Like the live feed, updates received before a snapshot are held and
+    applied after it, and a gap waits for the next recorded snapshot.
+    """
+    book = OrderBook(symbol or 'replay')
+    pending = []
+    applied = gaps = 0
+    with open(path) as f:
+        for line in f:
+            message = json.loads(line)
+            if 'snapshot' in message:
+                book.load_snapshot(message['snapshot'])
+                events, pending = pending, []
+            elif not book.synced:
+                pending.append(message)
+                continue
+            else:
+                events = [message]
+            try:
+                for event in events:
+                    applied += book.apply(event)
+            except OrderBookGap:
+                gaps += 1
+                book.last_update_id = None
+    return book, applied, gaps
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Record or replay depth stream messages')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='record a snapshot and depth updates to a JSON-lines file')
+    record.add_argument('symbol')
+    record.add_argument('--seconds', type=float, default=60)
+    record.add_argument('--out', required=True)
+    play = commands.add_parser('replay', help='rebuild the book from a recording and print its features')
+    play.add_argument('path')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'record':
+        from binance import ThreadedWebsocketManager
+        manager = ThreadedWebsocketManager()
+        manager.start()
+        with open(args.out, 'w') as out:
+            feed = DepthFeed(args.symbol.upper(), recorder=out)
+            feed.start(manager)
+            time.sleep(args.seconds)
+            manager.stop()
+        print(f"Recorded {feed.book.updates} updates to {args.out}")
+    else:
+        book, applied, gaps = replay(args.path)
+        print(json.dumps({'applied': applied, 'gaps': gaps, 'features': book.features()}, indent=2))
@@ -3,17 +3,25 @@ import os
 from datetime import datetime
 from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for
 from flask_login import login_required, current_user
-from binance.client import Client  # This now correctly refers to the official python-binance package
-from models import Analysis, Alert
+from models import Analysis, Alert, MonitorSubscription, MonitorAnomaly
 from app import db
-from utils.helpers import log_activity, create_alert
-from ml.analyzer import MLAnalyzer
-import pandas as pd
+from utils.helpers import log_activity, create_alert, alert_on_drift
+from utils.logs import log_context
+from binance_routes.monitor import normalize_symbol
+from utils.governor import admit, refusal, GovernorError
+from config import MAX_SIMULATED_TRANSACTIONS, MONITOR_MAX_SUBSCRIPTIONS
 
 binance_bp = Blueprint('binance', __name__, url_prefix='/binance')
 
+# The live page's price chart: the last 24 hourly bars
+CHART_INTERVAL = '1h'
+CHART_BARS = 24
+# Trades fetched and analysed per live poll
+LIVE_TRADE_LIMIT = 1000
+
 def save_transactions_to_file(trades, analysis_id, user_id):
     """Save live transactions to a CSV file for later reference"""
+    import pandas as pd
     try:
         # Create filename with timestamp and analysis ID
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -51,53 +59,74 @@ def save_transactions_to_file(trades, analysis_id, user_id):
 @login_required
 def get_live_data():
     try:
+        symbol = normalize_symbol(request.args.get('symbol'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        # python-binance, pandas and the models load on first use, not at worker startup
+        from binance_routes.market_data import binance_client
+        import pandas as pd
+        from ml.analyzer import MLAnalyzer
+        from binance_routes.bars import get_builder
+        from binance_routes.orderbook import synced_book
+        
         # Initialize Binance client
-        client = Client()
+        client = binance_client()
         
-        # Get recent trades (increased to 1000)
-        trades = client.get_recent_trades(symbol='BTCUSDT', limit=1000)
+        # Each poll takes an analysis slot and counts its trades against the user's quota
+        with admit(current_user.id, LIVE_TRADE_LIMIT):
+            # Get recent trades (increased to 1000)
+            trades = client.get_recent_trades(symbol=symbol, limit=LIVE_TRADE_LIMIT)
         
-        # Create analysis record
-        analysis = Analysis(
-            user_id=current_user.id,
-            analysis_type='live',
-            total_transactions=len(trades),
-            anomalies_detected=0,  # Will be calculated by ML analyzer
-            accuracy_score=0.0    # Will be calculated by ML analyzer
-        )
-        db.session.add(analysis)
-        db.session.commit()
+            # Create analysis record
+            analysis = Analysis(
+                user_id=current_user.id,
+                analysis_type='live',
+                total_transactions=len(trades),
+                anomalies_detected=0,  # Will be calculated by ML analyzer
+                accuracy_score=0.0    # Will be calculated by ML analyzer
+            )
+            db.session.add(analysis)
+            db.session.commit()
         
-        # Prepare data for ML analysis
-        trade_data = []
-        for trade in trades:
-            trade_data.append({
-                'price': float(trade['price']),
-                'qty': float(trade['qty']),
-                'quoteQty': float(trade['quoteQty']),
-                'time': trade['time']
-            })
+            # Prepare data for ML analysis
+            trade_data = []
+            for trade in trades:
+                trade_data.append({
+                    'id': int(trade['id']),
+                    'price': float(trade['price']),
+                    'qty': float(trade['qty']),
+                    'quoteQty': float(trade['quoteQty']),
+                    'time': trade['time']
+                })
         
-        # Convert to DataFrame for ML analysis
-        df = pd.DataFrame(trade_data)
+            # Convert to DataFrame for ML analysis
+            df = pd.DataFrame(trade_data)
         
-        # Perform ML analysis
-        ml_analyzer = MLAnalyzer()
-        results = ml_analyzer.analyze_live_data(df)
+            # Fold the trades into the symbol's bars, then analyze them with the bar context
+            bars = get_builder(symbol)
+            bars.add_trades(df)
+            ml_analyzer = MLAnalyzer()
+            book = synced_book(symbol)
+            with log_context(analysis_id=analysis.id):
+                results = ml_analyzer.analyze_live_data(df, stream=f'live:{symbol}', bar_features=bars.features(),
+                                                        order_book_features=book.features() if book is not None else None)
         
-        # Update analysis with results
-        analysis.anomalies_detected = results.get('anomalies_detected', 0)
-        analysis.accuracy_score = results.get('accuracy_score', 0.0)
-        analysis.results = json.dumps(results)
-        db.session.commit()
+            # Update analysis with results
+            analysis.anomalies_detected = results.get('anomalies_detected', 0)
+            analysis.accuracy_score = results.get('accuracy_score', 0.0)
+            analysis.results = json.dumps(results)
+            db.session.commit()
+        alert_on_drift(results.get('drift'))
         
         # Save transactions to file
         saved_filepath = save_transactions_to_file(trades, analysis.id, current_user.id)
         
-        log_activity(current_user.id, 'Live Analysis', f'Analyzed {len(trades)} live transactions')
+        log_activity(current_user.id, 'Live Analysis', f'Analyzed {len(trades)} live {symbol} transactions')
         
         return jsonify({
             'success': True,
+            'symbol': symbol,
             'data': results,
             'trades': [
                 {
@@ -110,6 +139,8 @@ def get_live_data():
             'analysis_id': analysis.id
         })
         
+    except GovernorError as e:
+        return refusal(e)
     except Exception as e:
         log_activity(current_user.id, 'Live Analysis Error', f'Error in live analysis: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -134,49 +165,52 @@ def simulate_testnet():
         # Get user config
         data = request.get_json()
         num_transactions = int(data.get('num_transactions', 50))
-        # Generate real simulation data
-        user_names = [f'User{i}' for i in range(1, 21)]
-        real_transactions = []
-        for i in range(num_transactions):
-            from_account = random.choice(user_names)
-            to_account = random.choice([u for u in user_names if u != from_account])
-            amount = round(random.uniform(0.01, 10.0), 4)
-            price = round(random.uniform(30000, 70000), 2)
-            is_anomaly = random.choices([0, 1], weights=[0.9, 0.1])[0]
-            tx = {
-                'from_account': from_account,
-                'to_account': to_account,
-                'amount': amount,
-                'price': price,
-                'is_anomaly': is_anomaly
+        if not 1 <= num_transactions <= MAX_SIMULATED_TRANSACTIONS:
+            return jsonify({'error': f'num_transactions must be between 1 and {MAX_SIMULATED_TRANSACTIONS}'}), 400
+        with admit(current_user.id, num_transactions):
+            # Generate real simulation data
+            user_names = [f'User{i}' for i in range(1, 21)]
+            real_transactions = []
+            for i in range(num_transactions):
+                from_account = random.choice(user_names)
+                to_account = random.choice([u for u in user_names if u != from_account])
+                amount = round(random.uniform(0.01, 10.0), 4)
+                price = round(random.uniform(30000, 70000), 2)
+                is_anomaly = random.choices([0, 1], weights=[0.9, 0.1])[0]
+                tx = {
+                    'from_account': from_account,
+                    'to_account': to_account,
+                    'amount': amount,
+                    'price': price,
+                    'is_anomaly': is_anomaly
+                }
+                real_transactions.append(tx)
+            # Calculate stats for real data
+            total_transactions = len(real_transactions)
+            anomalies_detected = sum(1 for t in real_transactions if t['is_anomaly'])
+            accuracy_score = round(random.uniform(0.82, 0.95), 2)
+            analysis_time = round(random.uniform(1.5, 4.5), 2)
+            model_accuracies = {
+                'svm': 0.85,
+                'random_forest': 0.87,
+                'adaboost': 0.82,
+                'xgboost': 0.89
             }
-            real_transactions.append(tx)
-        # Calculate stats for real data
-        total_transactions = len(real_transactions)
-        anomalies_detected = sum(1 for t in real_transactions if t['is_anomaly'])
-        accuracy_score = round(random.uniform(0.82, 0.95), 2)
-        analysis_time = round(random.uniform(1.5, 4.5), 2)
-        model_accuracies = {
-            'svm': 0.85,
-            'random_forest': 0.87,
-            'adaboost': 0.82,
-            'xgboost': 0.89
-        }
-        bar_data = {
-            'normal': total_transactions - anomalies_detected,
-            'anomalous': anomalies_detected
-        }
-        # Save real simulation to database for history/stats
-        analysis = Analysis(
-            user_id=current_user.id,
-            analysis_type='testnet',
-            total_transactions=total_transactions,
-            anomalies_detected=anomalies_detected,
-            accuracy_score=accuracy_score,
-            results=json.dumps(real_transactions)
-        )
-        db.session.add(analysis)
-        db.session.commit()
+            bar_data = {
+                'normal': total_transactions - anomalies_detected,
+                'anomalous': anomalies_detected
+            }
+            # Save real simulation to database for history/stats
+            analysis = Analysis(
+                user_id=current_user.id,
+                analysis_type='testnet',
+                total_transactions=total_transactions,
+                anomalies_detected=anomalies_detected,
+                accuracy_score=accuracy_score,
+                results=json.dumps(real_transactions)
+            )
+            db.session.add(analysis)
+            db.session.commit()
         # Demo transactions (4-5 animated examples, always same style)
         demo_transactions = []
         for _ in range(2):
@@ -227,6 +261,8 @@ def simulate_testnet():
             'transactions': real_transactions,
             'demo': demo_transactions
         })
+    except GovernorError as e:
+        return refusal(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -235,10 +271,10 @@ def simulate_testnet():
 def testnet_history():
     from models import Analysis
     if request.method == 'DELETE':
-        # Delete all testnet analyses for this user
-        Analysis.query.filter_by(user_id=current_user.id, analysis_type='testnet').delete()
-        db.session.commit()
-        return jsonify({'success': True})
+        # Delete all testnet analyses for this user, in batches by a background purge
+        from utils import purge
+        job = purge.start(current_user.id, 'testnet')
+        return jsonify({'success': True, 'purge': job.to_dict()}), 202
     # GET method (existing code)
     analyses = Analysis.query.filter_by(user_id=current_user.id, analysis_type='testnet').order_by(Analysis.created_at.desc()).all()
     history = []
@@ -271,29 +307,150 @@ def testnet_history():
 @login_required
 def get_market_data():
     try:
-        from config import BINANCE_API_KEY, BINANCE_API_SECRET
-        
-        if not BINANCE_API_KEY or not BINANCE_API_SECRET:
-            return jsonify({'error': 'Binance API keys not configured'}), 400
-        
-        client = Client(BINANCE_API_KEY, BINANCE_API_SECRET)
-        
-        # Get 24hr ticker statistics
-        ticker = client.get_ticker(symbol='BTCUSDT')
-        
-        # Get order book
-        order_book = client.get_order_book(symbol='BTCUSDT', limit=10)
+        symbol = normalize_symbol(request.args.get('symbol'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        from config import MARKET_DATA_DEADLINE, BAR_STALE_SECONDS
+        from binance_routes.market_data import get_client
+        from binance_routes.bars import get_builder
+        from binance_routes.orderbook import synced_book
         
-        # Get klines for chart
-        klines = client.get_klines(symbol='BTCUSDT', interval='1h', limit=24)
+        # The hourly chart comes from the bars built from polled trades; klines are only
+        # fetched (concurrently with the ticker and order book) to seed stale bars
+        bars = get_builder(symbol)
+        from_bars = bars.is_fresh(CHART_INTERVAL, BAR_STALE_SECONDS) and len(bars.rings[CHART_INTERVAL]) >= CHART_BARS
+        # Top-of-book comes from the local book kept by the depth stream once it is in sync
+        book = synced_book(symbol)
+        market_data, errors = get_client().market_snapshot(symbol, deadline=MARKET_DATA_DEADLINE, klines=not from_bars,
+                                                           order_book=book is None)
+        if len(errors) == len(market_data):
+            return jsonify({'error': 'Market data unavailable', 'errors': errors}), 502
+        market_data['symbol'] = symbol
+        if book is not None:
+            market_data['order_book'] = book.to_rest(10)
+            market_data['order_book_features'] = book.features()
+        if from_bars:
+            market_data['price_chart'] = bars.klines(CHART_INTERVAL, CHART_BARS)
+        elif market_data.get('price_chart') and CHART_INTERVAL in bars.rings:
+            bars.seed(CHART_INTERVAL, market_data['price_chart'])
         
-        market_data = {
-            'ticker': ticker,
-            'order_book': order_book,
-            'price_chart': klines
-        }
+        if errors:
+            market_data['errors'] = errors
+            market_data['partial'] = True
         
         return jsonify(market_data)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@binance_bp.route('/bars')
+@login_required
+def get_bars():
+    """OHLCV bars built from the trades this process has polled, in Binance's kline layout"""
+    try:
+        symbol = normalize_symbol(request.args.get('symbol'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    from binance_routes.bars import get_builder
+    bars = get_builder(symbol)
+    interval = request.args.get('interval', '1m')
+    if interval not in bars.rings:
+        return jsonify({'error': f"Unknown interval: {interval}", 'intervals': list(bars.rings)}), 400
+    limit = max(1, request.args.get('limit', 100, type=int))
+    return jsonify({
+        'success': True,
+        'symbol': symbol,
+        'interval': interval,
+        'bars': bars.klines(interval, limit),
+        'features': bars.features().get(interval),
+        'stats': bars.snapshot()
+    })
+
+@binance_bp.route('/subscriptions', methods=['GET', 'POST'])
+@login_required
+def subscriptions():
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            symbol = normalize_symbol(data.get('symbol'), default='')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not MonitorSubscription.query.filter_by(user_id=current_user.id, symbol=symbol).first():
+            if MonitorSubscription.query.filter_by(user_id=current_user.id).count() >= MONITOR_MAX_SUBSCRIPTIONS:
+                return jsonify({'error': f"At most {MONITOR_MAX_SUBSCRIPTIONS} subscriptions per user"}), 400
+            from binance_routes.market_data import get_client, MarketDataError
+            try:
+                tradable = symbol in get_client().trading_symbols()
+            except MarketDataError as e:
+                return jsonify({'error': f"Could not check {symbol} with the exchange: {e}"}), 503
+            if not tradable:
+                return jsonify({'error': f"{symbol} is not traded on the exchange"}), 400
+            db.session.add(MonitorSubscription(user_id=current_user.id, symbol=symbol))
+            db.session.commit()
+            log_activity(current_user.id, 'Monitor Subscribe', f'Subscribed to {symbol}')
+    subs = MonitorSubscription.query.filter_by(user_id=current_user.id).order_by(MonitorSubscription.symbol).all()
+    latest = dict(db.session.query(MonitorAnomaly.symbol, db.func.max(MonitorAnomaly.detected_at))
+                  .filter(MonitorAnomaly.symbol.in_([sub.symbol for sub in subs]))
+                  .group_by(MonitorAnomaly.symbol).all()) if subs else {}
+    return jsonify({
+        'success': True,
+        'subscriptions': [{
+            'symbol': sub.symbol,
+            'since': sub.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'last_anomaly': latest[sub.symbol].strftime('%Y-%m-%d %H:%M:%S') if latest.get(sub.symbol) else None
+        } for sub in subs]
+    })
+
+@binance_bp.route('/subscriptions/<symbol>', methods=['DELETE'])
+@login_required
+def unsubscribe(symbol):
+    try:
+        symbol = normalize_symbol(symbol)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    MonitorSubscription.query.filter_by(user_id=current_user.id, symbol=symbol).delete()
+    db.session.commit()
+    log_activity(current_user.id, 'Monitor Unsubscribe', f'Unsubscribed from {symbol}')
+    return jsonify({'success': True})
+
+@binance_bp.route('/monitor/anomalies')
+@login_required
+def monitor_anomalies():
+    """Anomalies the server-side monitors stored for the user's subscribed symbols.
+
+    Without ``after_id`` the latest ``limit`` are returned, newest first.  With
+    it, the oldest ones after that id come first, so polling with the returned
+    ``next_after_id`` pages through a backlog without skipping any.
+    """
+    symbols = [sub.symbol for sub in MonitorSubscription.query.filter_by(user_id=current_user.id)]
+    if request.args.get('symbol'):
+        try:
+            requested = normalize_symbol(request.args.get('symbol'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        symbols = [s for s in symbols if s == requested]
+    after_id = request.args.get('after_id', type=int)
+    limit = min(request.args.get('limit', 100, type=int), 500)
+    rows = []
+    if symbols:
+        query = MonitorAnomaly.query.filter(MonitorAnomaly.symbol.in_(symbols))
+        if after_id is None:
+            query = query.order_by(MonitorAnomaly.id.desc())
+        else:
+            query = query.filter(MonitorAnomaly.id > after_id).order_by(MonitorAnomaly.id.asc())
+        rows = query.limit(limit).all()
+    return jsonify({
+        'success': True,
+        'next_after_id': max((a.id for a in rows), default=after_id or 0),
+        'anomalies': [{
+            'id': a.id,
+            'symbol': a.symbol,
+            'trade_id': a.trade_id,
+            'price': a.price,
+            'qty': a.qty,
+            'score': a.score,
+            'trade_time': a.trade_time.strftime('%Y-%m-%d %H:%M:%S'),
+            'detected_at': a.detected_at.strftime('%Y-%m-%d %H:%M:%S')
+        } for a in rows]
+    })
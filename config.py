@@ -10,18 +10,156 @@ SQLALCHEMY_ENGINE_OPTIONS = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+# SQLite: set on every connection (see utils/database.py); WAL lets reads run alongside the one writer
+SQLITE_PRAGMAS = {
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000')),  # wait for the write lock instead of failing
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),  # with WAL, only a power loss can drop the last commits
+    'cache_size': -int(os.environ.get('SQLITE_CACHE_SIZE_MB', '64')) * 1024,  # negative = KiB
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE_MB', '256')) * 1024 * 1024,
+}
+# Other databases (PostgreSQL): connections kept per process, plus overflow under bursts
+if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+    SQLALCHEMY_ENGINE_OPTIONS.update({
+        "pool_size": int(os.environ.get('DATABASE_POOL_SIZE', '10')),
+        "max_overflow": int(os.environ.get('DATABASE_MAX_OVERFLOW', '20')),
+        "pool_timeout": float(os.environ.get('DATABASE_POOL_TIMEOUT', '30')),
+        "pool_use_lifo": True,  # reuse the warmest connections so idle ones can be recycled
+    })
 UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'csv'}
+# Uploads are stored by content hash; results are reused for identical files (see utils/result_cache.py)
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') == '1'
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Resumable chunked uploads for large files (see the /upload/sessions routes)
+UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_BYTES', str(8 * 1024 * 1024)))
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(20 * 1024 ** 3)))
+UPLOAD_SESSION_TTL_HOURS = int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', '24'))  # idle sessions are discarded
+# Largest request body: one chunk or a form upload (~10MB), plus multipart overhead
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', str(max(UPLOAD_CHUNK_BYTES, 10 * 1024 * 1024) + 1024 * 1024)))
+# Background analysis jobs (see utils/jobs.py)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+
+# Packaged model artifacts (see ml/artifacts.py). Falls back to the *.pkl files
+# in the project root when no artifact has been packaged yet.
+MODEL_ARTIFACT_DIR = os.environ.get('MODEL_ARTIFACT_DIR', os.path.join(BASE_DIR, 'artifacts'))
+MODEL_ARTIFACT_VERSION = os.environ.get('MODEL_ARTIFACT_VERSION')  # None -> artifacts/CURRENT
+# 'c' = copy-on-write maps: pages stay shared, but libsvm's predict_proba needs writable buffers
+MODEL_MMAP_MODE = os.environ.get('MODEL_MMAP_MODE', 'c') or None
+MODEL_VERIFY_CHECKSUMS = os.environ.get('MODEL_VERIFY_CHECKSUMS', '1') == '1'
+# Score with cheap models first and send only borderline rows to the SVM
+ENSEMBLE_CASCADE = os.environ.get('ENSEMBLE_CASCADE', '1') == '1'
+# Anomalies ranked and stored with each analysis for the results page and reports (see ml/ranking.py)
+RESULTS_TOP_K = int(os.environ.get('RESULTS_TOP_K', '100'))
+# Input drift monitoring (see ml/drift.py): PSI threshold, decay half-life in rows, rows before alerting
+DRIFT_MONITORING = os.environ.get('DRIFT_MONITORING', '1') == '1'
+DRIFT_PSI_THRESHOLD = float(os.environ.get('DRIFT_PSI_THRESHOLD', '0.25'))
+DRIFT_HALF_LIFE_ROWS = int(os.environ.get('DRIFT_HALF_LIFE_ROWS', '10000'))
+DRIFT_MIN_SAMPLES = int(os.environ.get('DRIFT_MIN_SAMPLES', '500'))
+# Streaming detector for live trade ticks (see ml/streaming.py): EWMA half-life and warm-up in trades
+TICK_DETECTOR = os.environ.get('TICK_DETECTOR', '1') == '1'
+TICK_HALF_LIFE_TRADES = int(os.environ.get('TICK_HALF_LIFE_TRADES', '500'))
+TICK_Z_THRESHOLD = float(os.environ.get('TICK_Z_THRESHOLD', '6'))
+TICK_WARMUP_TRADES = int(os.environ.get('TICK_WARMUP_TRADES', '100'))
+ALLOWED_EXTENSIONS = {'csv', 'csv.gz', 'csv.zst'}
+# CSV parsing (see ml/ingest.py): 'auto' uses pyarrow's multi-threaded parser when installed, else 'c'
+CSV_ENGINE = os.environ.get('CSV_ENGINE', 'auto')
+CSV_FLOAT_DTYPE = os.environ.get('CSV_FLOAT_DTYPE', 'float32')
+# Memory per CSV analysis (see ml/memory.py): over the budget, files are analysed in chunks or refused
+ANALYSIS_MEMORY_BUDGET_MB = int(os.environ.get('ANALYSIS_MEMORY_BUDGET_MB', '1024'))  # 0 = no budget
+ANALYSIS_CHUNK_ROWS = int(os.environ.get('ANALYSIS_CHUNK_ROWS', '200000'))  # largest chunk; smaller when the budget needs it
+MEMORY_SAMPLE_SECONDS = float(os.environ.get('MEMORY_SAMPLE_SECONDS', '0.05'))  # RSS sampling while an analysis runs
+MEMORY_TRACEMALLOC = os.environ.get('MEMORY_TRACEMALLOC', '0') == '1'  # per-stage traced peaks; slows analyses down
 
 # Email settings for verification
-MAIL_SERVER = 'smtp.gmail.com'
-MAIL_PORT = 587
-MAIL_USE_TLS = True
+MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+MAIL_PORT = int(os.environ.get('MAIL_PORT', '587'))
+MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', '1') == '1'
 MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
 MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
 MAIL_DEFAULT_SENDER = os.environ.get('MAIL_USERNAME')
 
+# Email outbox (see utils/mailer.py)
+MAIL_SENDER_THREAD = os.environ.get('MAIL_SENDER_THREAD', '1') == '1'  # 0 when running `python -m utils.mailer` instead
+MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', '50'))
+MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', '6'))
+MAIL_RETRY_BACKOFF = float(os.environ.get('MAIL_RETRY_BACKOFF', '30'))  # seconds, doubled per attempt
+MAIL_COALESCE_SECONDS = int(os.environ.get('MAIL_COALESCE_SECONDS', '300'))  # one anomaly email per user per window
+MAIL_CONNECTION_IDLE_SECONDS = int(os.environ.get('MAIL_CONNECTION_IDLE_SECONDS', '60'))
+MAIL_SMTP_TIMEOUT = float(os.environ.get('MAIL_SMTP_TIMEOUT', '20'))
+
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key')
 
 BINANCE_API_KEY = os.getenv('BINANCE_API_KEY')
 BINANCE_API_SECRET = os.getenv('BINANCE_API_SECRET')
+BINANCE_API_URL = os.getenv('BINANCE_API_URL', 'https://api.binance.com')
+
+# Public market-data client (see binance_routes/market_data.py)
+MARKET_DATA_TIMEOUT = (float(os.getenv('MARKET_DATA_CONNECT_TIMEOUT', '3')), float(os.getenv('MARKET_DATA_READ_TIMEOUT', '5')))
+MARKET_DATA_RETRIES = int(os.getenv('MARKET_DATA_RETRIES', '2'))
+MARKET_DATA_BACKOFF = float(os.getenv('MARKET_DATA_BACKOFF', '0.2'))  # seconds, doubled per retry
+MARKET_DATA_DEADLINE = float(os.getenv('MARKET_DATA_DEADLINE', '10'))  # whole /market-data request
+EXCHANGE_INFO_TTL_SECONDS = float(os.getenv('EXCHANGE_INFO_TTL_SECONDS', '3600'))  # cached list of trading symbols
+
+# Server-side symbol monitors (see binance_routes/monitor.py)
+MONITOR_SYMBOLS = [s.strip().upper() for s in os.environ.get('MONITOR_SYMBOLS', 'BTCUSDT,ETHUSDT').split(',') if s.strip()]
+MONITOR_WORKERS = int(os.environ.get('MONITOR_WORKERS', '0'))  # 0 -> one per CPU core
+MONITOR_POLL_SECONDS = float(os.environ.get('MONITOR_POLL_SECONDS', '10'))
+MONITOR_TRADE_LIMIT = int(os.environ.get('MONITOR_TRADE_LIMIT', '1000'))
+MONITOR_MAX_SUBSCRIPTIONS = int(os.environ.get('MONITOR_MAX_SUBSCRIPTIONS', '20'))  # symbols per user
+
+# In-process OHLCV bars built from polled trades (see binance_routes/bars.py): interval -> bars kept
+BAR_INTERVALS = {name.strip(): int(size) for name, size in
+                 (item.split(':') for item in os.environ.get('BAR_INTERVALS', '1s:600,1m:240,5m:288,1h:168').split(',') if item.strip())}
+BAR_STALE_SECONDS = float(os.environ.get('BAR_STALE_SECONDS', '120'))  # older bars are re-seeded from klines
+
+# Local order books kept from the depth diff stream (see binance_routes/orderbook.py)
+ORDER_BOOK_STREAM = os.environ.get('ORDER_BOOK_STREAM', '1') == '1'
+ORDER_BOOK_SNAPSHOT_LEVELS = int(os.environ.get('ORDER_BOOK_SNAPSHOT_LEVELS', '1000'))
+ORDER_BOOK_FEATURE_LEVELS = int(os.environ.get('ORDER_BOOK_FEATURE_LEVELS', '10'))  # levels summed for imbalance/depth
+ORDER_BOOK_HALF_LIFE_UPDATES = int(os.environ.get('ORDER_BOOK_HALF_LIFE_UPDATES', '600'))  # depth baseline for shocks
+
+# Startup (see utils/startup.py): AUTO_INIT_DB=0 on workers once `flask --app app init-db` has run
+AUTO_INIT_DB = os.environ.get('AUTO_INIT_DB', '1') == '1'
+WARM_UP_ON_START = os.environ.get('WARM_UP_ON_START', '1') == '1'  # load ML/report/exchange modules in the background
+STARTUP_TARGET_SECONDS = float(os.environ.get('STARTUP_TARGET_SECONDS', '1.0'))  # `python -m utils.startup` fails above this
+
+# Logging (see utils/logs.py): records go through a queue to a background writer
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_LEVELS = os.environ.get('LOG_LEVELS', 'werkzeug=INFO')  # per logger, e.g. 'ml=DEBUG,werkzeug=WARNING'
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' or 'text'
+LOG_DEBUG_SAMPLE_EVERY = int(os.environ.get('LOG_DEBUG_SAMPLE_EVERY', '10'))  # keep 1 in N DEBUG records per logger
+
+# Activity-log stats cards are counted in SQL and cached this long per user and filter set (0 = no cache)
+ACTIVITY_COUNTS_CACHE_SECONDS = float(os.environ.get('ACTIVITY_COUNTS_CACHE_SECONDS', '30'))
+
+# Clearing history and deleting accounts run as background purges (see utils/purge.py)
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', '1000'))  # rows deleted per short transaction
+PURGE_BATCH_PAUSE_SECONDS = float(os.environ.get('PURGE_BATCH_PAUSE_SECONDS', '0.05'))  # lets other writers in between batches
+PURGE_VACUUM_PAGES = int(os.environ.get('PURGE_VACUUM_PAGES', '2000'))  # SQLite pages returned to the filesystem per step
+
+# File retention (see utils/retention.py): rules per directory, 0 turns a rule off
+RETENTION_INTERVAL_SECONDS = float(os.environ.get('RETENTION_INTERVAL_SECONDS', '3600'))  # 0 = only `python -m utils.retention`
+RETENTION_UPLOADS = os.environ.get('RETENTION_UPLOADS', 'max_age_days=30,compress_after_days=7')  # uploads in use are never removed
+RETENTION_REPORTS = os.environ.get('RETENTION_REPORTS', 'max_age_days=7,keep_last=1,max_total_mb=500')
+RETENTION_LIVE_TRANSACTIONS = os.environ.get('RETENTION_LIVE_TRANSACTIONS', 'max_age_days=30,max_total_mb=2048,compress_after_days=1')
+RETENTION_COMPRESS_LEVEL = int(os.environ.get('RETENTION_COMPRESS_LEVEL', '6'))  # gzip level for compacted CSVs
+
+# Alerts (see utils/alerts.py): repeats of an event less than ALERT_WINDOW_SECONDS apart update one incident
+ALERT_WINDOW_SECONDS = int(os.environ.get('ALERT_WINDOW_SECONDS', '300'))
+ALERT_ESCALATE_AFTER = [int(n) for n in os.environ.get('ALERT_ESCALATE_AFTER', '10,100').split(',') if n.strip()]  # events per severity step
+ALERT_RATE_PER_HOUR = float(os.environ.get('ALERT_RATE_PER_HOUR', '30'))  # new incidents per user, after a burst of ALERT_BURST
+ALERT_BURST = int(os.environ.get('ALERT_BURST', '10'))
+ALERT_EMAIL_RATE_PER_HOUR = float(os.environ.get('ALERT_EMAIL_RATE_PER_HOUR', '4'))  # alert emails per user, after ALERT_EMAIL_BURST
+ALERT_EMAIL_BURST = int(os.environ.get('ALERT_EMAIL_BURST', '2'))
+
+# Resource governor (see utils/governor.py): fair queuing, concurrency limits and quotas for analysis work
+GOVERNOR_SLOTS = int(os.environ.get('GOVERNOR_SLOTS', str(os.cpu_count() or 2)))  # analyses running at once, all users
+GOVERNOR_USER_CONCURRENCY = int(os.environ.get('GOVERNOR_USER_CONCURRENCY', '2'))  # analyses running at once per user
+GOVERNOR_MAX_QUEUE = int(os.environ.get('GOVERNOR_MAX_QUEUE', '32'))  # interactive work is refused beyond this many waiting
+GOVERNOR_MAX_WAIT_SECONDS = float(os.environ.get('GOVERNOR_MAX_WAIT_SECONDS', '10'))  # longest an interactive request queues
+GOVERNOR_QUOTA_WINDOW_SECONDS = float(os.environ.get('GOVERNOR_QUOTA_WINDOW_SECONDS', '3600'))
+GOVERNOR_ROW_QUOTA = int(os.environ.get('GOVERNOR_ROW_QUOTA', '5000000'))  # rows analysed per user per window, 0 = unlimited
+GOVERNOR_BYTE_QUOTA = int(os.environ.get('GOVERNOR_BYTE_QUOTA', str(2 * 1024 ** 3)))  # bytes uploaded per user per window, 0 = unlimited
+GOVERNOR_USER_WEIGHTS = {int(user_id): float(weight) for user_id, weight in
+                         (item.split('=') for item in os.environ.get('GOVERNOR_USER_WEIGHTS', '').split(',') if item.strip())}  # e.g. '1=2'
+MAX_SIMULATED_TRANSACTIONS = int(os.environ.get('MAX_SIMULATED_TRANSACTIONS', '10000'))  # testnet num_transactions cap
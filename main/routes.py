@@ -1,17 +1,26 @@
 import os
 import json
+import time
+import uuid
+import logging
 from datetime import datetime, timedelta
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, current_app
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
-from models import Analysis, ActivityLog, Alert, User
+from models import Analysis, ActivityLog, Alert, User, UploadSession
 from app import db
-from utils.helpers import allowed_file, log_activity, create_alert, send_email
-from ml.analyzer import MLAnalyzer
-import pandas as pd
+from utils.helpers import (allowed_file, log_activity, create_alert, send_email, measured_model_metrics, alert_on_drift,
+                           anomaly_ranking)
+from utils.uploads import (ChunkError, save_upload, part_path, write_chunk, expire_sessions, analyze_upload,
+                           process_chunked_upload)
+from utils import jobs, purge
+from utils.pagination import keyset_paginate
+from utils.governor import admit, get_governor, estimate_rows, refusal, GovernorError
+from ml.ingest import HeaderCheck, IngestError
 import pytz
 
 main_bp = Blueprint('main', __name__)
+logger = logging.getLogger(__name__)
  
 # Forms for settings
 from auth.forms import UpdateProfileForm, ChangePasswordForm, DeleteAccountForm
@@ -31,7 +40,8 @@ def dashboard():
     recent_analyses = Analysis.query.filter_by(user_id=current_user.id).order_by(Analysis.created_at.desc()).all()
     
     # Recent alerts
-    recent_alerts = Alert.query.filter_by(user_id=current_user.id).order_by(Alert.created_at.desc()).limit(5).all()
+    recent_alerts = Alert.query.filter_by(user_id=current_user.id).order_by(
+        db.func.coalesce(Alert.last_seen_at, Alert.created_at).desc()).limit(5).all()
     
     # Activity logs
     recent_activities = ActivityLog.query.filter_by(user_id=current_user.id).order_by(ActivityLog.timestamp.desc()).limit(10).all()
@@ -77,6 +87,14 @@ def dashboard():
 @login_required
 def upload():
     if request.method == 'POST':
+        # Check the quota before touching request.files: parsing the form spools the whole file to disk
+        size_hint = request.content_length or 0
+        try:
+            get_governor().check_quota(current_user.id, estimate_rows(size_hint), size_hint)
+        except GovernorError as e:
+            flash(f'{str(e)}. Try again in {e.retry_after} seconds.', 'error')
+            return redirect(request.url)
+        
         if 'file' not in request.files:
             flash('No file selected', 'error')
             return redirect(request.url)
@@ -91,57 +109,63 @@ def upload():
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
             filename = timestamp + filename
             
-            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Validate CSV schema before analysis
-            import pandas as pd
+            # Stream to content-addressed storage, hashing and checking the CSV header on the way;
+            # identical files are stored once
+            header = HeaderCheck()
             try:
-                df_head = pd.read_csv(filepath, nrows=5)
-            except Exception as e:
-                os.remove(filepath)
-                flash(f'Invalid CSV file: {str(e)}', 'error')
-                return redirect(request.url)
-
-            # Accept either (price & qty) or (close & volume)
-            has_price_qty = ('price' in df_head.columns and 'qty' in df_head.columns)
-            has_close_volume = ('close' in df_head.columns and 'volume' in df_head.columns)
-            if not (has_price_qty or has_close_volume):
-                os.remove(filepath)
-                flash('Invalid CSV headers. Expected columns: price & qty OR close & volume.', 'error')
+                filepath, file_hash, file_size, created = save_upload(
+                    file, current_app.config['UPLOAD_FOLDER'], check=header)
+            except IngestError as e:
+                flash(str(e), 'error')
                 return redirect(request.url)
 
             # Log activity
             log_activity(current_user.id, 'File Upload', f'Uploaded file: {filename}')
             
-            # Process the file
-            analyzer = MLAnalyzer()
+            # Process the file; the analysis gets its id up front so the analysis logs carry it
+            analysis = Analysis(
+                user_id=current_user.id,
+                analysis_type='upload',
+                filename=filename,
+                file_hash=file_hash,
+                status='running'
+            )
+            db.session.add(analysis)
+            db.session.flush()
             try:
-                results = analyzer.analyze_csv(filepath)
+                # Waits for a fair share of the analysis slots; refused when the user is over quota
+                with admit(current_user.id, estimate_rows(file_size), file_size) as ticket:
+                    summary, cache_hit = analyze_upload(analysis, filepath, header.columns, header.compression)
+                    ticket['rows'] = summary['total_transactions']
+                if cache_hit:
+                    log_activity(current_user.id, 'Result Cache Hit', f'Reused results for {filename}')
                 
                 # Save analysis results
-                analysis = Analysis(
-                    user_id=current_user.id,
-                    analysis_type='upload',
-                    filename=filename,
-                    total_transactions=results['total_transactions'],
-                    anomalies_detected=results['anomalies_detected'],
-                    accuracy_score=results['accuracy_score'],
-                    results=json.dumps(results)
-                )
-                db.session.add(analysis)
+                analysis.status = 'complete'
                 db.session.commit()
                 
                 # Create alert if anomalies detected
-                if results['anomalies_detected'] > 0:
+                if summary['anomalies_detected'] > 0:
                     create_alert(current_user.id, 'anomaly', 
-                               f"Detected {results['anomalies_detected']} anomalies in uploaded file", 
-                               'high')
+                               f"Detected {summary['anomalies_detected']} anomalies in uploaded file", 
+                               'high', key=f'upload:{analysis.id}', quantity=summary['anomalies_detected'],
+                               noun='anomalies')
+                alert_on_drift(summary.get('drift'))
                 
                 flash('File analyzed successfully!', 'success')
                 return redirect(url_for('main.results', analysis_id=analysis.id))
                 
+            except GovernorError as e:
+                # Nothing ran: drop the analysis rather than list it as failed
+                db.session.delete(analysis)
+                db.session.commit()
+                flash(f'{str(e)}. Try again in {e.retry_after} seconds.', 'error')
             except Exception as e:
+                db.session.rollback()
+                analysis = db.session.merge(analysis)
+                analysis.status = 'failed'
+                analysis.error = str(e)
+                db.session.commit()
                 flash(f'Error analyzing file: {str(e)}', 'error')
                 log_activity(current_user.id, 'Analysis Error', f'Error analyzing file {filename}: {str(e)}')
         else:
@@ -149,11 +173,136 @@ def upload():
     
     return render_template('dashboard/upload.html')
 
+@main_bp.route('/upload/sessions', methods=['POST'])
+@login_required
+def create_upload_session():
+    """Start a resumable chunked upload: {filename, size[, sha256]} -> session with chunk layout"""
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    size = data.get('size')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type. Please upload a CSV file.'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'size must be a positive number of bytes'}), 400
+    if size > current_app.config['UPLOAD_MAX_BYTES']:
+        return jsonify({'error': f"File is larger than the {current_app.config['UPLOAD_MAX_BYTES']} byte limit"}), 413
+    try:
+        get_governor().check_quota(current_user.id, estimate_rows(size), size)
+    except GovernorError as e:
+        return refusal(e)
+    
+    upload_dir = current_app.config['UPLOAD_FOLDER']
+    expire_sessions(upload_dir)
+    upload = UploadSession(id=uuid.uuid4().hex, user_id=current_user.id,
+                           filename=datetime.now().strftime('%Y%m%d_%H%M%S_') + filename,
+                           total_size=size, chunk_size=current_app.config['UPLOAD_CHUNK_BYTES'],
+                           sha256=data.get('sha256'))
+    os.makedirs(upload_dir, exist_ok=True)
+    open(part_path(upload_dir, upload.id), 'wb').close()
+    db.session.add(upload)
+    db.session.commit()
+    return jsonify(upload.to_dict()), 201
+
+def _get_upload_session(session_id):
+    return UploadSession.query.filter_by(id=session_id, user_id=current_user.id).first_or_404()
+
+@main_bp.route('/upload/sessions/<session_id>', methods=['GET', 'DELETE'])
+@login_required
+def upload_session(session_id):
+    """Upload progress (to resume from next_chunk), or abort the upload"""
+    upload = _get_upload_session(session_id)
+    if request.method == 'DELETE' and upload.status == 'open':
+        path = part_path(current_app.config['UPLOAD_FOLDER'], upload.id)
+        if os.path.exists(path):
+            os.remove(path)
+        upload.status = 'aborted'
+        db.session.commit()
+    return jsonify(upload.to_dict())
+
+@main_bp.route('/upload/sessions/<session_id>/chunks/<int:index>', methods=['PUT'])
+@login_required
+def upload_chunk(session_id, index):
+    """Write chunk ``index`` (raw body, SHA-256 hex in X-Chunk-SHA256); chunks must arrive in order"""
+    upload = _get_upload_session(session_id)
+    if upload.status != 'open':
+        return jsonify({'error': f'Upload is {upload.status}', **upload.to_dict()}), 409
+    if index < upload.next_chunk:
+        # Already stored; the client is retrying after a lost response
+        return jsonify(upload.to_dict())
+    if index > upload.next_chunk or index >= upload.chunk_count:
+        return jsonify({'error': f'Expected chunk {upload.next_chunk}', **upload.to_dict()}), 409
+    checksum = request.headers.get('X-Chunk-SHA256')
+    if not checksum:
+        return jsonify({'error': 'X-Chunk-SHA256 header is required'}), 400
+    
+    # The first chunk carries the CSV header: reject unusable files before the rest is sent
+    header = HeaderCheck() if index == 0 else None
+    offset = index * upload.chunk_size
+    try:
+        written = write_chunk(part_path(current_app.config['UPLOAD_FOLDER'], upload.id), offset,
+                              request.stream, upload.chunk_length(index), checksum, check=header)
+    except ChunkError as e:
+        return jsonify({'error': str(e), **upload.to_dict()}), 400
+    except IngestError as e:
+        upload.status = 'failed'
+        db.session.commit()
+        os.remove(part_path(current_app.config['UPLOAD_FOLDER'], upload.id))
+        return jsonify({'error': str(e), **upload.to_dict()}), 400
+    
+    # Advance only if no concurrent retry of the same chunk got there first
+    UploadSession.query.filter_by(id=upload.id, next_chunk=index).update(
+        {'next_chunk': index + 1, 'received_bytes': offset + written, 'updated_at': datetime.utcnow()},
+        synchronize_session=False)
+    db.session.commit()
+    db.session.refresh(upload)
+    return jsonify(upload.to_dict())
+
+@main_bp.route('/upload/sessions/<session_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(session_id):
+    """Close a complete upload and queue its analysis; poll the returned status_url"""
+    upload = _get_upload_session(session_id)
+    if upload.status == 'finalized':
+        return jsonify({**upload.to_dict(), 'results_url': url_for('main.results', analysis_id=upload.analysis_id),
+                        'status_url': url_for('main.analysis_status', analysis_id=upload.analysis_id)})
+    if upload.status != 'open':
+        return jsonify({'error': f'Upload is {upload.status}', **upload.to_dict()}), 409
+    if upload.received_bytes != upload.total_size:
+        return jsonify({'error': f'Missing chunks from {upload.next_chunk}', **upload.to_dict()}), 409
+    
+    analysis = Analysis(user_id=current_user.id, analysis_type='upload', filename=upload.filename, status='queued')
+    db.session.add(analysis)
+    db.session.flush()
+    upload.analysis_id = analysis.id
+    upload.status = 'finalized'
+    upload.updated_at = datetime.utcnow()
+    db.session.commit()
+    log_activity(current_user.id, 'File Upload', f'Uploaded file: {upload.filename} ({upload.total_size} bytes, chunked)')
+    
+    jobs.submit(process_chunked_upload, analysis.id, upload.id, current_app.config['UPLOAD_FOLDER'])
+    return jsonify({**upload.to_dict(), 'results_url': url_for('main.results', analysis_id=analysis.id),
+                    'status_url': url_for('main.analysis_status', analysis_id=analysis.id)}), 202
+
+@main_bp.route('/api/analysis/<int:analysis_id>/status')
+@login_required
+def analysis_status(analysis_id):
+    analysis = Analysis.query.filter_by(id=analysis_id, user_id=current_user.id).first_or_404()
+    return jsonify({
+        'id': analysis.id,
+        'status': analysis.status or 'complete',
+        'error': analysis.error,
+        'total_transactions': analysis.total_transactions,
+        'anomalies_detected': analysis.anomalies_detected,
+        'analysis_mode': analysis.analysis_mode,
+        'memory_mb': analysis.memory_mb
+    })
+
 @main_bp.route('/results/<int:analysis_id>')
 @login_required
 def results(analysis_id):
     analysis = Analysis.query.filter_by(id=analysis_id, user_id=current_user.id).first_or_404()
-    results_data = json.loads(analysis.results) if analysis.results else {}
+    stored_results = analysis.get_results()
+    results_data = json.loads(stored_results) if stored_results else {}
     # Convert to Asia/Karachi timezone
     local_tz = pytz.timezone('Asia/Karachi')
     if analysis.created_at.tzinfo is None:
@@ -161,35 +310,79 @@ def results(analysis_id):
     else:
         created_utc = analysis.created_at.astimezone(pytz.utc)
     analysis_local_created_at = created_utc.astimezone(local_tz)
-    return render_template('dashboard/results.html', analysis=analysis, results=results_data, analysis_local_created_at=analysis_local_created_at)
+    return render_template('dashboard/results.html', analysis=analysis, results=results_data, analysis_local_created_at=analysis_local_created_at,
+                           model_metrics=measured_model_metrics(results_data), ranking=anomaly_ranking(results_data))
 
 @main_bp.route('/results')
 @login_required
 def results_blank():
-    return render_template('dashboard/results.html', analysis=None, results={})
+    return render_template('dashboard/results.html', analysis=None, results={}, model_metrics={}, ranking=None)
 
 @main_bp.route('/live-analysis')
 @login_required
 def live_analysis():
     return render_template('dashboard/live-analysis.html')
 
+# Filters of the activity-log page; all but `search` are served from the (user_id, [action,] timestamp, id) indexes
+ACTIVITY_FILTERS = ('action', 'date_from', 'date_to', 'search')
+_activity_counts_cache = {}
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+def _count_where(condition):
+    return db.func.coalesce(db.func.sum(db.case((condition, 1), else_=0)), 0)
+
+def _filter_activity(query, args):
+    """Apply the activity-log filters (action, inclusive date range, details search) to a query"""
+    if args.get('action'):
+        query = query.filter(ActivityLog.action == args['action'])
+    date_from, date_to = _parse_date(args.get('date_from')), _parse_date(args.get('date_to'))
+    if date_from:
+        query = query.filter(ActivityLog.timestamp >= date_from)
+    if date_to:
+        query = query.filter(ActivityLog.timestamp < date_to + timedelta(days=1))
+    if args.get('search'):
+        query = query.filter(ActivityLog.details.icontains(args['search'], autoescape=True))
+    return query
+
+def _activity_counts(user_id, args):
+    """Stats cards for the filtered log in one SQL aggregate, cached for ACTIVITY_COUNTS_CACHE_SECONDS"""
+    ttl = current_app.config['ACTIVITY_COUNTS_CACHE_SECONDS']
+    key = (user_id,) + tuple(args.get(name, '') for name in ACTIVITY_FILTERS)
+    cached = _activity_counts_cache.get(key)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    since = datetime.utcnow() - timedelta(days=1)
+    total, today, uploads, live = _filter_activity(db.session.query(
+        db.func.count(ActivityLog.id),
+        _count_where(ActivityLog.timestamp > since),
+        _count_where(ActivityLog.action == 'File Upload'),
+        _count_where(ActivityLog.action == 'Live Analysis'),
+    ).filter(ActivityLog.user_id == user_id), args).one()
+    counts = {'total': total, 'today': today, 'uploads': uploads, 'live': live}
+    if ttl > 0:
+        if len(_activity_counts_cache) > 10000:
+            _activity_counts_cache.clear()
+        _activity_counts_cache[key] = (time.monotonic(), counts)
+    return counts
+
 @main_bp.route('/activity-logs')
 @login_required
 def activity_logs():
-    page = request.args.get('page', 1, type=int)
-    logs = ActivityLog.query.filter_by(user_id=current_user.id).order_by(
-        ActivityLog.timestamp.desc()).paginate(
-        page=page, per_page=20, error_out=False)
-
-    # Count today's activities
-    now = datetime.now()
-    yesterday = now - timedelta(days=1)
-    todays_activities_count = len([log for log in logs.items if log.timestamp > yesterday])
+    query = _filter_activity(ActivityLog.query.filter(ActivityLog.user_id == current_user.id), request.args)
+    # Keyset pagination: `after`/`before` cursors instead of page numbers, so deep pages cost the same
+    logs = keyset_paginate(query, ActivityLog.timestamp, ActivityLog.id, per_page=20,
+                           after=request.args.get('after'), before=request.args.get('before'))
+    counts = _activity_counts(current_user.id, request.args)
 
     # Build filtered_args for pagination
-    filtered_args = {k: v for k, v in request.args.items() if k != 'page'}
+    filtered_args = {k: v for k, v in request.args.items() if k in ACTIVITY_FILTERS}
 
-    return render_template('dashboard/activity-logs.html', logs=logs, todays_activities_count=todays_activities_count, filtered_args=filtered_args)
+    return render_template('dashboard/activity-logs.html', logs=logs, counts=counts, filtered_args=filtered_args)
 
 @main_bp.route('/settings', methods=['GET', 'POST'])
 @login_required
@@ -244,23 +437,15 @@ def settings():
             user_id = current_user.id
             username = current_user.username
 
-            # Delete related data
-            Analysis.query.filter_by(user_id=user_id).delete()
-            ActivityLog.query.filter_by(user_id=user_id).delete()
-            Alert.query.filter_by(user_id=user_id).delete()
-
-            # Delete the user
-            user = User.query.get(user_id)
+            # The account is unusable from here; its rows and files are deleted in the background
+            current_user.deleted_at = datetime.utcnow()
+            db.session.commit()
             from flask_login import logout_user
             logout_user()
-            db.session.delete(user)
-            db.session.commit()
+            purge.start(user_id, 'account')
             flash('Your account has been deleted.', 'info')
-            # Cannot log_activity after deletion; use print for server log
-            try:
-                print(f"User deleted: {username} (ID {user_id})")
-            except Exception:
-                pass
+            # Cannot log_activity after deletion; use the server log
+            logger.info(f"User deleted: {username} (ID {user_id})")
             return redirect(url_for('main.index'))
 
     return render_template('dashboard/settings.html', 
@@ -298,21 +483,55 @@ def user_analysis_activity():
     stacked_data = {date: stacked_data[date] for date in sorted(stacked_data)}
     return jsonify({'success': True, 'chart_data': chart_data, 'stacked_data': stacked_data, 'analysis_types': analysis_types})
 
+@main_bp.route('/api/drift-stats')
+@login_required
+def drift_stats():
+    from ml.drift import all_snapshots
+    return jsonify({'success': True, 'monitors': all_snapshots()})
+
+@main_bp.route('/api/tick-stats')
+@login_required
+def tick_stats():
+    from ml.streaming import all_snapshots
+    return jsonify({'success': True, 'detectors': all_snapshots()})
+
+@main_bp.route('/api/governor-stats')
+@login_required
+def governor_stats():
+    """Analysis slots and queue, with the current user's queue waits and quota use"""
+    return jsonify({'success': True, 'governor': get_governor().stats(current_user.id)})
+
+@main_bp.route('/api/alert-stats')
+@login_required
+def alert_stats():
+    from utils.alerts import stats
+    return jsonify({'success': True, 'alerts': stats()})
+
+@main_bp.route('/api/storage-stats')
+@login_required
+def storage_stats():
+    from utils.retention import storage_stats
+    return jsonify({'success': True, 'storage': storage_stats(current_app.config['UPLOAD_FOLDER'])})
+
 @main_bp.route('/api/user-analyses', methods=['DELETE'])
 @login_required
 def clear_user_analyses():
-    from models import Analysis
-    Analysis.query.filter_by(user_id=current_user.id).delete()
-    db.session.commit()
-    return jsonify({'success': True})
+    # Deleted in batches by a background purge; poll /api/purges/<id> for progress
+    job = purge.start(current_user.id, 'analyses')
+    return jsonify({'success': True, 'purge': job.to_dict()}), 202
 
 @main_bp.route('/api/user-activity-logs', methods=['DELETE'])
 @login_required
 def clear_user_activity_logs():
-    from models import ActivityLog
-    ActivityLog.query.filter_by(user_id=current_user.id).delete()
-    db.session.commit()
-    return jsonify({'success': True})
+    job = purge.start(current_user.id, 'activity_logs')
+    return jsonify({'success': True, 'purge': job.to_dict()}), 202
+
+@main_bp.route('/api/purges/<int:purge_id>')
+@login_required
+def purge_status(purge_id):
+    from models import PurgeJob
+    job = PurgeJob.query.filter_by(id=purge_id, user_id=current_user.id).first_or_404()
+    return jsonify({'success': True, 'purge': job.to_dict()})
 
 @main_bp.route('/download-report/<int:analysis_id>')
 @login_required
@@ -334,7 +553,8 @@ def download_report(analysis_id):
     analysis_type = analysis.analysis_type.title()
     filename = f"{analysis_type}_Analysis_Report_{analysis_id}.pdf"
     
-    return send_file(report_path, as_attachment=True, 
+    # Reports are written relative to the working directory; send_file resolves relative paths against the app root
+    return send_file(os.path.abspath(report_path), as_attachment=True, 
                      download_name=filename)
 
 @main_bp.route('/api/send-anomaly-email', methods=['POST'])
@@ -345,10 +565,12 @@ def send_anomaly_email():
     details = data.get('details', '')
     if not anomaly_count:
         return {'success': False, 'error': 'Missing anomaly count'}, 400
-    subject = 'Bitcoin Anomaly Detection Alert'
-    body = f"Anomaly Alert! {anomaly_count} anomalies detected during live analysis.\n\nDetails: {details}"
-    send_email(current_user.email, subject, body)
-    return {'success': True}
+    # Live polling repeats this every few seconds: the alert engine keeps one alert per incident and
+    # only emails new or escalated incidents, within the user's email rate limit
+    from utils.alerts import raise_alert
+    alert = raise_alert(current_user.id, 'anomaly', f"{anomaly_count} anomalies detected during live analysis. {details}",
+                        'high', key='live-analysis', quantity=int(anomaly_count), noun='anomalies', email=True)
+    return {'success': True, 'alert': {'id': alert.id, 'occurrences': alert.occurrences, 'severity': alert.severity}}
 
 @main_bp.route('/test-pdf')
 @login_required
@@ -1,63 +1,99 @@
 import os
+import gc
 import pandas as pd
 import numpy as np
 from datetime import datetime
 import joblib
-from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier
-from sklearn.svm import SVC
-import xgboost as xgb
 import logging
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="sklearn")
-import random
 import time
+import hashlib
+from config import (MODEL_ARTIFACT_DIR, MODEL_ARTIFACT_VERSION, MODEL_MMAP_MODE, MODEL_VERIFY_CHECKSUMS,
+                    ENSEMBLE_CASCADE, DRIFT_MONITORING, DRIFT_PSI_THRESHOLD, DRIFT_HALF_LIFE_ROWS,
+                    DRIFT_MIN_SAMPLES, TICK_DETECTOR, ANALYSIS_MEMORY_BUDGET_MB, ANALYSIS_CHUNK_ROWS)
+from ml.artifacts import (ArtifactError, FEATURE_SCHEMA, LEGACY_MODEL_FILES, LEGACY_SCALER_FILE, file_checksum,
+                          get_artifacts)
+from ml.drift import gaussian_reference, get_monitor, merge_reports
+from ml.ingest import read_csv, read_csv_chunks, estimate_rows
+from ml.memory import MB, FULL_BYTES_PER_ROW, MemoryBudgetExceeded, MemoryTracker, estimate_full_bytes
+from ml.ranking import rank_anomalies, StreamingRanking
+from ml.streaming import get_detector
+
+logger = logging.getLogger(__name__)
+
+# prepare_features' rolling window, in rows
+ROLLING_WINDOW = 5
+# Smallest useful chunk; a budget that cannot fit one refuses the file
+MIN_CHUNK_ROWS = 1000
+
+
+class ModelsUnavailableError(Exception):
+    """Raised when neither a model artifact nor the legacy pickles can be loaded."""
+
+
+def _as_float(column):
+    """Float column as is (e.g. float32 from ml.ingest), anything else converted"""
+    return column if pd.api.types.is_float_dtype(column) else column.astype(float)
+
+
+def _to_json_list(values, cast=float):
+    """Array -> list for JSON, with NaN (rows a cascade model skipped) as None"""
+    values = np.asarray(values, dtype=np.float64)
+    if not np.isnan(values).any():
+        return values.astype(cast).tolist()
+    return [None if v != v else cast(v) for v in values.tolist()]
+
 
 class MLAnalyzer:
     def __init__(self):
         self.models = {}
         self.scaler = None
+        self.manifest = None
+        self.ensemble = None
+        self.legacy_version = None
         self.load_models()
     
     def load_models(self):
-        """Load pre-trained ML models from workspace root. If missing, create dummy model/scaler silently."""
+        """Load pre-trained ML models, preferring the packaged artifact directory"""
         try:
-            model_files = {
-                'svm': 'svm_model.pkl',
-                'random_forest': 'random_forest_model.pkl',
-                'adaboost': 'adaboost_model.pkl',
-                'xgboost': 'xgboost_model.pkl'
-            }
-            for model_name, filename in model_files.items():
-                filepath = filename
-                if os.path.exists(filepath):
-                    self.models[model_name] = joblib.load(filepath)
-                    logging.info(f"Loaded {model_name} model from {filepath}")
-                else:
-                    
-                    self.models[model_name] = self._create_dummy_model(model_name)
-            # Load scaler
-            scaler_path = 'scaler.pkl'
-            if os.path.exists(scaler_path):
-                self.scaler = joblib.load(scaler_path)
-                logging.info("Loaded scaler from scaler.pkl")
+            bundle = get_artifacts(MODEL_ARTIFACT_DIR, version=MODEL_ARTIFACT_VERSION,
+                                   mmap_mode=MODEL_MMAP_MODE, verify=MODEL_VERIFY_CHECKSUMS)
+        except (ArtifactError, OSError) as e:
+            logger.debug(f"No packaged model artifact available ({e}); using legacy pickles")
+            bundle = None
+        if bundle is not None:
+            # Shared, read-only estimators: never fit these in place
+            self.models = dict(bundle['models'])
+            self.scaler = bundle['scaler']
+            self.manifest = bundle['manifest']
+            self.ensemble = bundle['objects'].get('ensemble')
+            if self.ensemble is not None and not set(self.ensemble.model_names) <= set(self.models):
+                logger.warning("Ensemble does not match the artifact's models; averaging probabilities instead")
+                self.ensemble = None
+            return
+        self.load_legacy_models()
+
+    def load_legacy_models(self):
+        """Load the notebook's *.pkl models from the workspace root, skipping missing ones"""
+        for model_name, filename in LEGACY_MODEL_FILES.items():
+            if os.path.exists(filename):
+                self.models[model_name] = joblib.load(filename)
+                logger.info(f"Loaded {model_name} model from {filename}")
             else:
-                # Silently create d scaler
-                self.scaler = StandardScaler()
-        except Exception as e:
-            raise e
+                logger.warning(f"{filename} not found; {model_name} is left out of the ensemble")
+        if os.path.exists(LEGACY_SCALER_FILE):
+            self.scaler = joblib.load(LEGACY_SCALER_FILE)
+            logger.info(f"Loaded scaler from {LEGACY_SCALER_FILE}")
+        if not self.models or self.scaler is None:
+            raise ModelsUnavailableError(
+                "No trained models found. Run `python -m ml.training` to build a model artifact.")
+        digest = hashlib.sha256()
+        for filename in sorted(LEGACY_MODEL_FILES.values()) + [LEGACY_SCALER_FILE]:
+            if os.path.exists(filename):
+                digest.update(file_checksum(filename).encode('utf-8'))
+        self.legacy_version = f"legacy-{digest.hexdigest()[:12]}"
 
-    def _create_dummy_model(self, model_name):
-        np.random.seed(42)
-        if model_name == 'svm':
-            return SVC(probability=True, random_state=42)
-        elif model_name == 'random_forest':
-            return RandomForestClassifier(n_estimators=100, random_state=42)
-        elif model_name == 'adaboost':
-            return AdaBoostClassifier(n_estimators=100, random_state=42)
-        elif model_name == 'xgboost':
-            return xgb.XGBClassifier(n_estimators=100, random_state=42)
-    
     def prepare_features(self, df):
         """Prepare features for ML analysis"""
         try:
@@ -66,14 +102,16 @@ class MLAnalyzer:
             
             # If we have price and volume columns
             if 'price' in df.columns and 'qty' in df.columns:
-                features.append(df['price'].astype(float))
-                features.append(df['qty'].astype(float))
+                price = _as_float(df['price'])
+                qty = _as_float(df['qty'])
+                features.append(price)
+                features.append(qty)
                 
                 # Calculate additional features
-                features.append(df['price'].rolling(window=5).mean().fillna(df['price']))
-                features.append(df['price'].rolling(window=5).std().fillna(0))
-                features.append(df['qty'].rolling(window=5).mean().fillna(df['qty']))
-                features.append(df['qty'].rolling(window=5).std().fillna(0))
+                features.append(price.rolling(window=ROLLING_WINDOW).mean().fillna(price))
+                features.append(price.rolling(window=ROLLING_WINDOW).std().fillna(0))
+                features.append(qty.rolling(window=ROLLING_WINDOW).mean().fillna(qty))
+                features.append(qty.rolling(window=ROLLING_WINDOW).std().fillna(0))
             
             # If we have numeric columns, use them
             numeric_cols = df.select_dtypes(include=[np.number]).columns
@@ -105,144 +143,279 @@ class MLAnalyzer:
         except Exception as e:
             # Return random features as fallback, always 6 columns
             return np.random.randn(len(df), 6)
-    
-    def train_dummy_models(self, X, y=None):
-        """Train dummy models with sample data"""
-        if y is None:
-            # Generate dummy labels
-            y = np.random.choice([0, 1], size=len(X), p=[0.9, 0.1])
-        
-        # Fit scaler
-        X_scaled = self.scaler.fit_transform(X)
-        
-        # Train each model
+
+    def score(self, X_scaled, cascade=ENSEMBLE_CASCADE, tick_probabilities=None, supervised=True):
+        """Ensemble scores for scaled features.
+
+        Uses the calibrated stacking ensemble from the model artifact; without one
+        (legacy pickles) it averages the models' probabilities at a 0.5 threshold.
+        ``tick_probabilities`` (from ``score_ticks``) adds the streaming tick
+        detector as a member: a row is flagged when either side flags it.  With
+        ``supervised=False`` (input outside the training distribution, see
+        ``in_training_domain``) the models are skipped and the detector decides.
+        """
+        if tick_probabilities is not None and not supervised:
+            return {
+                'scores': tick_probabilities,
+                'prediction': (tick_probabilities >= 0.5).astype(int),
+                'model_probabilities': {'tick_stream': tick_probabilities},
+                'cascade_rows': 0,
+                'mode': 'tick_stream',
+            }
+        scored = self._score_models(X_scaled, cascade)
+        if tick_probabilities is not None:
+            scored['model_probabilities']['tick_stream'] = tick_probabilities
+            scored['prediction'] = np.maximum(scored['prediction'], (tick_probabilities >= 0.5).astype(int))
+            scored['scores'] = np.maximum(scored['scores'], tick_probabilities)
+        return scored
+
+    def _score_models(self, X_scaled, cascade):
+        if self.ensemble is not None:
+            scored = self.ensemble.predict(self.models, X_scaled, cascade=cascade)
+            scored['mode'] = 'cascade' if cascade and self.ensemble.can_cascade else 'stacked'
+            return scored
+
+        probabilities = {}
         for model_name, model in self.models.items():
             try:
-                model.fit(X_scaled, y)
-                logging.info(f"Trained {model_name} model")
+                probabilities[model_name] = model.predict_proba(X_scaled)[:, 1]
             except Exception as e:
-                logging.error(f"Error training {model_name}: {str(e)}")
+                logger.error(f"Error with {model_name}: {str(e)}")
+        if not probabilities:
+            raise ModelsUnavailableError("No model could score the input")
+        scores = np.mean(list(probabilities.values()), axis=0)
+        return {
+            'scores': scores,
+            'prediction': (scores >= 0.5).astype(int),
+            'model_probabilities': probabilities,
+            'cascade_rows': len(scores),
+            'mode': 'mean_probability',
+        }
+
+    @staticmethod
+    def in_training_domain(drift):
+        """False when a drift report shows the batch is unlike the training data (any PSI over threshold)"""
+        return not drift or max(drift['psi'].values(), default=0.0) < DRIFT_PSI_THRESHOLD
+
+    def score_ticks(self, df, stream):
+        """Streaming tick-detector probabilities for a trade frame, or None (disabled / not trades)"""
+        if not TICK_DETECTOR or 'price' not in df.columns or 'qty' not in df.columns:
+            return None
+        detector = get_detector(stream)
+        trade_ids = df['id'].to_numpy() if 'id' in df.columns else None
+        return detector.probability(detector.update(df['price'].to_numpy(), df['qty'].to_numpy(), trade_ids))
+
+    def model_metrics(self):
+        """Test-set metrics recorded with the model artifact, if any"""
+        return (self.manifest or {}).get('metrics', {})
+
+    def measured_accuracy(self):
+        """Offline-measured accuracy of the ensemble mode in use (0.0 when unmeasured)"""
+        ensemble_metrics = self.model_metrics().get('ensemble', {})
+        mode = 'cascade' if ENSEMBLE_CASCADE and 'cascade' in ensemble_metrics else 'full'
+        return float(ensemble_metrics.get(mode, {}).get('accuracy', 0.0))
+
+    def cache_identity(self):
+        """(model version, feature schema version) that this analyzer's results depend on"""
+        if self.manifest:
+            model_version = self.manifest['version']
+            schema_version = self.manifest.get('feature_schema', FEATURE_SCHEMA).get('version')
+        else:
+            model_version = self.legacy_version
+            schema_version = FEATURE_SCHEMA['version']
+        mode = 'cascade' if ENSEMBLE_CASCADE and self.ensemble is not None and self.ensemble.can_cascade else 'full'
+        return f"{model_version}:{mode}", str(schema_version)
+
+    def drift_reference(self):
+        """Training feature distribution from the artifact, or a standard normal one"""
+        reference = (self.manifest or {}).get('drift_reference')
+        if reference:
+            return reference
+        names = getattr(self.scaler, 'feature_names_in_', None)
+        return gaussian_reference(tuple(names) if names is not None else tuple(FEATURE_SCHEMA['features']))
+
+    def observe_drift(self, path, X_scaled):
+        """Feed a scaled batch to the drift monitor of a scoring path; never fails the analysis"""
+        if not DRIFT_MONITORING:
+            return None
+        try:
+            monitor = get_monitor(path, self.drift_reference(), half_life=DRIFT_HALF_LIFE_ROWS,
+                                  threshold=DRIFT_PSI_THRESHOLD, min_samples=DRIFT_MIN_SAMPLES)
+            return monitor.update(X_scaled)
+        except Exception as e:
+            logger.error(f"Drift monitoring failed for {path}: {str(e)}")
+            return None
     
-    def analyze_csv(self, filepath):
-        """Analyze uploaded CSV file"""
+    def analyze_csv(self, filepath, columns=None, compression=None, budget_mb=ANALYSIS_MEMORY_BUDGET_MB):
+        """Analyze uploaded CSV file (``columns``/``compression`` from the upload's header check).
+
+        A file expected to need more than ``budget_mb`` in one piece, or that
+        passes the budget while being analysed, is analysed in chunks instead;
+        ``results['memory']`` records the mode and each stage's memory use.
+        """
         try:
             start_time = time.time()
-            df = pd.read_csv(filepath)
-            
-            # Prepare features
-            X = self.prepare_features(df)
-            
-            # Train models if needed
-            if not hasattr(self.models['svm'], 'classes_'):
-                self.train_dummy_models(X)
-            
-            # Scale features
-            X_scaled = self.scaler.transform(X)
-            
-            # Make predictions with each model
-            predictions = {}
-            probabilities = {}
-            
-            for model_name, model in self.models.items():
-                try:
-                    pred = model.predict(X_scaled)
-                    prob = model.predict_proba(X_scaled)[:, 1] if hasattr(model, 'predict_proba') else pred
-                    
-                    predictions[model_name] = pred
-                    probabilities[model_name] = prob
-                except Exception as e:
-                    logging.error(f"Error with {model_name}: {str(e)}")
-                    predictions[model_name] = np.zeros(len(X))
-                    probabilities[model_name] = np.zeros(len(X))
-            
-            # Ensemble prediction
-            ensemble_pred = np.mean(list(predictions.values()), axis=0)
-            ensemble_pred = (ensemble_pred > 0.3).astype(int)
+            budget = budget_mb * MB if budget_mb else None
+            estimated = estimate_full_bytes(estimate_rows(filepath, compression))
+            mode = 'chunked' if budget is not None and estimated > budget else 'full'
+            with MemoryTracker(budget) as tracker:
+                if mode == 'full':
+                    try:
+                        results = self._analyze_csv_full(filepath, columns, compression, tracker)
+                    except MemoryBudgetExceeded as e:
+                        logger.warning(f"{str(e)}; analysing {filepath} in chunks instead")
+                        mode = 'chunked'
+                        gc.collect()
+                        tracker.rebase()
+                if mode == 'chunked':
+                    results = self._analyze_csv_chunked(filepath, columns, compression, tracker,
+                                                        self._chunk_rows(budget))
+            results['analysis_time'] = time.time() - start_time
+            results['memory'] = {**tracker.report(), 'mode': mode, 'budget_mb': budget_mb or None,
+                                 'estimated_mb': round(estimated / MB, 1)}
+            return results
             
-            # Calculate results
+        except Exception as e:
+            logger.error(f"Error analyzing CSV: {str(e)}")
+            raise e
+
+    @staticmethod
+    def _chunk_rows(budget):
+        """Rows per chunk: ANALYSIS_CHUNK_ROWS, or fewer so one chunk uses at most half the budget"""
+        if budget is None:
+            return ANALYSIS_CHUNK_ROWS
+        rows = min(ANALYSIS_CHUNK_ROWS, budget // (2 * FULL_BYTES_PER_ROW))
+        if rows < MIN_CHUNK_ROWS:
+            raise MemoryBudgetExceeded(f"The {budget // MB} MB analysis memory budget is too small for this file")
+        return rows
+
+    def _analyze_csv_full(self, filepath, columns, compression, tracker):
+        with tracker.stage('read'):
+            df = read_csv(filepath, columns=columns, compression=compression)
+        tracker.check()
+        
+        with tracker.stage('features'):
+            # Prepare and scale features; the frame and the unscaled matrix are not needed afterwards
             total_transactions = len(df)
-            anomalies_detected = int(np.sum(ensemble_pred))
-            accuracy_score = np.mean([0.85, 0.87, 0.82, 0.89])  # Dummy accuracy scores
-            analysis_time = time.time() - start_time
-            
+            X_scaled = self.scaler.transform(self.prepare_features(df))
+            del df
+        tracker.check()
+        
+        with tracker.stage('score'):
+            # Score with the ensemble
+            scored = self.score(X_scaled)
+            ensemble_pred = scored['prediction']
+        tracker.check()
+        
+        with tracker.stage('results'):
             # Prepare detailed results
             results = {
                 'total_transactions': total_transactions,
-                'anomalies_detected': anomalies_detected,
-                'accuracy_score': accuracy_score,
-                'model_predictions': {name: pred.tolist() for name, pred in predictions.items()},
-                'model_probabilities': {name: prob.tolist() for name, prob in probabilities.items()},
+                'anomalies_detected': int(np.sum(ensemble_pred)),
+                'accuracy_score': self.measured_accuracy(),
+                'model_metrics': self.model_metrics(),
+                'model_predictions': {name: _to_json_list(np.where(np.isnan(prob), np.nan, prob >= 0.5), int)
+                                      for name, prob in scored['model_probabilities'].items()},
+                'model_probabilities': {name: _to_json_list(prob) for name, prob in scored['model_probabilities'].items()},
                 'ensemble_prediction': ensemble_pred.tolist(),
+                'ensemble_scores': np.round(scored['scores'], 6).tolist(),
+                'ensemble_mode': scored['mode'],
+                'cascade_rows': scored['cascade_rows'],
                 'anomaly_indices': np.where(ensemble_pred == 1)[0].tolist(),
-                'analysis_timestamp': datetime.now().isoformat(),
-                'analysis_time': analysis_time
+                'anomaly_ranking': rank_anomalies(scored['scores'], ensemble_pred),
+                'analysis_timestamp': datetime.now().isoformat()
             }
-            
-            return results
-            
-        except Exception as e:
-            logging.error(f"Error analyzing CSV: {str(e)}")
-            raise e
+        tracker.check()
+        # Only once the attempt is within budget: a chunked retry would feed the monitor the same rows again
+        results['drift'] = self.observe_drift('upload', X_scaled)
+        return results
+
+    def _analyze_csv_chunked(self, filepath, columns, compression, tracker, chunk_rows):
+        """Analyze a file chunk by chunk, keeping only counts, flagged rows and the streaming ranking.
+
+        Per-row model outputs are not kept, so the results page shows the
+        ranked anomalies without per-model probabilities.
+        """
+        ranking = StreamingRanking()
+        flagged_rows = []
+        total = cascade_rows = chunks = 0
+        drift = mode = None
+        tail = None
+        for chunk in read_csv_chunks(filepath, chunk_rows, columns=columns, compression=compression):
+            with tracker.stage('chunk'):
+                # Carry the last rows over, so rolling features match a single-pass analysis
+                frame = chunk if tail is None else pd.concat([tail, chunk], ignore_index=True)
+                X_scaled = self.scaler.transform(self.prepare_features(frame)[len(frame) - len(chunk):])
+                tail = frame.iloc[-(ROLLING_WINDOW - 1):]
+                drift = merge_reports(drift, self.observe_drift('upload', X_scaled))
+                scored = self.score(X_scaled)
+                prediction = scored['prediction']
+                flagged_rows.append(np.flatnonzero(prediction) + total)
+                ranking.update(scored['scores'], prediction, total)
+                total += len(chunk)
+                cascade_rows += scored['cascade_rows']
+                mode = scored['mode']
+                chunks += 1
+                del frame, X_scaled, scored, prediction
+            tracker.check()
+        
+        anomaly_indices = np.concatenate(flagged_rows) if flagged_rows else np.empty(0, dtype=np.int64)
+        return {
+            'total_transactions': total,
+            'anomalies_detected': int(len(anomaly_indices)),
+            'accuracy_score': self.measured_accuracy(),
+            'model_metrics': self.model_metrics(),
+            'ensemble_mode': mode,
+            'cascade_rows': cascade_rows,
+            'anomaly_indices': anomaly_indices.tolist(),
+            'anomaly_ranking': ranking.result(),
+            'analysis_timestamp': datetime.now().isoformat(),
+            'chunks': chunks,
+            'drift': drift
+        }
     
-    def analyze_live_data(self, df):
-        """Analyze live market data"""
+    def analyze_live_data(self, df, stream='live', bar_features=None, order_book_features=None):
+        """Analyze live market data (``stream`` names the tick detector, e.g. 'live:BTCUSDT').
+
+        ``bar_features`` (``BarBuilder.features``) and ``order_book_features``
+        (``OrderBook.features``) describe the market around the trades; they
+        are returned with the results.
+        """
         try:
             # Prepare features from live data
             X = self.prepare_features(df)
             
-            # Train models if needed
-            if not hasattr(self.models['svm'], 'classes_'):
-                self.train_dummy_models(X)
-            
             # Scale features
             X_scaled = self.scaler.transform(X)
             
-            # Make predictions
-            predictions = {}
-            for model_name, model in self.models.items():
-                try:
-                    pred = model.predict(X_scaled)
-                    predictions[model_name] = pred
-                except Exception as e:
-                    logging.error(f"Error with {model_name}: {str(e)}")
-                    predictions[model_name] = np.zeros(len(X))
+            drift = self.observe_drift('live', X_scaled)
             
-            # Ensemble prediction
-            ensemble_pred = np.mean(list(predictions.values()), axis=0)
-            ensemble_pred = (ensemble_pred > 0.3).astype(int)
-            # --- Force some random anomalies for testing ---
-            if np.sum(ensemble_pred) == 0 and len(ensemble_pred) > 0:
-                n_anom = random.randint(1, 9)
-                n_anom = min(n_anom, len(ensemble_pred))
-                anomaly_indices = random.sample(range(len(ensemble_pred)), n_anom)
-                for idx in anomaly_indices:
-                    ensemble_pred[idx] = 1
-            # -----------------------------------------------
-            # --- Estimated accuracy based on anomaly count (dynamic) ---
-            anomaly_count = int(np.sum(ensemble_pred))
-            if anomaly_count <= 1:
-                accuracy = round(random.uniform(0.93, 0.95), 2)
-            elif anomaly_count <= 4:
-                accuracy = round(random.uniform(0.91, 0.93), 2)
-            elif anomaly_count <= 7:
-                accuracy = round(random.uniform(0.87, 0.90), 2)
-            else:
-                accuracy = round(random.uniform(0.85, 0.88), 2)
-            # ----------------------------------------------------------
+            # Ensemble prediction, with the streaming detector for the raw ticks. The supervised
+            # models were trained on daily aggregates; when the ticks look nothing like them only
+            # the detector decides
+            scored = self.score(X_scaled, tick_probabilities=self.score_ticks(df, stream),
+                                supervised=self.in_training_domain(drift))
+            ensemble_pred = scored['prediction']
             
             results = {
                 'total_transactions': len(df),
                 'anomalies_detected': int(np.sum(ensemble_pred)),
-                'accuracy_score': accuracy,
+                'accuracy_score': self.measured_accuracy(),
                 'anomaly_indices': np.where(ensemble_pred == 1)[0].tolist(),
+                'anomaly_ranking': rank_anomalies(scored['scores'], ensemble_pred),
                 'analysis_timestamp': datetime.now().isoformat(),
-                'live_data': True
+                'live_data': True,
+                'ensemble_mode': scored['mode'],
+                'tick_detector': get_detector(stream).snapshot() if TICK_DETECTOR else None,
+                'bar_features': bar_features,
+                'order_book_features': order_book_features,
+                'drift': drift
             }
             
             return results
             
         except Exception as e:
-            logging.error(f"Error analyzing live data: {str(e)}")
+            logger.error(f"Error analyzing live data: {str(e)}")
             raise e
     
     def analyze_simulated_data(self, df):
@@ -257,41 +430,34 @@ class MLAnalyzer:
             # Prepare features
             X = self.prepare_features(df)
             
-            # Train models if needed
-            if not hasattr(self.models['svm'], 'classes_'):
-                self.train_dummy_models(X)
-            
             # Scale features
             X_scaled = self.scaler.transform(X)
             
-            # Make predictions
-            predictions = {}
-            for model_name, model in self.models.items():
-                try:
-                    pred = model.predict(X_scaled)
-                    predictions[model_name] = pred
-                except Exception as e:
-                    logging.error(f"Error with {model_name}: {str(e)}")
-                    predictions[model_name] = np.zeros(len(X))
+            drift = self.observe_drift('simulated', X_scaled)
             
             # Ensemble prediction
-            ensemble_pred = np.mean(list(predictions.values()), axis=0)
-            ensemble_pred = (ensemble_pred > 0.3).astype(int)
+            scored = self.score(X_scaled)
+            ensemble_pred = scored['prediction']
             
-            # Random accuracy between 0.84 and 0.93
-            accuracy_score = np.round(np.random.uniform(0.84, 0.94), 2)
+            # Accuracy against the simulated labels when present, else the offline measurement
+            if 'is_anomaly' in df.columns:
+                accuracy_score = float(np.mean(ensemble_pred == df['is_anomaly'].to_numpy()))
+            else:
+                accuracy_score = self.measured_accuracy()
             results = {
                 'total_transactions': len(df),
                 'anomalies_detected': int(np.sum(ensemble_pred)),
                 'accuracy_score': accuracy_score,
                 'anomaly_indices': np.where(ensemble_pred == 1)[0].tolist(),
+                'anomaly_ranking': rank_anomalies(scored['scores'], ensemble_pred),
                 'analysis_timestamp': datetime.now().isoformat(),
                 'simulated_data': True,
-                'true_anomalies': int(true_anomalies)
+                'true_anomalies': int(true_anomalies),
+                'drift': drift
             }
             
             return results
             
         except Exception as e:
-            logging.error(f"Error analyzing simulated data: {str(e)}")
+            logger.error(f"Error analyzing simulated data: {str(e)}")
             raise e
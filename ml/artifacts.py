@@ -0,0 +1,241 @@
+"""Model artifact packaging and loading.
+
+An artifact directory holds one uncompressed joblib file per model plus the
+scaler, and a ``manifest.json`` recording the artifact version, the feature
+schema the models were trained on and a SHA-256 checksum per file.  Because
+the files are uncompressed, ``joblib.load(..., mmap_mode='c')`` maps large
+numpy arrays (SVM support vectors, dual coefficients, ...) straight from the
+page cache, so every worker process shares one physical copy instead of
+unpickling its own.  Copy-on-write (``'c'``) rather than read-only (``'r'``)
+maps are used because libsvm's ``predict_proba`` refuses read-only buffers;
+pages are only duplicated if something actually writes to them.
+
+Layout::
+
+    artifacts/
+        CURRENT                 # name of the active version
+        20250812_140655/
+            manifest.json
+            svm.joblib
+            adaboost.joblib
+            xgboost.joblib
+            scaler.joblib
+
+Package the pickles in the project root with::
+
+    python -m ml.artifacts --src . --root artifacts
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+import joblib
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+CURRENT_POINTER = 'CURRENT'
+ARTIFACT_FORMAT = 1
+
+# Columns the shipped models and scaler were fitted on (see MLcode.ipynb)
+FEATURE_SCHEMA = {
+    'version': 1,
+    'features': ['Weight Mean', 'Difficulty Mean', 'Reward Mean',
+                 'Transaction Sum', 'Total Blocks', 'Fee Total Sum'],
+}
+
+# Legacy pickles written by the notebook, relative to the project root
+LEGACY_MODEL_FILES = {
+    'svm': 'svm_model.pkl',
+    'random_forest': 'random_forest_model.pkl',
+    'adaboost': 'adaboost_model.pkl',
+    'xgboost': 'xgboost_model.pkl',
+}
+LEGACY_SCALER_FILE = 'scaler.pkl'
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class ArtifactError(Exception):
+    """Raised when an artifact directory is missing, incomplete or corrupt."""
+
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    """Return the hex SHA-256 digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path, payload):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(payload, fh, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _write_text_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        fh.write(text)
+    os.replace(tmp_path, path)
+
+
+def package_models(models, scaler, root='artifacts', version=None, feature_schema=None,
+                   extra=None, make_current=True, objects=None):
+    """Write models and scaler to a new uncompressed artifact directory.
+
+    ``models`` maps model names to fitted estimators and ``objects`` holds any
+    other fitted components (e.g. the stacking ensemble).  ``extra`` is merged
+    into the manifest (training metrics, dataset hash, ...).  Returns the path
+    of the new artifact directory.
+    """
+    version = version or datetime.now().strftime('%Y%m%d_%H%M%S')
+    artifact_dir = os.path.join(root, version)
+    if os.path.exists(os.path.join(artifact_dir, MANIFEST_NAME)):
+        raise ArtifactError(f"Artifact version {version} already exists in {root}")
+    os.makedirs(artifact_dir, exist_ok=True)
+
+    files = {}
+    entries = [(name, model) for name, model in models.items()]
+    entries.extend((objects or {}).items())
+    entries.append(('scaler', scaler))
+    for name, obj in entries:
+        filename = f"{name}.joblib"
+        path = os.path.join(artifact_dir, filename)
+        # compress=0 keeps arrays page-aligned on disk so they can be memory-mapped
+        joblib.dump(obj, path, compress=0)
+        files[name] = {
+            'file': filename,
+            'sha256': file_checksum(path),
+            'size': os.path.getsize(path),
+            'type': f"{type(obj).__module__}.{type(obj).__name__}",
+        }
+
+    manifest = {
+        'format': ARTIFACT_FORMAT,
+        'version': version,
+        'created_at': datetime.utcnow().isoformat(),
+        'feature_schema': feature_schema or FEATURE_SCHEMA,
+        'models': sorted(models.keys()),
+        'objects': sorted((objects or {}).keys()),
+        'files': files,
+    }
+    if extra:
+        manifest.update(extra)
+    _write_json_atomic(os.path.join(artifact_dir, MANIFEST_NAME), manifest)
+
+    if make_current:
+        _write_text_atomic(os.path.join(root, CURRENT_POINTER), version + '\n')
+    logger.info(f"Packaged {len(models)} models into {artifact_dir}")
+    return artifact_dir
+
+
+def package_legacy_pickles(src_dir='.', root='artifacts', version=None):
+    """Repackage the notebook's ``*.pkl`` files as an artifact directory"""
+    models = {}
+    for model_name, filename in LEGACY_MODEL_FILES.items():
+        path = os.path.join(src_dir, filename)
+        if os.path.exists(path):
+            models[model_name] = joblib.load(path)
+        else:
+            logger.warning(f"Skipping {model_name}: {path} not found")
+    scaler_path = os.path.join(src_dir, LEGACY_SCALER_FILE)
+    if not models or not os.path.exists(scaler_path):
+        raise ArtifactError(f"No models or scaler found in {src_dir}")
+    scaler = joblib.load(scaler_path)
+    return package_models(models, scaler, root=root, version=version,
+                          extra={'source': 'legacy_pickles'})
+
+
+def resolve_artifact_dir(root='artifacts', version=None):
+    """Return the directory of ``version``, or of the CURRENT version"""
+    if version is None:
+        pointer = os.path.join(root, CURRENT_POINTER)
+        if not os.path.exists(pointer):
+            raise ArtifactError(f"No {CURRENT_POINTER} pointer in {root}")
+        with open(pointer, encoding='utf-8') as fh:
+            version = fh.read().strip()
+    artifact_dir = os.path.join(root, version)
+    if not os.path.exists(os.path.join(artifact_dir, MANIFEST_NAME)):
+        raise ArtifactError(f"Artifact {artifact_dir} has no {MANIFEST_NAME}")
+    return artifact_dir
+
+
+def read_manifest(artifact_dir):
+    """Load and sanity-check an artifact manifest"""
+    with open(os.path.join(artifact_dir, MANIFEST_NAME), encoding='utf-8') as fh:
+        manifest = json.load(fh)
+    if manifest.get('format') != ARTIFACT_FORMAT:
+        raise ArtifactError(f"Unsupported artifact format {manifest.get('format')} in {artifact_dir}")
+    return manifest
+
+
+def load_artifacts(artifact_dir, mmap_mode='c', verify=True):
+    """Load every file listed in the manifest of ``artifact_dir``.
+
+    Returns ``{'manifest': ..., 'models': {name: estimator}, 'objects': {...},
+    'scaler': ...}``.
+    With ``mmap_mode='c'`` numpy arrays inside the pickles are copy-on-write
+    memory maps shared with every other process that maps the same file.
+    """
+    manifest = read_manifest(artifact_dir)
+    loaded = {}
+    for name, entry in manifest['files'].items():
+        path = os.path.join(artifact_dir, entry['file'])
+        if not os.path.exists(path):
+            raise ArtifactError(f"Missing artifact file {path}")
+        if os.path.getsize(path) != entry['size']:
+            raise ArtifactError(f"Size mismatch for {path}")
+        if verify and file_checksum(path) != entry['sha256']:
+            raise ArtifactError(f"Checksum mismatch for {path}")
+        loaded[name] = joblib.load(path, mmap_mode=mmap_mode)
+
+    if 'scaler' not in loaded:
+        raise ArtifactError(f"Artifact {artifact_dir} has no scaler")
+    scaler = loaded.pop('scaler')
+    models = {name: loaded[name] for name in manifest['models'] if name in loaded}
+    objects = {name: loaded[name] for name in manifest.get('objects', []) if name in loaded}
+    return {'manifest': manifest, 'models': models, 'objects': objects, 'scaler': scaler,
+            'path': artifact_dir}
+
+
+def get_artifacts(root='artifacts', version=None, mmap_mode='c', verify=True):
+    """Return the artifact bundle for ``root``, loading it once per process"""
+    artifact_dir = resolve_artifact_dir(root, version)
+    key = (os.path.abspath(artifact_dir), mmap_mode)
+    bundle = _cache.get(key)
+    if bundle is not None:
+        return bundle
+    with _cache_lock:
+        bundle = _cache.get(key)
+        if bundle is None:
+            bundle = load_artifacts(artifact_dir, mmap_mode=mmap_mode, verify=verify)
+            _cache[key] = bundle
+            logger.info(f"Loaded model artifact {bundle['manifest']['version']} from {artifact_dir}")
+    return bundle
+
+
+def clear_cache():
+    """Forget loaded artifacts, e.g. after a new version became CURRENT"""
+    with _cache_lock:
+        _cache.clear()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Package model pickles into an mmap-friendly artifact directory')
+    parser.add_argument('--src', default='.', help='directory containing the *.pkl files')
+    parser.add_argument('--root', default='artifacts', help='artifact root directory')
+    parser.add_argument('--version', default=None, help='artifact version (default: timestamp)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    path = package_legacy_pickles(args.src, root=args.root, version=args.version)
+    print(f"Artifact written to {path}")
@@ -0,0 +1,270 @@
+"""Streaming drift detection on the model inputs.
+
+Every scoring path (upload, live, simulated) feeds its scaled feature matrix
+to a ``DriftMonitor``, which keeps constant-memory sketches per feature:
+
+* running count/mean/variance/min/max (Welford, merged batch-wise),
+* a fixed-size reservoir sample for approximate quantiles,
+* exponentially decayed histograms over the training quantile bins, from
+  which the Population Stability Index (PSI) against the training
+  distribution is computed.
+
+The training reference (bin edges and expected bin shares) is written into
+the model artifact manifest by ``ml.training``.  Artifacts without one fall
+back to a standard normal reference, which is what ``StandardScaler`` output
+looks like on the training data.
+
+An update is a ``searchsorted`` and a ``bincount`` per feature, so it is cheap
+enough to run on every live batch.
+"""
+import threading
+from functools import lru_cache
+import numpy as np
+from scipy.special import ndtri
+
+DRIFT_BINS = 10
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+RESERVOIR_SIZE = 1024
+EPS = 1e-4
+
+
+def build_reference(X, feature_names, bins=DRIFT_BINS):
+    """JSON-serialisable reference distribution of a (scaled) training matrix"""
+    X = np.asarray(X, dtype=np.float64)
+    quantiles = np.linspace(0, 1, bins + 1)[1:-1]
+    features = {}
+    for i, name in enumerate(feature_names):
+        edges = np.unique(np.quantile(X[:, i], quantiles))
+        counts = np.bincount(np.searchsorted(edges, X[:, i], side='right'), minlength=len(edges) + 1)
+        features[name] = {
+            'edges': edges.tolist(),
+            'expected': (counts / counts.sum()).tolist(),
+            'mean': float(X[:, i].mean()),
+            'std': float(X[:, i].std()),
+        }
+    return {'source': 'training', 'rows': int(X.shape[0]), 'features': features}
+
+
+@lru_cache(maxsize=8)
+def gaussian_reference(feature_names, bins=DRIFT_BINS):
+    """Reference for standardised features when the artifact carries none.
+
+    Cached, so every caller gets the same object for the same feature tuple.
+    """
+    edges = ndtri(np.linspace(0, 1, bins + 1)[1:-1]).tolist()
+    expected = [1.0 / bins] * bins
+    return {
+        'source': 'standard_normal',
+        'rows': 0,
+        'features': {name: {'edges': edges, 'expected': expected, 'mean': 0.0, 'std': 1.0}
+                     for name in feature_names},
+    }
+
+
+def psi(expected, actual):
+    """Population Stability Index between two bin-share vectors"""
+    expected = np.clip(np.asarray(expected, dtype=np.float64), EPS, None)
+    actual = np.clip(np.asarray(actual, dtype=np.float64), EPS, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def psi_level(value):
+    if value >= PSI_SIGNIFICANT:
+        return 'significant'
+    if value >= PSI_MODERATE:
+        return 'moderate'
+    return 'ok'
+
+
+class RunningStats:
+    """Per-column count, mean, variance, min and max, merged one batch at a time."""
+
+    def __init__(self, n_features):
+        self.count = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+        self.min = np.full(n_features, np.inf)
+        self.max = np.full(n_features, -np.inf)
+
+    def update(self, X):
+        n = X.shape[0]
+        if n == 0:
+            return
+        batch_mean = X.mean(axis=0)
+        batch_m2 = ((X - batch_mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = batch_mean - self.mean
+        # Chan et al. parallel variance: merge the batch moments into the running ones
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.min = np.minimum(self.min, X.min(axis=0))
+        self.max = np.maximum(self.max, X.max(axis=0))
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else np.zeros_like(self.m2)
+
+
+class ReservoirSketch:
+    """Uniform fixed-size sample of all rows seen, for approximate quantiles."""
+
+    def __init__(self, n_features, size=RESERVOIR_SIZE, seed=None):
+        self.size = size
+        self.sample = np.empty((size, n_features))
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, X):
+        n = X.shape[0]
+        fill = min(max(self.size - self.seen, 0), n)
+        if fill:
+            self.sample[self.seen:self.seen + fill] = X[:fill]
+        rest = X[fill:]
+        if len(rest):
+            # Algorithm R, vectorised: row t (1-based) replaces a random slot with probability size/t
+            positions = self.seen + fill + np.arange(1, len(rest) + 1)
+            slots = (self.rng.random(len(rest)) * positions).astype(np.int64)
+            keep = slots < self.size
+            self.sample[slots[keep]] = rest[keep]
+        self.seen += n
+
+    def quantiles(self, q):
+        filled = min(self.seen, self.size)
+        if not filled:
+            return None
+        return np.quantile(self.sample[:filled], q, axis=0)
+
+
+class DriftMonitor:
+    """Constant-memory drift sketches for one scoring path."""
+
+    def __init__(self, name, reference, half_life=10000, threshold=PSI_SIGNIFICANT, min_samples=500):
+        self.name = name
+        self.reference = reference
+        self.feature_names = list(reference['features'])
+        self.half_life = half_life
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.edges = [np.asarray(reference['features'][f]['edges']) for f in self.feature_names]
+        self.expected = [np.asarray(reference['features'][f]['expected']) for f in self.feature_names]
+        self.counts = [np.zeros(len(e)) for e in self.expected]
+        self.weight = 0.0
+        self.stats = RunningStats(len(self.feature_names))
+        self.reservoir = ReservoirSketch(len(self.feature_names))
+        self.drifted = set()
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def psi_values(self):
+        if self.weight <= 0:
+            return {name: 0.0 for name in self.feature_names}
+        return {name: psi(expected, counts / self.weight)
+                for name, expected, counts in zip(self.feature_names, self.expected, self.counts)}
+
+    def update(self, X):
+        """Add a batch of scaled rows; returns the drift report for the path after it"""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != len(self.feature_names):
+            raise ValueError(f"Expected {len(self.feature_names)} features, got shape {X.shape}")
+        with self._lock:
+            # Older rows fade out with the configured half-life (in rows), so PSI tracks recent data
+            decay = 0.5 ** (X.shape[0] / self.half_life) if self.half_life else 1.0
+            for i, edges in enumerate(self.edges):
+                batch = np.bincount(np.searchsorted(edges, X[:, i], side='right'), minlength=len(edges) + 1)
+                self.counts[i] = self.counts[i] * decay + batch
+            self.weight = self.weight * decay + X.shape[0]
+            self.stats.update(X)
+            self.reservoir.update(X)
+            self.batches += 1
+
+            values = self.psi_values()
+            ready = self.stats.count >= self.min_samples
+            drifted = {name for name, value in values.items() if ready and value >= self.threshold}
+            new_drift = sorted(drifted - self.drifted)
+            recovered = sorted(self.drifted - drifted)
+            self.drifted = drifted
+        return {
+            'path': self.name,
+            'psi': {name: round(value, 4) for name, value in values.items()},
+            'drifted': sorted(drifted),
+            'new_drift': new_drift,
+            'recovered': recovered,
+            'samples': int(self.stats.count),
+        }
+
+    def snapshot(self):
+        """Current sketches, reference summary and PSI per feature"""
+        with self._lock:
+            values = self.psi_values()
+            variance = self.stats.variance
+            quantiles = self.reservoir.quantiles([0.05, 0.5, 0.95])
+            features = {}
+            for i, name in enumerate(self.feature_names):
+                ref = self.reference['features'][name]
+                features[name] = {
+                    'psi': round(values[name], 4),
+                    'level': psi_level(values[name]) if self.stats.count >= self.min_samples else 'warming_up',
+                    'mean': float(self.stats.mean[i]),
+                    'std': float(np.sqrt(variance[i])),
+                    'min': float(self.stats.min[i]) if self.stats.count else None,
+                    'max': float(self.stats.max[i]) if self.stats.count else None,
+                    'p05': float(quantiles[0, i]) if quantiles is not None else None,
+                    'p50': float(quantiles[1, i]) if quantiles is not None else None,
+                    'p95': float(quantiles[2, i]) if quantiles is not None else None,
+                    'reference_mean': ref['mean'],
+                    'reference_std': ref['std'],
+                }
+            return {
+                'path': self.name,
+                'samples': int(self.stats.count),
+                'batches': self.batches,
+                'reference': self.reference.get('source'),
+                'threshold': self.threshold,
+                'drifted': sorted(self.drifted),
+                'features': features,
+            }
+
+
+def merge_reports(earlier, later):
+    """Combine the reports of consecutive batches on one path into the report for all of them.
+
+    Features that started drifting in any batch stay in ``new_drift``; PSI and
+    the drifted set are the latest ones.  Either report may be None.
+    """
+    if earlier is None or later is None:
+        return later or earlier
+    return {
+        **later,
+        'new_drift': sorted(set(earlier['new_drift']) | set(later['new_drift'])),
+        'recovered': sorted((set(earlier['recovered']) | set(later['recovered'])) - set(later['drifted'])),
+    }
+
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+def get_monitor(name, reference, **kwargs):
+    """Process-wide monitor for a scoring path, recreated when the reference changes"""
+    monitor = _monitors.get(name)
+    if monitor is None or monitor.reference is not reference:
+        with _monitors_lock:
+            monitor = _monitors.get(name)
+            if monitor is None or monitor.reference is not reference:
+                monitor = DriftMonitor(name, reference, **kwargs)
+                _monitors[name] = monitor
+    return monitor
+
+
+def all_snapshots():
+    """Snapshots of every monitor in this process, keyed by scoring path"""
+    with _monitors_lock:
+        monitors = list(_monitors.values())
+    return {monitor.name: monitor.snapshot() for monitor in monitors}
+
+
+def reset_monitors():
+    with _monitors_lock:
+        _monitors.clear()
@@ -0,0 +1,198 @@
+"""Calibrated stacking ensemble with an optional SVM cascade.
+
+Each base model's ``predict_proba`` output is Platt-calibrated on a held-out
+calibration split, then a logistic-regression stacker learns how much weight
+every calibrated model gets.  The decision threshold is the one that
+maximises F1 on the calibration split, so nothing is hard-coded.
+
+Two stackers are fitted: the *full* one over all models and a *cheap* one that
+leaves out the expensive models (the RBF SVM, whose cost grows with its
+support vectors).  In cascade mode every row is scored by the cheap stacker
+and only rows whose cheap score lies within ``band`` of the cheap threshold
+are passed to the SVM and re-scored by the full stacker.  Candidate bands
+route a growing share of the calibration rows (``CASCADE_FRACTIONS``, never
+fewer than the first) to the SVM; ``band`` is the first whose decisions agree
+with the full ensemble on at least ``agreement`` of the rows that matter:
+those either stacker flags or that are labelled anomalous.  With a few
+percent positives the plain agreement rate is near 1 without any SVM rows,
+and cheap scores cluster so tightly that fixed bands jump from none of the
+rows to most of them.  Cheap scores are shifted in logit space so that the cheap
+threshold lands on the full one, keeping every row's score on one scale.
+"""
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import (accuracy_score, precision_score, recall_score, f1_score,
+                             roc_auc_score, balanced_accuracy_score, confusion_matrix)
+
+EXPENSIVE_MODELS = ('svm',)
+# Shares of calibration rows the cascade may send to the SVM, nearest the cheap threshold first
+CASCADE_FRACTIONS = (0.05, 0.1, 0.2, 0.3, 0.5)
+EPS = 1e-6
+
+
+def _logit(p):
+    p = np.clip(np.asarray(p, dtype=np.float64), EPS, 1 - EPS)
+    return np.log(p / (1 - p))
+
+
+def best_threshold(y_true, scores):
+    """Threshold on ``scores`` that maximises F1 (ties go to the higher threshold)"""
+    candidates = np.unique(np.quantile(scores, np.linspace(0.5, 0.999, 200)))
+    best_t, best_f1 = 0.5, -1.0
+    for t in candidates:
+        f1 = f1_score(y_true, (scores >= t).astype(int), zero_division=0)
+        if f1 >= best_f1:
+            best_t, best_f1 = float(t), f1
+    return best_t
+
+
+def classification_metrics(y_true, y_pred, scores=None):
+    """Metrics in the same shape ml.training reports per model"""
+    try:
+        auc = float(roc_auc_score(y_true, scores)) if scores is not None else None
+    except ValueError:
+        auc = None
+    return {
+        'accuracy': float(accuracy_score(y_true, y_pred)),
+        'precision': float(precision_score(y_true, y_pred, zero_division=0)),
+        'recall': float(recall_score(y_true, y_pred, zero_division=0)),
+        'f1': float(f1_score(y_true, y_pred, zero_division=0)),
+        'auc': auc,
+        'balanced_accuracy': float(balanced_accuracy_score(y_true, y_pred)),
+        'confusion_matrix': confusion_matrix(y_true, y_pred, labels=[0, 1]).tolist(),
+    }
+
+
+class StackedEnsemble:
+    """Platt-calibrated base models combined by a logistic-regression stacker."""
+
+    def __init__(self, model_names, calibrators, full_stacker, full_threshold,
+                 cheap_names=None, cheap_stacker=None, cheap_threshold=None, band=None):
+        self.model_names = list(model_names)
+        self.calibrators = calibrators
+        self.full_stacker = full_stacker
+        self.full_threshold = full_threshold
+        self.cheap_names = list(cheap_names or [])
+        self.cheap_stacker = cheap_stacker
+        self.cheap_threshold = cheap_threshold
+        self.band = band
+        self.metrics = {}
+
+    @property
+    def can_cascade(self):
+        return self.cheap_stacker is not None and self.band is not None
+
+    @property
+    def weights(self):
+        """Stacker coefficients per model, normalised to sum to 1 in absolute value"""
+        coefs = self.full_stacker.coef_[0]
+        total = float(np.sum(np.abs(coefs))) or 1.0
+        return {name: float(c / total) for name, c in zip(self.model_names, coefs)}
+
+    def calibrate(self, name, raw):
+        """Map a model's raw positive-class probability to a calibrated one"""
+        return self.calibrators[name].predict_proba(_logit(raw)[:, None])[:, 1]
+
+    @staticmethod
+    def _stack(calibrated, names):
+        return np.column_stack([_logit(calibrated[n]) for n in names])
+
+    @classmethod
+    def fit(cls, models, X_cal, y_cal, agreement=0.99):
+        """Fit calibrators, stackers, thresholds and the cascade band on a calibration split"""
+        names = sorted(models)
+        raw = {n: models[n].predict_proba(X_cal)[:, 1] for n in names}
+        calibrators = {n: LogisticRegression().fit(_logit(raw[n])[:, None], y_cal) for n in names}
+        calibrated = {n: calibrators[n].predict_proba(_logit(raw[n])[:, None])[:, 1] for n in names}
+
+        full_stacker = LogisticRegression().fit(cls._stack(calibrated, names), y_cal)
+        full_scores = full_stacker.predict_proba(cls._stack(calibrated, names))[:, 1]
+        full_threshold = best_threshold(y_cal, full_scores)
+        ensemble = cls(names, calibrators, full_stacker, full_threshold)
+
+        cheap_names = [n for n in names if n not in EXPENSIVE_MODELS]
+        if cheap_names and len(cheap_names) < len(names):
+            cheap_stacker = LogisticRegression().fit(cls._stack(calibrated, cheap_names), y_cal)
+            cheap_scores = cheap_stacker.predict_proba(cls._stack(calibrated, cheap_names))[:, 1]
+            cheap_threshold = best_threshold(y_cal, cheap_scores)
+            full_pred = full_scores >= full_threshold
+            cheap_pred = cheap_scores >= cheap_threshold
+            relevant = full_pred | cheap_pred | (np.asarray(y_cal) == 1)
+            distance = np.abs(cheap_scores - cheap_threshold)
+            for fraction in CASCADE_FRACTIONS:
+                band = float(np.quantile(distance, fraction))
+                cascade_pred = np.where(distance <= band, full_pred, cheap_pred)
+                if not relevant.any() or np.mean(cascade_pred[relevant] == full_pred[relevant]) >= agreement:
+                    break
+            else:
+                band = 1.0
+            ensemble.cheap_names = cheap_names
+            ensemble.cheap_stacker = cheap_stacker
+            ensemble.cheap_threshold = cheap_threshold
+            ensemble.band = band
+        return ensemble
+
+    def _cheap_to_full_scale(self, cheap_scores):
+        """Shift cheap-stacker scores in logit space so ``cheap_threshold`` maps to ``full_threshold``"""
+        shifted = _logit(cheap_scores) - _logit(self.cheap_threshold) + _logit(self.full_threshold)
+        return 1 / (1 + np.exp(-shifted))
+
+    def predict(self, models, X, cascade=True):
+        """Score ``X``; returns per-row scores, decisions and calibrated per-model probabilities.
+
+        With ``cascade`` the expensive models only see the uncertain rows; their
+        per-model probabilities are NaN for rows they did not score.  Rows the
+        cheap stacker decided get its score mapped onto the full stacker's
+        scale, so scores compare across rows and ``full_threshold`` applies.
+        """
+        n_rows = X.shape[0]
+        calibrated = {}
+        if cascade and self.can_cascade:
+            for name in self.cheap_names:
+                calibrated[name] = self.calibrate(name, models[name].predict_proba(X)[:, 1])
+            cheap_scores = self.cheap_stacker.predict_proba(self._stack(calibrated, self.cheap_names))[:, 1]
+            prediction = (cheap_scores >= self.cheap_threshold).astype(int)
+            scores = self._cheap_to_full_scale(cheap_scores)
+            uncertain = np.flatnonzero(np.abs(cheap_scores - self.cheap_threshold) <= self.band)
+            for name in self.model_names:
+                if name not in calibrated:
+                    calibrated[name] = np.full(n_rows, np.nan)
+            if len(uncertain):
+                X_uncertain = X[uncertain]
+                subset = {name: calibrated[name][uncertain] for name in self.cheap_names}
+                for name in self.model_names:
+                    if name not in self.cheap_names:
+                        subset[name] = self.calibrate(name, models[name].predict_proba(X_uncertain)[:, 1])
+                        calibrated[name][uncertain] = subset[name]
+                full_scores = self.full_stacker.predict_proba(self._stack(subset, self.model_names))[:, 1]
+                scores[uncertain] = full_scores
+                prediction[uncertain] = (full_scores >= self.full_threshold).astype(int)
+            cascade_rows = int(len(uncertain))
+        else:
+            for name in self.model_names:
+                calibrated[name] = self.calibrate(name, models[name].predict_proba(X)[:, 1])
+            scores = self.full_stacker.predict_proba(self._stack(calibrated, self.model_names))[:, 1]
+            prediction = (scores >= self.full_threshold).astype(int)
+            cascade_rows = n_rows
+        return {
+            'scores': scores,
+            'prediction': prediction,
+            'model_probabilities': calibrated,
+            'cascade_rows': cascade_rows,
+        }
+
+    def evaluate(self, models, X_test, y_test):
+        """Measure full and cascade performance on a test split and store it on ``metrics``"""
+        full = self.predict(models, X_test, cascade=False)
+        self.metrics = {
+            'full': classification_metrics(y_test, full['prediction'], full['scores']),
+            'threshold': self.full_threshold,
+            'weights': self.weights,
+        }
+        if self.can_cascade:
+            cascaded = self.predict(models, X_test, cascade=True)
+            self.metrics['cascade'] = classification_metrics(y_test, cascaded['prediction'], cascaded['scores'])
+            self.metrics['cascade']['expensive_fraction'] = cascaded['cascade_rows'] / max(len(y_test), 1)
+            self.metrics['cascade']['band'] = self.band
+            self.metrics['cascade']['threshold'] = self.cheap_threshold
+        return self.metrics
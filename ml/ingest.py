@@ -0,0 +1,227 @@
+"""Typed CSV ingestion for uploaded transaction files.
+
+Uploads are checked while they stream to disk: ``HeaderCheck`` sees the
+first chunks, decompressing gzip/zstd on the fly, and rejects a file without
+a usable column pair before the rest of it is stored.  The analysis then
+reads the file once with its dtypes declared up front (numeric columns as
+``CSV_FLOAT_DTYPE``, float32 by default), using pyarrow's multi-threaded
+parser when it is installed and pandas' C parser otherwise.  Files too big
+for the analysis memory budget are read in chunks (``read_csv_chunks``),
+and ``estimate_rows`` sizes a file from a sample before it is read.
+"""
+import os
+import csv
+import zlib
+import logging
+from functools import lru_cache
+from config import CSV_ENGINE, CSV_FLOAT_DTYPE
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# Stored file extension per compression
+EXTENSIONS = {None: 'csv', 'gzip': 'csv.gz', 'zstd': 'csv.zst'}
+# Either pair is enough for feature extraction (see MLAnalyzer.prepare_features)
+COLUMN_SETS = (('price', 'qty'), ('close', 'volume'))
+MAX_HEADER_BYTES = 64 * 1024
+SLICE_BYTES = 16 * 1024  # compressed bytes decompressed at a time while looking for the header
+
+
+class IngestError(ValueError):
+    """Raised for uploads that cannot be analysed; the message is shown to the user."""
+
+
+def detect_compression(prefix):
+    if prefix.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if prefix.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def _decompressor(compression):
+    if compression == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise IngestError('zstd-compressed uploads need the zstandard package on the server')
+        return zstandard.ZstdDecompressor().decompressobj().decompress
+    return bytes
+
+
+class HeaderCheck:
+    """Validates the CSV header from the leading chunks of an upload.
+
+    Call ``feed`` with each chunk in order and ``finish`` at the end of the
+    stream; both raise ``IngestError`` for unusable files.  Afterwards
+    ``columns`` and ``compression`` describe the file.
+    """
+
+    def __init__(self, column_sets=COLUMN_SETS, max_header_bytes=MAX_HEADER_BYTES):
+        self.column_sets = column_sets
+        self.max_header_bytes = max_header_bytes
+        self.compression = None
+        self.columns = None
+        self._decompress = None
+        self._raw = b''
+        self._text = b''
+
+    @property
+    def done(self):
+        return self.columns is not None
+
+    def feed(self, chunk):
+        if self.done:
+            return
+        if self._decompress is None:
+            # Need the magic bytes before the compression is known
+            self._raw += chunk
+            if len(self._raw) < len(ZSTD_MAGIC):
+                return
+            chunk, self._raw = self._raw, b''
+            self._start(chunk)
+        for offset in range(0, len(chunk), SLICE_BYTES):
+            self._inflate(chunk[offset:offset + SLICE_BYTES])
+            if self._parse(final=False):
+                return
+
+    def finish(self):
+        if self.done:
+            return
+        if self._decompress is None:
+            self._start(self._raw)
+            self._inflate(self._raw)
+        self._parse(final=True)
+
+    @property
+    def extension(self):
+        return EXTENSIONS[self.compression]
+
+    def _start(self, prefix):
+        self.compression = detect_compression(prefix)
+        self._decompress = _decompressor(self.compression)
+
+    def _inflate(self, data):
+        try:
+            self._text += self._decompress(data)
+        except Exception as e:
+            raise IngestError(f'Invalid {self.compression} file: {str(e)}')
+
+    def _parse(self, final):
+        end = self._text.find(b'\n')
+        if end < 0:
+            if len(self._text) > self.max_header_bytes:
+                raise IngestError('Invalid CSV file: no header line found')
+            if not final:
+                return False
+            end = len(self._text)
+        try:
+            line = self._text[:end].decode('utf-8-sig').rstrip('\r')
+        except UnicodeDecodeError:
+            raise IngestError('Invalid CSV file: the header is not UTF-8 text')
+        columns = next(csv.reader([line]), [])
+        if not any(all(name in columns for name in pair) for pair in self.column_sets):
+            raise IngestError('Invalid CSV headers. Expected columns: '
+                              + ' OR '.join(' & '.join(pair) for pair in self.column_sets) + '.')
+        self.columns = columns
+        self._text = b''
+        return True
+
+
+def sniff_file(path, chunk_size=64 * 1024):
+    """Run ``HeaderCheck`` over a stored file"""
+    check = HeaderCheck()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            check.feed(chunk)
+            if check.done:
+                break
+    check.finish()
+    return check
+
+
+@lru_cache(maxsize=None)
+def parser_engine(preference=CSV_ENGINE):
+    """'pyarrow' when requested or available ('auto'), else pandas' C parser"""
+    if preference not in ('auto', 'pyarrow'):
+        return preference
+    try:
+        import pyarrow  # noqa: F401
+        return 'pyarrow'
+    except ImportError:
+        if preference == 'pyarrow':
+            logger.warning("CSV_ENGINE=pyarrow but pyarrow is not installed; using the C parser")
+        return 'c'
+
+
+def analysis_columns(columns):
+    """Columns the analysis needs (None = all): prepare_features only reads price/qty when both are present"""
+    if 'price' in columns and 'qty' in columns:
+        return ['price', 'qty']
+    return None
+
+
+def _read_options(path, columns, compression, float_dtype):
+    if columns is None:
+        check = sniff_file(path)
+        columns, compression = check.columns, check.compression
+    usecols = analysis_columns(columns)
+    # The column pairs must be numeric; other columns are inferred and downcast afterwards
+    dtype = {name: float_dtype for pair in COLUMN_SETS for name in pair if name in (usecols or columns)}
+    return {'usecols': usecols, 'dtype': dtype, 'compression': compression}
+
+
+def _downcast(df, dtype, float_dtype):
+    import numpy as np
+    for name in df.columns:
+        if name not in dtype and df[name].dtype == np.float64:
+            df[name] = df[name].astype(float_dtype)
+    return df
+
+
+def read_csv(path, columns=None, compression=None, float_dtype=CSV_FLOAT_DTYPE):
+    """Read a transaction CSV in one pass with declared dtypes.
+
+    ``columns``/``compression`` come from the upload's ``HeaderCheck``; the
+    file is sniffed again only when they are not given.
+    """
+    import pandas as pd
+    options = _read_options(path, columns, compression, float_dtype)
+    try:
+        df = pd.read_csv(path, engine=parser_engine(), **options)
+    except (ValueError, pd.errors.ParserError) as e:
+        raise IngestError(f'Invalid CSV file: {str(e)}')
+    return _downcast(df, options['dtype'], float_dtype)
+
+
+def read_csv_chunks(path, chunk_rows, columns=None, compression=None, float_dtype=CSV_FLOAT_DTYPE):
+    """``read_csv`` as frames of at most ``chunk_rows`` rows, for files too large to analyse at once"""
+    import pandas as pd
+    options = _read_options(path, columns, compression, float_dtype)
+    try:
+        # pyarrow's parser cannot stream; the C parser can
+        for chunk in pd.read_csv(path, engine='c', chunksize=chunk_rows, **options):
+            yield _downcast(chunk, options['dtype'], float_dtype)
+    except (ValueError, pd.errors.ParserError) as e:
+        raise IngestError(f'Invalid CSV file: {str(e)}')
+
+
+def estimate_rows(path, compression=None, sample_bytes=256 * 1024):
+    """Approximate row count from the line length and compression ratio of the file's first bytes"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        raw = f.read(sample_bytes)
+    try:
+        text = _decompressor(compression)(raw)
+    except Exception as e:
+        raise IngestError(f'Invalid {compression} file: {str(e)}')
+    lines = text.count(b'\n')
+    if not raw or not lines:
+        return 0
+    if len(raw) == size:
+        # The sample is the whole file
+        return max(0, lines - 1) if text.endswith(b'\n') else lines
+    return int(size * (len(text) / len(raw)) / (len(text) / lines))
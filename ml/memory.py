@@ -0,0 +1,160 @@
+"""Memory accounting and budgets for CSV analyses.
+
+A full analysis holds the frame, the feature matrix and its scaled copy,
+the per-model probability and prediction arrays, their list conversions
+and finally the JSON string, all at once; a big enough upload used to get
+the worker OOM-killed.  ``MemoryTracker`` measures an analysis stage by
+stage: seconds, resident set size (RSS) at the end of the stage, the peak
+RSS a sampling thread saw while it ran and, with ``MEMORY_TRACEMALLOC``,
+the stage's peak traced allocation (Python objects and numpy buffers).
+
+RSS is the whole process's, so analyses running at the same time show up
+in each other's numbers; budgets are therefore checked against growth
+since the analysis started, and only between stages.  ``check`` raises
+``MemoryBudgetExceeded`` so the caller can drop what it holds and fall
+back to chunked analysis, or refuse the file, instead of being killed.
+"""
+import os
+import time
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from config import MEMORY_TRACEMALLOC, MEMORY_SAMPLE_SECONDS
+from ml.ingest import IngestError
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Peak traced bytes per row of a full analysis plus its results JSON, measured on 200k-row uploads
+# (~500 for the analysis, ~100 for the JSON), rounded up for allocator overhead
+FULL_BYTES_PER_ROW = 768
+
+_trace_users = 0
+_trace_lock = threading.Lock()
+
+
+class MemoryBudgetExceeded(IngestError):
+    """The analysis would use, or is using, more memory than its budget allows."""
+
+
+def current_rss():
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def estimate_full_bytes(rows):
+    """Expected memory growth of analysing ``rows`` rows in one piece"""
+    return rows * FULL_BYTES_PER_ROW
+
+
+def _start_tracing():
+    global _trace_users
+    with _trace_lock:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _trace_users += 1
+
+
+def _stop_tracing():
+    global _trace_users
+    with _trace_lock:
+        _trace_users -= 1
+        if _trace_users == 0:
+            tracemalloc.stop()
+
+
+class MemoryTracker:
+    """Per-stage time and memory of one analysis, with an optional budget on RSS growth."""
+
+    def __init__(self, budget_bytes=None, sample_seconds=MEMORY_SAMPLE_SECONDS, trace=MEMORY_TRACEMALLOC):
+        self.budget_bytes = budget_bytes or None
+        self.sample_seconds = sample_seconds
+        self.trace = trace
+        self.stages = {}
+        self.baseline = 0
+        self.peak = 0
+        self._budget_baseline = self._budget_peak = 0
+        self._stage_peak = 0
+        self._stop_event = threading.Event()
+        self._sampler = None
+
+    def __enter__(self):
+        self.baseline = self.peak = self._stage_peak = current_rss()
+        self._budget_baseline = self._budget_peak = self.baseline
+        if self.trace:
+            _start_tracing()
+        if self.sample_seconds > 0:
+            self._sampler = threading.Thread(target=self._sample, name='memory-sampler', daemon=True)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop_event.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self._observe(current_rss())
+        if self.trace:
+            _stop_tracing()
+        return False
+
+    def _observe(self, rss):
+        self.peak = max(self.peak, rss)
+        self._budget_peak = max(self._budget_peak, rss)
+        self._stage_peak = max(self._stage_peak, rss)
+
+    def _sample(self):
+        while not self._stop_event.wait(self.sample_seconds):
+            self._observe(current_rss())
+
+    @contextmanager
+    def stage(self, name):
+        """Measure a stage; repeated names (e.g. one per chunk) are aggregated"""
+        self._stage_peak = current_rss()
+        if self.trace:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            rss = current_rss()
+            self._observe(rss)
+            entry = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0, 'rss_mb': 0.0, 'peak_rss_mb': 0.0})
+            entry['count'] += 1
+            entry['seconds'] = round(entry['seconds'] + time.perf_counter() - started, 4)
+            entry['rss_mb'] = round(rss / MB, 1)
+            entry['peak_rss_mb'] = max(entry['peak_rss_mb'], round(self._stage_peak / MB, 1))
+            if self.trace:
+                traced = round(tracemalloc.get_traced_memory()[1] / MB, 1)
+                entry['peak_traced_mb'] = max(entry.get('peak_traced_mb', 0.0), traced)
+
+    def growth(self):
+        """Bytes the process has grown by since the analysis started (or the last ``rebase``)"""
+        self._observe(current_rss())
+        return self._budget_peak - self._budget_baseline
+
+    def rebase(self):
+        """Check the budget against growth from now on, e.g. after dropping a failed attempt's data"""
+        self._budget_baseline = self._budget_peak = current_rss()
+
+    def check(self):
+        """Raise ``MemoryBudgetExceeded`` once growth has passed the budget"""
+        if self.budget_bytes is None:
+            return
+        growth = self.growth()
+        if growth > self.budget_bytes:
+            raise MemoryBudgetExceeded(f"Analysis used {growth / MB:.0f} MB, over its "
+                                       f"{self.budget_bytes / MB:.0f} MB memory budget")
+
+    def report(self):
+        return {
+            'baseline_rss_mb': round(self.baseline / MB, 1),
+            'peak_rss_mb': round(self.peak / MB, 1),
+            'growth_mb': round((self.peak - self.baseline) / MB, 1),
+            'stages': self.stages,
+        }
@@ -0,0 +1,174 @@
+"""Anomaly ranking: top-k selection and score-based severity.
+
+Every analysis stores the ``k`` highest-scoring flagged rows and a severity
+breakdown with its results, so the results page and the PDF report can show
+the true top anomalies without sorting every row.  Top-k uses
+``np.argpartition`` (linear time) and sorts only the selected rows.
+
+Severity reflects where a flagged row's ensemble score falls in the score
+distribution of the whole file: rows above the 99.9th percentile are
+Critical, above the 99th High, above the 95th Medium, and the rest Low.
+
+Files analysed in chunks use ``StreamingRanking``: a bounded heap keeps the
+exact top k across chunks, and scores are spilled to a temporary file
+instead of being kept in memory, so the severities match a single pass
+without memory growing with the file.
+"""
+import heapq
+import tempfile
+import numpy as np
+from config import RESULTS_TOP_K
+
+SEVERITY_LEVELS = ('Low', 'Medium', 'High', 'Critical')
+SEVERITY_QUANTILES = (0.95, 0.99, 0.999)
+# Histogram bins over [0, 1] for streamed scores, to find the values at the severity quantiles
+SCORE_BINS = 100000
+# Rows read back from the spill file at a time
+SPILL_BLOCK_ROWS = 1 << 20
+_SPILL_DTYPE = np.dtype([('score', np.float64), ('flagged', np.bool_)])
+
+
+def top_k(values, k):
+    """Positions of the ``k`` largest values, largest first"""
+    values = np.asarray(values)
+    if k <= 0 or not len(values):
+        return np.empty(0, dtype=np.int64)
+    if k >= len(values):
+        return np.argsort(-values, kind='stable')
+    part = np.argpartition(-values, k - 1)[:k]
+    return part[np.argsort(-values[part], kind='stable')]
+
+
+def rank_anomalies(scores, flagged, k=RESULTS_TOP_K, quantiles=SEVERITY_QUANTILES):
+    """Top-k flagged rows with severities, plus severity counts over all flagged rows"""
+    scores = np.asarray(scores, dtype=np.float64)
+    indices = np.flatnonzero(np.asarray(flagged, dtype=bool))
+    thresholds = np.quantile(scores, quantiles) if len(scores) else np.zeros(len(quantiles))
+    flagged_scores = scores[indices]
+    levels = np.searchsorted(thresholds, flagged_scores, side='right')
+    counts = np.bincount(levels, minlength=len(SEVERITY_LEVELS))
+    top = top_k(flagged_scores, k)
+    return {
+        'top': [{'index': int(indices[p]), 'score': round(float(flagged_scores[p]), 6),
+                 'severity': SEVERITY_LEVELS[levels[p]]} for p in top],
+        'severity_counts': {level: int(count) for level, count in zip(SEVERITY_LEVELS, counts)},
+        'severity_thresholds': [round(float(t), 6) for t in thresholds],
+        'k': k
+    }
+
+
+class TopK:
+    """The ``k`` highest (score, row) pairs pushed so far, in a min-heap of at most ``k`` items."""
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []
+
+    def push_many(self, scores, rows):
+        if self.k <= 0 or not len(scores):
+            return
+        if len(scores) > self.k:
+            # At most k of a batch can make it into the heap
+            keep = top_k(scores, self.k)
+            scores, rows = scores[keep], rows[keep]
+        for score, row in zip(scores.tolist(), rows.tolist()):
+            # On equal scores the earlier row ranks first, as with the stable sort in top_k
+            item = (score, -row)
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, item)
+            elif item > self._heap[0]:
+                heapq.heapreplace(self._heap, item)
+
+    def items(self):
+        """``(score, row)`` pairs, highest first"""
+        return [(score, -negative_row) for score, negative_row in sorted(self._heap, reverse=True)]
+
+
+class StreamingRanking:
+    """``rank_anomalies`` over scores that arrive in chunks, with the same severity counts.
+
+    A bounded heap keeps the top k, and a fine histogram of all scores
+    locates the bins holding each severity quantile.  Scores and flags are
+    spilled to a temporary file rather than kept in memory; ``result`` reads
+    it back to take the exact ``np.quantile`` values from those bins and to
+    compare every flagged score with them, as ``rank_anomalies`` does.  The
+    spill file is already unlinked, and ``result`` closes it.
+    """
+
+    def __init__(self, k=RESULTS_TOP_K, quantiles=SEVERITY_QUANTILES, bins=SCORE_BINS):
+        self.k = k
+        self.quantiles = quantiles
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.top = TopK(k)
+        self._spill = tempfile.TemporaryFile(prefix='ranking-', suffix='.bin')
+
+    def _bin(self, scores):
+        return np.clip((scores * self.bins).astype(np.int64), 0, self.bins - 1)
+
+    def update(self, scores, flagged, offset):
+        """Add a chunk whose first row is row ``offset`` of the file"""
+        records = np.empty(len(scores), dtype=_SPILL_DTYPE)
+        records['score'] = scores
+        records['flagged'] = flagged
+        self.counts += np.bincount(self._bin(records['score']), minlength=self.bins)
+        positions = np.flatnonzero(records['flagged'])
+        self.top.push_many(records['score'][positions], positions + offset)
+        records.tofile(self._spill)
+
+    def _blocks(self):
+        self._spill.flush()
+        self._spill.seek(0)
+        while True:
+            block = np.fromfile(self._spill, dtype=_SPILL_DTYPE, count=SPILL_BLOCK_ROWS)
+            if not len(block):
+                return
+            yield block
+
+    def thresholds(self):
+        """The severity quantiles of all scores, as ``np.quantile`` computes them"""
+        total = int(self.counts.sum())
+        if not total:
+            return np.zeros(len(self.quantiles))
+        # np.quantile interpolates between the sorted values at these ranks
+        positions = np.asarray(self.quantiles, dtype=np.float64) * (total - 1)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.minimum(lower + 1, total - 1)
+        cumulative = np.cumsum(self.counts)
+        lower_bins = np.searchsorted(cumulative, lower, side='right')
+        upper_bins = np.searchsorted(cumulative, upper, side='right')
+        wanted = np.unique(np.concatenate([lower_bins, upper_bins]))
+        values = {int(b): [] for b in wanted}
+        for block in self._blocks():
+            bins = self._bin(block['score'])
+            for b in values:
+                values[b].append(block['score'][bins == b])
+        values = {b: np.sort(np.concatenate(parts)) for b, parts in values.items()}
+
+        def value_at(rank, b):
+            return values[b][rank - (cumulative[b] - self.counts[b])]
+
+        result = []
+        for position, lo, hi, lo_bin, hi_bin in zip(positions, lower, upper, lower_bins, upper_bins):
+            a, b = value_at(lo, int(lo_bin)), value_at(hi, int(hi_bin))
+            result.append(a + (b - a) * (position - lo))
+        return np.array(result)
+
+    def result(self):
+        """The ranking, in ``rank_anomalies``' format; call once, after the last ``update``"""
+        thresholds = self.thresholds()
+        counts = np.zeros(len(SEVERITY_LEVELS), dtype=np.int64)
+        for block in self._blocks():
+            flagged_scores = block['score'][block['flagged']]
+            levels = np.searchsorted(thresholds, flagged_scores, side='right')
+            counts += np.bincount(levels, minlength=len(SEVERITY_LEVELS))
+        self._spill.close()
+        top = self.top.items()
+        levels = np.searchsorted(thresholds, [score for score, _ in top], side='right')
+        return {
+            'top': [{'index': int(row), 'score': round(float(score), 6), 'severity': SEVERITY_LEVELS[level]}
+                    for (score, row), level in zip(top, levels)],
+            'severity_counts': {level: int(count) for level, count in zip(SEVERITY_LEVELS, counts)},
+            'severity_thresholds': [round(float(t), 6) for t in thresholds],
+            'k': self.k
+        }
@@ -0,0 +1,143 @@
+"""Streaming anomaly detector for raw trade ticks.
+
+The supervised models were trained on daily blockchain aggregates, so single
+trades are far outside what they have seen.  ``TickDetector`` learns each
+symbol's own trade flow online instead.  For every trade it keeps
+exponentially weighted estimates of the location and scale of
+
+* the log return against the previous trade, and
+* the log trade size,
+
+and scores the trade by the larger of the two robust z-scores.  The scale is
+an EWMA of absolute deviations (a running MAD).  Updates are winsorized at
+``clip`` scales, so an outlier is scored at full strength but moves the
+baseline only a little.  Each trade costs O(1) time and the state is a few
+floats, however long the stream runs.
+
+``get_detector`` keeps one detector per stream (e.g. ``live:BTCUSDT``) for
+the life of the process, like the drift monitors in ``ml.drift``.
+"""
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import TICK_HALF_LIFE_TRADES, TICK_Z_THRESHOLD, TICK_WARMUP_TRADES
+
+FEATURES = ('log_return', 'log_size')
+# Scale floors: a return of 0.2bp or a 5% size change is never extreme on its own
+MIN_SCALE = (2e-5, 0.05)
+MAD_TO_SIGMA = math.sqrt(math.pi / 2)  # E|x - mean| = sigma * sqrt(2/pi) for a normal distribution
+RECENT_SCORES = 4096  # scores kept for trades that may be fetched again
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+
+class TickDetector:
+    """Online robust z-score detector over one stream of trades."""
+
+    def __init__(self, half_life=TICK_HALF_LIFE_TRADES, threshold=TICK_Z_THRESHOLD,
+                 warmup=TICK_WARMUP_TRADES, clip=3.0):
+        self.alpha = 1.0 - 0.5 ** (1.0 / half_life)
+        self.threshold = threshold
+        self.warmup = warmup
+        self.clip = clip
+        self.count = 0
+        self.last_price = None
+        self.last_trade_id = None
+        self.mean = [0.0, 0.0]
+        self.dev = [0.0, 0.0]
+        self.anomalies = 0
+        self.recent = OrderedDict()  # trade id -> z-score, bounded by RECENT_SCORES
+        self.lock = threading.Lock()
+
+    def probability(self, z):
+        """Map z-scores onto [0, 1) so that ``threshold`` lands on 0.5"""
+        z = np.asarray(z, dtype=np.float64)
+        return z * z / (z * z + self.threshold * self.threshold)
+
+    def update(self, prices, qtys, trade_ids=None):
+        """Score trades in order, learning from the ones not seen before; returns z-scores.
+
+        With ``trade_ids``, trades up to the last id already processed are not
+        learned again: they get their earlier score (0 once it has aged out).
+        """
+        # Plain lists: indexing numpy arrays one element at a time is several times slower
+        prices = np.asarray(prices, dtype=np.float64).tolist()
+        qtys = np.asarray(qtys, dtype=np.float64).tolist()
+        if trade_ids is not None:
+            trade_ids = np.asarray(trade_ids, dtype=np.int64).tolist()
+        z_scores = [0.0] * len(prices)
+        with self.lock:
+            alpha, clip, warmup = self.alpha, self.clip, self.warmup
+            mean_r, mean_s = self.mean
+            dev_r, dev_s = self.dev
+            floor_r, floor_s = MIN_SCALE
+            last_price, count, last_id = self.last_price, self.count, self.last_trade_id
+            recent = self.recent
+            flagged = 0
+            log = math.log
+            for i in range(len(prices)):
+                if trade_ids is not None:
+                    trade_id = trade_ids[i]
+                    if last_id is not None and trade_id <= last_id:
+                        z_scores[i] = recent.get(trade_id, 0.0)
+                        continue
+                    last_id = trade_id
+                price, qty = prices[i], qtys[i]
+                if not (price > 0 and qty > 0):
+                    continue
+                ret = log(price / last_price) if last_price else 0.0
+                size = log(qty)
+                last_price = price
+                scale_r = max(dev_r * MAD_TO_SIGMA, floor_r)
+                scale_s = max(dev_s * MAD_TO_SIGMA, floor_s)
+                err_r = ret - mean_r
+                err_s = size - mean_s
+                z = max(abs(err_r) / scale_r, abs(err_s) / scale_s)
+                count += 1
+                # Plain running averages while warming up, so the baseline is settled when scoring starts
+                rate = alpha if count > warmup else 1.0 / count
+                if count > warmup:
+                    z_scores[i] = z
+                    flagged += z >= self.threshold
+                    # Winsorize so outliers only nudge the baseline
+                    limit_r, limit_s = clip * scale_r, clip * scale_s
+                    err_r = min(max(err_r, -limit_r), limit_r)
+                    err_s = min(max(err_s, -limit_s), limit_s)
+                mean_r += rate * err_r
+                mean_s += rate * err_s
+                dev_r += rate * (abs(err_r) - dev_r)
+                dev_s += rate * (abs(err_s) - dev_s)
+                if trade_ids is not None:
+                    recent[last_id] = z_scores[i]
+                    if len(recent) > RECENT_SCORES:
+                        recent.popitem(last=False)
+            self.mean = [mean_r, mean_s]
+            self.dev = [dev_r, dev_s]
+            self.last_price, self.count, self.last_trade_id = last_price, count, last_id
+            self.anomalies += flagged
+        return np.asarray(z_scores)
+
+    def snapshot(self):
+        return {
+            'trades': self.count,
+            'anomalies': self.anomalies,
+            'warmed_up': self.count > self.warmup,
+            'location': dict(zip(FEATURES, (round(v, 8) for v in self.mean))),
+            'scale': dict(zip(FEATURES, (round(max(d * MAD_TO_SIGMA, f), 8) for d, f in zip(self.dev, MIN_SCALE)))),
+            'threshold': self.threshold
+        }
+
+
+def get_detector(name):
+    """The process-wide detector for stream ``name``, created on first use"""
+    detector = _detectors.get(name)
+    if detector is None:
+        with _detectors_lock:
+            detector = _detectors.setdefault(name, TickDetector())
+    return detector
+
+
+def all_snapshots():
+    return {name: detector.snapshot() for name, detector in list(_detectors.items())}
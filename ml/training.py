@@ -0,0 +1,274 @@
+"""Offline training pipeline for the anomaly detection models.
+
+This is the command-line version of ``MLcode.ipynb``: it reads the labelled
+dataset, forward-fills gaps, splits train/test (stratified), standardises the
+features, balances the training set with SMOTE and fits SVM, Random Forest,
+AdaBoost and XGBoost in parallel.  A calibrated stacking ensemble (see
+``ml/ensemble.py``) is then fitted on a held-out calibration split.  The
+fitted models and ensemble are written as a new versioned artifact (see
+``ml/artifacts.py``) together with their test-set metrics and the reference
+feature distribution used for drift monitoring (``ml/drift.py``).
+
+Preprocessed matrices are cached under ``<root>/.cache`` keyed by the dataset
+checksum and preprocessing parameters, so re-running with the same data skips
+the CSV parsing, scaling and SMOTE steps.
+
+Usage::
+
+    python -m ml.training --data "Dataset/Dataset 2.csv" --n-jobs -1
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+import joblib
+from joblib import Parallel, delayed
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier
+from sklearn.metrics import (accuracy_score, precision_score, recall_score, f1_score,
+                             confusion_matrix, roc_auc_score, balanced_accuracy_score)
+import xgboost as xgb
+from ml.artifacts import FEATURE_SCHEMA, LEGACY_MODEL_FILES, LEGACY_SCALER_FILE, file_checksum, package_models
+from ml.ensemble import StackedEnsemble
+from ml.drift import build_reference
+
+logger = logging.getLogger(__name__)
+
+# Dataset/Dataset.csv has no label column; the labelled export is Dataset 2.csv
+DEFAULT_DATASET = os.path.join('Dataset', 'Dataset 2.csv')
+LABEL_COLUMN = 'Anomaly'
+TEST_SIZE = 0.2
+# Share of the training split held out (before SMOTE) to calibrate and stack the ensemble
+CALIBRATION_SIZE = 0.2
+RANDOM_STATE = 42
+
+# Hyperparameters used in MLcode.ipynb
+DEFAULT_PARAMS = {
+    'svm': {'kernel': 'rbf', 'C': 1.0, 'gamma': 'scale'},
+    'random_forest': {'n_estimators': 100},
+    'adaboost': {'n_estimators': 100},
+    'xgboost': {'n_estimators': 100},
+}
+
+
+def cache_key(dataset_path, features, label, test_size, random_state, calibration_size=CALIBRATION_SIZE):
+    """Key a preprocessing run by dataset contents and preprocessing parameters"""
+    params = json.dumps({
+        'dataset': file_checksum(dataset_path),
+        'features': list(features),
+        'label': label,
+        'test_size': test_size,
+        'calibration_size': calibration_size,
+        'random_state': random_state,
+        'smote': True,
+    }, sort_keys=True)
+    return hashlib.sha256(params.encode('utf-8')).hexdigest()[:16]
+
+
+def read_dataset(dataset_path, features, label):
+    """Read the training CSV and return (X, y) as float64 / int arrays"""
+    df = pd.read_csv(dataset_path)
+    df.ffill(inplace=True)
+    missing = [col for col in list(features) + [label] if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required columns in {dataset_path}: {missing}")
+    X = df[list(features)].to_numpy(dtype=np.float64)
+    y = df[label].to_numpy(dtype=np.int64)
+    return X, y
+
+
+def prepare_data(dataset_path=DEFAULT_DATASET, cache_dir=None, features=None, label=LABEL_COLUMN,
+                 test_size=TEST_SIZE, random_state=RANDOM_STATE, calibration_size=CALIBRATION_SIZE):
+    """Return scaled train (SMOTE-balanced), calibration and test matrices, using the on-disk cache when possible"""
+    features = features or FEATURE_SCHEMA['features']
+    key = cache_key(dataset_path, features, label, test_size, random_state, calibration_size)
+    entry_dir = os.path.join(cache_dir, key) if cache_dir else None
+    matrices_path = os.path.join(entry_dir, 'matrices.npz') if entry_dir else None
+    scaler_path = os.path.join(entry_dir, 'scaler.joblib') if entry_dir else None
+
+    if matrices_path and os.path.exists(matrices_path) and os.path.exists(scaler_path):
+        logger.info(f"Using cached feature matrices {entry_dir}")
+        with np.load(matrices_path) as cached:
+            data = {name: cached[name] for name in cached.files}
+        data['scaler'] = joblib.load(scaler_path)
+        data['cache_key'] = key
+        return data
+
+    from imblearn.over_sampling import SMOTE
+
+    X, y = read_dataset(dataset_path, features, label)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=test_size, stratify=y, random_state=random_state)
+    X_train, X_cal, y_train, y_cal = train_test_split(
+        X_train, y_train, test_size=calibration_size, stratify=y_train, random_state=random_state)
+
+    # Fit on a DataFrame so the scaler records the column names, as in the notebook
+    scaler = StandardScaler().fit(pd.DataFrame(X_train, columns=list(features)))
+    X_train_scaled = scaler.transform(pd.DataFrame(X_train, columns=list(features)))
+    X_cal_scaled = scaler.transform(pd.DataFrame(X_cal, columns=list(features)))
+    X_test_scaled = scaler.transform(pd.DataFrame(X_test, columns=list(features)))
+
+    X_train_bal, y_train_bal = SMOTE(random_state=random_state).fit_resample(X_train_scaled, y_train)
+
+    data = {
+        'X_train': X_train_bal,
+        'y_train': y_train_bal,
+        'X_cal': X_cal_scaled,
+        'y_cal': y_cal,
+        'X_test': X_test_scaled,
+        'y_test': y_test,
+    }
+    if entry_dir:
+        os.makedirs(entry_dir, exist_ok=True)
+        np.savez(matrices_path, **data)
+        joblib.dump(scaler, scaler_path, compress=0)
+    data['scaler'] = scaler
+    data['cache_key'] = key
+    return data
+
+
+def build_model(name, params=None, n_jobs=1, random_state=RANDOM_STATE):
+    """Create one unfitted estimator; ``n_jobs`` is the thread count for RF/XGBoost"""
+    params = dict(DEFAULT_PARAMS[name] if params is None else params)
+    if name == 'svm':
+        params.setdefault('probability', True)
+        return SVC(random_state=random_state, **params)
+    if name == 'random_forest':
+        return RandomForestClassifier(random_state=random_state, n_jobs=n_jobs, **params)
+    if name == 'adaboost':
+        return AdaBoostClassifier(random_state=random_state, **params)
+    if name == 'xgboost':
+        return xgb.XGBClassifier(random_state=random_state, n_jobs=n_jobs, **params)
+    raise ValueError(f"Unknown model {name}")
+
+
+def build_models(params=None, n_jobs=1, random_state=RANDOM_STATE):
+    """Create all unfitted estimators, using DEFAULT_PARAMS for models missing from ``params``"""
+    params = params or {}
+    return {name: build_model(name, params.get(name), n_jobs=n_jobs, random_state=random_state)
+            for name in DEFAULT_PARAMS}
+
+
+def compute_metrics(model, X_test, y_test):
+    """Test-set metrics matching the notebook's compute_metrics"""
+    y_pred = model.predict(X_test)
+    try:
+        auc = float(roc_auc_score(y_test, model.predict_proba(X_test)[:, 1]))
+    except (AttributeError, ValueError):
+        auc = None
+    return {
+        'accuracy': float(accuracy_score(y_test, y_pred)),
+        'precision': float(precision_score(y_test, y_pred, zero_division=0)),
+        'recall': float(recall_score(y_test, y_pred, zero_division=0)),
+        'f1': float(f1_score(y_test, y_pred, zero_division=0)),
+        'auc': auc,
+        'balanced_accuracy': float(balanced_accuracy_score(y_test, y_pred)),
+        'confusion_matrix': confusion_matrix(y_test, y_pred, labels=[0, 1]).tolist(),
+    }
+
+
+def _fit_model(name, model, X, y):
+    start = time.time()
+    model.fit(X, y)
+    return name, model, time.time() - start
+
+
+def train_models(data, params=None, n_jobs=-1):
+    """Fit all models in parallel, one process per model"""
+    n_cores = joblib.cpu_count() if n_jobs in (None, -1) else max(1, n_jobs)
+    models = build_models(params, n_jobs=max(1, n_cores // 4))
+    fitted = Parallel(n_jobs=min(len(models), n_cores))(
+        delayed(_fit_model)(name, model, data['X_train'], data['y_train'])
+        for name, model in models.items()
+    )
+    results = {}
+    fit_seconds = {}
+    for name, model, seconds in fitted:
+        results[name] = model
+        fit_seconds[name] = round(seconds, 3)
+        logger.info(f"Trained {name} in {seconds:.2f}s")
+    return results, fit_seconds
+
+
+def run_pipeline(dataset_path=DEFAULT_DATASET, root='artifacts', version=None, n_jobs=-1,
+                 params=None, use_cache=True, export_pickles=None):
+    """Train all models and write a versioned artifact with metrics; returns its path"""
+    cache_dir = os.path.join(root, '.cache') if use_cache else None
+    data = prepare_data(dataset_path, cache_dir=cache_dir)
+    models, fit_seconds = train_models(data, params=params, n_jobs=n_jobs)
+
+    metrics = {name: compute_metrics(model, data['X_test'], data['y_test'])
+               for name, model in models.items()}
+    for name, values in metrics.items():
+        logger.info(f"{name}: accuracy={values['accuracy']:.4f} f1={values['f1']:.4f}")
+
+    ensemble = StackedEnsemble.fit(models, data['X_cal'], data['y_cal'])
+    metrics['ensemble'] = ensemble.evaluate(models, data['X_test'], data['y_test'])
+    logger.info(f"ensemble: accuracy={metrics['ensemble']['full']['accuracy']:.4f} "
+                 f"f1={metrics['ensemble']['full']['f1']:.4f} weights={metrics['ensemble']['weights']}")
+    if 'cascade' in metrics['ensemble']:
+        cascade = metrics['ensemble']['cascade']
+        logger.info(f"cascade: accuracy={cascade['accuracy']:.4f} f1={cascade['f1']:.4f} "
+                     f"svm_rows={cascade['expensive_fraction']:.1%}")
+
+    extra = {
+        'source': 'ml.training',
+        'metrics': metrics,
+        # The calibration split is scaled but not SMOTE-resampled, so it follows the training distribution
+        'drift_reference': build_reference(data['X_cal'], FEATURE_SCHEMA['features']),
+        'dataset': {
+            'path': dataset_path,
+            'sha256': file_checksum(dataset_path),
+            'label': LABEL_COLUMN,
+            'test_size': TEST_SIZE,
+            'calibration_size': CALIBRATION_SIZE,
+            'random_state': RANDOM_STATE,
+            'train_rows': int(len(data['y_train'])),
+            'calibration_rows': int(len(data['y_cal'])),
+            'test_rows': int(len(data['y_test'])),
+        },
+        'training': {
+            'params': params or DEFAULT_PARAMS,
+            'fit_seconds': fit_seconds,
+            'cache_key': data['cache_key'],
+        },
+    }
+    artifact_dir = package_models(models, data['scaler'], root=root, version=version, extra=extra,
+                                  objects={'ensemble': ensemble})
+    with open(os.path.join(artifact_dir, 'metrics.json'), 'w', encoding='utf-8') as fh:
+        json.dump(metrics, fh, indent=2)
+
+    if export_pickles:
+        for name, model in models.items():
+            joblib.dump(model, os.path.join(export_pickles, LEGACY_MODEL_FILES[name]))
+        joblib.dump(data['scaler'], os.path.join(export_pickles, LEGACY_SCALER_FILE))
+    return artifact_dir
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Train the BTCSleuth anomaly detection models')
+    parser.add_argument('--data', default=DEFAULT_DATASET, help='labelled training CSV')
+    parser.add_argument('--root', default='artifacts', help='artifact root directory')
+    parser.add_argument('--version', default=None, help='artifact version (default: timestamp)')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='CPU cores to use (-1 = all)')
+    parser.add_argument('--params', default=None, help='JSON file with per-model hyperparameters')
+    parser.add_argument('--no-cache', action='store_true', help='recompute preprocessed matrices')
+    parser.add_argument('--export-pickles', default=None, metavar='DIR',
+                        help='also write legacy *_model.pkl/scaler.pkl files to DIR')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    params = None
+    if args.params:
+        with open(args.params, encoding='utf-8') as fh:
+            params = json.load(fh)
+    path = run_pipeline(args.data, root=args.root, version=args.version, n_jobs=args.n_jobs,
+                        params=params, use_cache=not args.no_cache, export_pickles=args.export_pickles)
+    print(f"Artifact written to {path}")
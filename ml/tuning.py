@@ -0,0 +1,325 @@
+"""Cross-validated hyperparameter search with successive halving.
+
+Every model family has a small search space plus a *resource* that grows
+across halving rungs: ``n_estimators`` for the tree ensembles and boosting
+models, the fraction of training rows for the SVM.  All candidates start on
+the smallest budget; after each rung only the best ``1/eta`` survive to be
+re-evaluated on a larger one.  XGBoost candidates additionally stop adding
+trees once the loss on an inner holdout, split from the training fold
+before SMOTE, stops improving (``early_stopping_rounds``); the validation
+fold is only used for scoring, as with the other families.
+
+Fold splits are prepared once: each fold's scaled, SMOTE-resampled training
+set, scaled validation set and XGBoost's fit/stop split are written as
+``.npy`` files under ``<root>/.cache/folds/<key>/`` and memory-mapped by the
+worker processes, so no candidate repeats the scaling/SMOTE work and
+workers share the pages.
+
+Usage::
+
+    python -m ml.tuning --data "Dataset/Dataset 2.csv" --n-jobs -1
+    python -m ml.training --params artifacts/tuning/best_params.json
+"""
+import os
+import json
+import math
+import time
+import hashlib
+import logging
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sklearn.preprocessing import StandardScaler
+from sklearn.utils import resample
+from sklearn.metrics import f1_score, balanced_accuracy_score, roc_auc_score
+from ml.artifacts import FEATURE_SCHEMA, file_checksum
+from ml.training import DEFAULT_DATASET, LABEL_COLUMN, RANDOM_STATE, build_model, read_dataset
+
+logger = logging.getLogger(__name__)
+
+N_SPLITS = 5
+ETA = 3
+EARLY_STOPPING_ROUNDS = 20
+# Share of each training fold held out for XGBoost's early stopping
+EARLY_STOPPING_FRACTION = 0.1
+
+SCORERS = {
+    'f1': lambda y, pred, prob: f1_score(y, pred, zero_division=0),
+    'balanced_accuracy': lambda y, pred, prob: balanced_accuracy_score(y, pred),
+    'roc_auc': lambda y, pred, prob: roc_auc_score(y, prob),
+}
+
+# Grids per model, with the resource that successive halving allocates
+SEARCH_SPACES = {
+    'svm': {
+        'grid': {
+            'C': [0.1, 1.0, 10.0, 100.0],
+            'gamma': ['scale', 0.01, 0.1, 1.0],
+            'class_weight': [None, 'balanced'],
+        },
+        'fixed': {'kernel': 'rbf'},
+        'resource': 'sample_fraction',
+        'min_resource': 0.1,
+        'max_resource': 1.0,
+    },
+    'random_forest': {
+        'grid': {
+            'max_depth': [None, 8, 16],
+            'min_samples_leaf': [1, 2, 5],
+            'max_features': ['sqrt', 0.5],
+            'class_weight': [None, 'balanced_subsample'],
+        },
+        'fixed': {},
+        'resource': 'n_estimators',
+        'min_resource': 25,
+        'max_resource': 400,
+    },
+    'adaboost': {
+        'grid': {
+            'learning_rate': [0.01, 0.05, 0.1, 0.5, 1.0],
+        },
+        'fixed': {},
+        'resource': 'n_estimators',
+        'min_resource': 25,
+        'max_resource': 400,
+    },
+    'xgboost': {
+        'grid': {
+            'max_depth': [3, 4, 6, 8],
+            'learning_rate': [0.03, 0.1, 0.3],
+            'subsample': [0.8, 1.0],
+            'colsample_bytree': [0.8, 1.0],
+            'min_child_weight': [1, 5],
+        },
+        'fixed': {'eval_metric': 'logloss'},
+        'resource': 'n_estimators',
+        'min_resource': 50,
+        'max_resource': 600,
+    },
+}
+
+
+def expand_grid(grid):
+    """Return the list of parameter dicts in a grid"""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def prepare_folds(dataset_path=DEFAULT_DATASET, cache_dir='artifacts/.cache', n_splits=N_SPLITS,
+                  random_state=RANDOM_STATE, features=None, label=LABEL_COLUMN):
+    """Write scaled + SMOTE-resampled CV folds to disk once; return their directories"""
+    features = features or FEATURE_SCHEMA['features']
+    key = hashlib.sha256(json.dumps({
+        'dataset': file_checksum(dataset_path),
+        'features': list(features),
+        'label': label,
+        'n_splits': n_splits,
+        'random_state': random_state,
+        'smote': True,
+        'early_stopping_fraction': EARLY_STOPPING_FRACTION,
+    }, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    folds_root = os.path.join(cache_dir, 'folds', key)
+    fold_dirs = [os.path.join(folds_root, f"fold_{i}") for i in range(n_splits)]
+    if all(os.path.exists(os.path.join(d, 'y_val.npy')) for d in fold_dirs):
+        logger.info(f"Using cached folds {folds_root}")
+        return fold_dirs
+
+    from imblearn.over_sampling import SMOTE
+
+    X, y = read_dataset(dataset_path, features, label)
+    splitter = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    for fold_dir, (train_idx, val_idx) in zip(fold_dirs, splitter.split(X, y)):
+        scaler = StandardScaler().fit(pd.DataFrame(X[train_idx], columns=list(features)))
+        X_train = scaler.transform(pd.DataFrame(X[train_idx], columns=list(features)))
+        X_val = scaler.transform(pd.DataFrame(X[val_idx], columns=list(features)))
+        # The early-stopping holdout is split off before SMOTE so it holds only real rows
+        fit_pos, stop_pos = train_test_split(np.arange(len(train_idx)), test_size=EARLY_STOPPING_FRACTION,
+                                             stratify=y[train_idx], random_state=random_state)
+        X_stop, y_stop = X_train[stop_pos], y[train_idx][stop_pos]
+        X_fit, y_fit = SMOTE(random_state=random_state).fit_resample(X_train[fit_pos], y[train_idx][fit_pos])
+        X_train, y_train = SMOTE(random_state=random_state).fit_resample(X_train, y[train_idx])
+        os.makedirs(fold_dir, exist_ok=True)
+        # y_val is written last: its presence marks a complete fold
+        np.save(os.path.join(fold_dir, 'X_train.npy'), np.ascontiguousarray(X_train))
+        np.save(os.path.join(fold_dir, 'y_train.npy'), np.ascontiguousarray(y_train))
+        np.save(os.path.join(fold_dir, 'X_fit.npy'), np.ascontiguousarray(X_fit))
+        np.save(os.path.join(fold_dir, 'y_fit.npy'), np.ascontiguousarray(y_fit))
+        np.save(os.path.join(fold_dir, 'X_stop.npy'), np.ascontiguousarray(X_stop))
+        np.save(os.path.join(fold_dir, 'y_stop.npy'), np.ascontiguousarray(y_stop))
+        np.save(os.path.join(fold_dir, 'X_val.npy'), np.ascontiguousarray(X_val))
+        np.save(os.path.join(fold_dir, 'y_val.npy'), np.ascontiguousarray(y[val_idx]))
+    logger.info(f"Prepared {n_splits} folds in {folds_root}")
+    return fold_dirs
+
+
+def _load_fold(fold_dir):
+    return {name: np.load(os.path.join(fold_dir, f"{name}.npy"), mmap_mode='r')
+            for name in ('X_train', 'y_train', 'X_fit', 'y_fit', 'X_stop', 'y_stop', 'X_val', 'y_val')}
+
+
+def evaluate_candidate(model_name, params, resource, fold_dir, scoring='f1'):
+    """Fit one candidate on one cached fold and return (score, fit_seconds, extra)"""
+    space = SEARCH_SPACES[model_name]
+    fold = _load_fold(fold_dir)
+    X_train, y_train = fold['X_train'], fold['y_train']
+    model_params = dict(space['fixed'], **params)
+    fit_kwargs = {}
+    extra = {}
+
+    if space['resource'] == 'sample_fraction':
+        if resource < 1.0:
+            X_train, y_train = resample(np.asarray(X_train), np.asarray(y_train), replace=False,
+                                        n_samples=max(2, int(len(y_train) * resource)),
+                                        stratify=np.asarray(y_train), random_state=RANDOM_STATE)
+    else:
+        model_params['n_estimators'] = int(resource)
+    if model_name == 'svm':
+        # Platt scaling costs an internal 5-fold CV; scores only need decision_function
+        model_params['probability'] = False
+    if model_name == 'xgboost':
+        model_params['early_stopping_rounds'] = EARLY_STOPPING_ROUNDS
+        X_train, y_train = fold['X_fit'], fold['y_fit']
+        fit_kwargs = {'eval_set': [(fold['X_stop'], fold['y_stop'])], 'verbose': False}
+
+    model = build_model(model_name, model_params, n_jobs=1)
+    start = time.time()
+    model.fit(X_train, y_train, **fit_kwargs)
+    fit_seconds = time.time() - start
+    if model_name == 'xgboost':
+        extra['best_iteration'] = int(model.best_iteration)
+
+    pred = model.predict(fold['X_val'])
+    if hasattr(model, 'predict_proba') and model_name != 'svm':
+        prob = model.predict_proba(fold['X_val'])[:, 1]
+    else:
+        prob = model.decision_function(fold['X_val'])
+    score = float(SCORERS[scoring](fold['y_val'], pred, prob))
+    return score, fit_seconds, extra
+
+
+def halving_schedule(n_candidates, min_resource, max_resource, eta=ETA):
+    """Resources per rung so the last rung runs the survivors on ``max_resource``.
+
+    Each rung gets ``eta`` times the previous one's resource, so there are no
+    more rungs than fit between ``min_resource`` and ``max_resource``.
+    """
+    n_rungs = 1 + min(int(math.floor(math.log(max(n_candidates, 1), eta) + 1e-9)),
+                      int(math.floor(math.log(max_resource / min_resource, eta) + 1e-9)))
+    return [max_resource / (eta ** (n_rungs - 1 - rung)) for rung in range(n_rungs)]
+
+
+def search_model(model_name, fold_dirs, executor, scoring='f1', eta=ETA):
+    """Successive-halving search for one model family; returns the leaderboard"""
+    space = SEARCH_SPACES[model_name]
+    candidates = expand_grid(space['grid'])
+    schedule = halving_schedule(len(candidates), space['min_resource'], space['max_resource'], eta)
+    leaderboard = []
+
+    for rung, resource in enumerate(schedule):
+        if space['resource'] == 'n_estimators':
+            resource = int(round(resource))
+        futures = {}
+        for idx, params in enumerate(candidates):
+            for fold_dir in fold_dirs:
+                future = executor.submit(evaluate_candidate, model_name, params, resource, fold_dir, scoring)
+                futures.setdefault(idx, []).append(future)
+
+        rung_results = []
+        for idx, params in enumerate(candidates):
+            outcomes = [f.result() for f in futures[idx]]
+            scores = [o[0] for o in outcomes]
+            entry = {
+                'model': model_name,
+                'params': params,
+                'rung': rung,
+                'resource': resource,
+                'mean_score': float(np.mean(scores)),
+                'std_score': float(np.std(scores)),
+                'fit_seconds': float(sum(o[1] for o in outcomes)),
+            }
+            iterations = [o[2]['best_iteration'] for o in outcomes if 'best_iteration' in o[2]]
+            if iterations:
+                entry['best_iteration'] = int(np.median(iterations))
+            rung_results.append(entry)
+        leaderboard.extend(rung_results)
+        logger.info(f"{model_name} rung {rung}: {len(candidates)} candidates on {space['resource']}={resource}")
+
+        if rung == len(schedule) - 1:
+            break
+        rung_results.sort(key=lambda e: e['mean_score'], reverse=True)
+        keep = max(1, len(rung_results) // eta)
+        candidates = [e['params'] for e in rung_results[:keep]]
+
+    return leaderboard
+
+
+def best_params_from(leaderboard, model_name):
+    """Pick the best candidate of the final rung and turn it into training parameters"""
+    space = SEARCH_SPACES[model_name]
+    final_rung = max(e['rung'] for e in leaderboard)
+    best = max((e for e in leaderboard if e['rung'] == final_rung), key=lambda e: e['mean_score'])
+    params = dict(space['fixed'], **best['params'])
+    if 'best_iteration' in best:
+        params['n_estimators'] = best['best_iteration'] + 1
+    elif space['resource'] == 'n_estimators':
+        params['n_estimators'] = int(best['resource'])
+    return params, best
+
+
+def run_search(dataset_path=DEFAULT_DATASET, root='artifacts', models=None, n_jobs=-1,
+               scoring='f1', n_splits=N_SPLITS, eta=ETA):
+    """Tune every model family and write best_params.json plus the leaderboard"""
+    models = models or list(SEARCH_SPACES)
+    fold_dirs = prepare_folds(dataset_path, cache_dir=os.path.join(root, '.cache'), n_splits=n_splits)
+    max_workers = joblib.cpu_count() if n_jobs in (None, -1) else max(1, n_jobs)
+
+    start = time.time()
+    best_params = {}
+    summary = {}
+    leaderboard = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for model_name in models:
+            board = search_model(model_name, fold_dirs, executor, scoring=scoring, eta=eta)
+            params, best = best_params_from(board, model_name)
+            best_params[model_name] = params
+            summary[model_name] = {'mean_score': best['mean_score'], 'std_score': best['std_score']}
+            leaderboard.extend(board)
+            logger.info(f"{model_name}: best {scoring}={best['mean_score']:.4f} with {params}")
+
+    out_dir = os.path.join(root, 'tuning')
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'best_params.json'), 'w', encoding='utf-8') as fh:
+        json.dump(best_params, fh, indent=2)
+    with open(os.path.join(out_dir, 'leaderboard.json'), 'w', encoding='utf-8') as fh:
+        json.dump({
+            'dataset': dataset_path,
+            'scoring': scoring,
+            'n_splits': n_splits,
+            'eta': eta,
+            'elapsed_seconds': round(time.time() - start, 2),
+            'best': summary,
+            'candidates': leaderboard,
+        }, fh, indent=2)
+    return best_params
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Hyperparameter search for the BTCSleuth models')
+    parser.add_argument('--data', default=DEFAULT_DATASET, help='labelled training CSV')
+    parser.add_argument('--root', default='artifacts', help='artifact root directory')
+    parser.add_argument('--models', nargs='+', choices=sorted(SEARCH_SPACES), default=None)
+    parser.add_argument('--n-jobs', type=int, default=-1, help='worker processes (-1 = all cores)')
+    parser.add_argument('--scoring', choices=sorted(SCORERS), default='f1')
+    parser.add_argument('--folds', type=int, default=N_SPLITS)
+    parser.add_argument('--eta', type=int, default=ETA, help='halving factor')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    best = run_search(args.data, root=args.root, models=args.models, n_jobs=args.n_jobs,
+                      scoring=args.scoring, n_splits=args.folds, eta=args.eta)
+    print(json.dumps(best, indent=2))
@@ -13,6 +13,7 @@ class User(UserMixin, db.Model):
     verification_code = db.Column(db.String(10), nullable=True)  # For email verification and password reset
     verification_expiry = db.Column(db.DateTime, nullable=True)  # Expiry time for the code
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    deleted_at = db.Column(db.DateTime, nullable=True)  # account deletion requested; the row goes when its purge finishes
     
     # Relationships
     analyses = db.relationship('Analysis', backref='user', lazy=True)
@@ -36,11 +37,51 @@ class Analysis(db.Model):
     anomalies_detected = db.Column(db.Integer, default=0)
     accuracy_score = db.Column(db.Float, default=0.0)
     results = db.Column(db.Text)  # JSON string of results
+    file_hash = db.Column(db.String(64), index=True)  # SHA-256 of the uploaded file
+    result_cache_id = db.Column(db.Integer, db.ForeignKey('result_cache.id'), nullable=True)  # shared results
+    status = db.Column(db.String(20), default='complete')  # 'queued', 'running', 'complete', 'failed'
+    error = db.Column(db.Text)  # why a queued analysis failed
+    memory_mb = db.Column(db.Float)  # how much the analysis grew the worker's memory (RSS)
+    analysis_mode = db.Column(db.String(10))  # 'full' or 'chunked' (over the memory budget)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    result_cache = db.relationship('ResultCache', lazy=True)
+    
+    __table_args__ = (db.Index('ix_analysis_user_created', 'user_id', 'created_at'),)
+    
+    def get_results(self):
+        """JSON results, whether stored on the analysis or shared through the result cache"""
+        if self.results:
+            return self.results
+        return self.result_cache.results if self.result_cache else None
+    
+    @property
+    def pending(self):
+        """True while a queued analysis has not finished"""
+        return self.status in ('queued', 'running')
+    
     def __repr__(self):
         return f'<Analysis {self.id} - {self.analysis_type}>'
 
+class ResultCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    file_hash = db.Column(db.String(64), nullable=False)
+    model_version = db.Column(db.String(100), nullable=False)  # artifact version (+ scoring mode)
+    schema_version = db.Column(db.String(20), nullable=False)  # feature schema version
+    results = db.Column(db.Text, nullable=False)  # JSON string of results
+    total_transactions = db.Column(db.Integer, default=0)
+    anomalies_detected = db.Column(db.Integer, default=0)
+    accuracy_score = db.Column(db.Float, default=0.0)
+    size_bytes = db.Column(db.Integer, default=0)
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (db.UniqueConstraint('file_hash', 'model_version', 'schema_version', name='uq_result_cache_key'),)
+    
+    def __repr__(self):
+        return f'<ResultCache {self.file_hash[:12]} - {self.model_version}>'
+
 class ActivityLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -49,17 +90,147 @@ class ActivityLog(db.Model):
     ip_address = db.Column(db.String(45))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Keyset pagination (utils/pagination.py) seeks on (user_id, timestamp, id), optionally per action
+    __table_args__ = (db.Index('ix_activity_log_user_time', 'user_id', 'timestamp', 'id'),
+                      db.Index('ix_activity_log_user_action_time', 'user_id', 'action', 'timestamp', 'id'))
+    
     def __repr__(self):
         return f'<ActivityLog {self.id} - {self.action}>'
 
 class Alert(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     alert_type = db.Column(db.String(50), nullable=False)  # 'anomaly', 'system', 'security'
     message = db.Column(db.Text, nullable=False)
     severity = db.Column(db.String(20), default='medium')  # 'low', 'medium', 'high', 'critical'
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    fingerprint = db.Column(db.String(40))  # repeats of the same event update this row (see utils/alerts.py)
+    occurrences = db.Column(db.Integer, default=1)  # events folded into this alert
+    quantity = db.Column(db.Integer)  # e.g. anomalies, summed over those events
+    last_seen_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_alert_user_fingerprint_seen', 'user_id', 'fingerprint', 'last_seen_at'),)
     
     def __repr__(self):
         return f'<Alert {self.id} - {self.alert_type}>'
+
+class MonitorSubscription(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    symbol = db.Column(db.String(20), nullable=False, index=True)  # e.g. 'BTCUSDT'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'symbol', name='uq_subscription_user_symbol'),)
+    
+    def __repr__(self):
+        return f'<MonitorSubscription {self.user_id} - {self.symbol}>'
+
+class MonitorAnomaly(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(20), nullable=False)
+    trade_id = db.Column(db.BigInteger, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    qty = db.Column(db.Float, nullable=False)
+    score = db.Column(db.Float)  # ensemble score of the trade
+    trade_time = db.Column(db.DateTime, nullable=False)
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('symbol', 'trade_id', name='uq_monitor_anomaly_trade'),
+                      db.Index('ix_monitor_anomaly_symbol_id', 'symbol', 'id'))
+    
+    def __repr__(self):
+        return f'<MonitorAnomaly {self.symbol} - {self.trade_id}>'
+
+class EmailOutbox(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    kind = db.Column(db.String(30), default='generic')  # 'verification', 'anomaly', 'generic'
+    coalesce_key = db.Column(db.String(100), index=True)  # messages with the same key are merged within a window
+    message_count = db.Column(db.Integer, default=1)  # how many queued messages this row carries
+    status = db.Column(db.String(20), default='pending')  # 'pending', 'sending', 'sent', 'failed'
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(64))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (db.Index('ix_email_outbox_status_due', 'status', 'next_attempt_at'),)
+    
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} - {self.status}>'
+
+class UploadSession(db.Model):
+    id = db.Column(db.String(32), primary_key=True)  # random hex token used in the upload URLs
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    next_chunk = db.Column(db.Integer, default=0)  # chunks arrive in order; everything before this is on disk
+    received_bytes = db.Column(db.BigInteger, default=0)
+    sha256 = db.Column(db.String(64))  # optional whole-file checksum from the client, checked after finalize
+    status = db.Column(db.String(20), default='open')  # 'open', 'finalized', 'failed', 'aborted'
+    analysis_id = db.Column(db.Integer, db.ForeignKey('analysis.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+    
+    def chunk_length(self, index):
+        """Expected size of chunk ``index`` (the last one may be short)"""
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'total_size': self.total_size,
+            'chunk_size': self.chunk_size,
+            'chunk_count': self.chunk_count,
+            'next_chunk': self.next_chunk,
+            'received_bytes': self.received_bytes,
+            'status': self.status,
+            'analysis_id': self.analysis_id
+        }
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id} - {self.status}>'
+
+class PurgeJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)  # no foreign key: an account purge deletes the user
+    scope = db.Column(db.String(20), nullable=False)  # 'analyses', 'activity_logs', 'testnet', 'account'
+    status = db.Column(db.String(20), default='queued')  # 'queued', 'running', 'complete', 'failed'
+    rows_deleted = db.Column(db.Integer, default=0)
+    files_deleted = db.Column(db.Integer, default=0)
+    bytes_freed = db.Column(db.BigInteger, default=0)  # files removed plus database pages reclaimed
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    @property
+    def pending(self):
+        return self.status in ('queued', 'running')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'scope': self.scope,
+            'status': self.status,
+            'rows_deleted': self.rows_deleted,
+            'files_deleted': self.files_deleted,
+            'bytes_freed': self.bytes_freed,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<PurgeJob {self.id} - {self.scope} {self.status}>'
@@ -52,7 +52,7 @@ def get_live_data():
         if results['anomalies_detected'] > 0:
             create_alert(current_user.id, 'anomaly', 
                        f"Live analysis detected {results['anomalies_detected']} anomalies", 
-                       'high')
+                       'high', quantity=results['anomalies_detected'], noun='anomalies')
         
         log_activity(current_user.id, 'Live Analysis', f'Analyzed {len(trades)} live transactions')
         
@@ -118,7 +118,7 @@ def simulate_testnet():
         if results['anomalies_detected'] > 0:
             create_alert(current_user.id, 'anomaly', 
                        f"Testnet simulation detected {results['anomalies_detected']} anomalies", 
-                       'medium')
+                       'medium', quantity=results['anomalies_detected'], noun='anomalies')
         
         log_activity(current_user.id, 'Testnet Simulation', 
                    f'Simulated {num_transactions} transactions')
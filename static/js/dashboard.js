@@ -286,10 +286,22 @@ function animateCounter(element, targetValue, duration = 1000) {
     }, 16);
 }
 
+// Deletions run as background purges; resolves with the finished purge
+function waitForPurge(purge, interval = 1000) {
+    if (!purge || (purge.status !== 'queued' && purge.status !== 'running')) {
+        return Promise.resolve(purge);
+    }
+    return new Promise(resolve => setTimeout(resolve, interval))
+        .then(() => fetch(`/api/purges/${purge.id}`))
+        .then(response => response.json())
+        .then(data => waitForPurge(data.purge, interval));
+}
+
 function clearAllAnalyses() {
     if (!confirm('Are you sure you want to clear all analyses? This cannot be undone.')) return;
     fetch('/api/user-analyses', { method: 'DELETE' })
         .then(response => response.json())
+        .then(data => data.success ? waitForPurge(data.purge).then(purge => ({ success: purge.status === 'complete' })) : data)
         .then(data => {
             if (data.success) {
                 location.reload();
@@ -304,6 +316,7 @@ function clearAllLogs() {
     if (!confirm('Are you sure you want to clear all activity logs? This cannot be undone.')) return;
     fetch('/api/user-activity-logs', { method: 'DELETE' })
         .then(response => response.json())
+        .then(data => data.success ? waitForPurge(data.purge).then(purge => ({ success: purge.status === 'complete' })) : data)
         .then(data => {
             if (data.success) {
                 location.reload();
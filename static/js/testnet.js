@@ -479,10 +479,22 @@ function updateSimulationHistory(history) {
     `).join('');
 }
 
+// Deletions run as background purges; resolves with the finished purge
+function waitForPurge(purge, interval = 1000) {
+    if (!purge || (purge.status !== 'queued' && purge.status !== 'running')) {
+        return Promise.resolve(purge);
+    }
+    return new Promise(resolve => setTimeout(resolve, interval))
+        .then(() => fetch(`/api/purges/${purge.id}`))
+        .then(response => response.json())
+        .then(data => waitForPurge(data.purge, interval));
+}
+
 function clearSimulationHistory() {
     if (!confirm('Are you sure you want to clear all simulation history? This cannot be undone.')) return;
     fetch('/binance/testnet-history', { method: 'DELETE' })
         .then(response => response.json())
+        .then(data => data.success ? waitForPurge(data.purge).then(purge => ({ success: purge.status === 'complete' })) : data)
         .then(data => {
             if (data.success) {
                 loadSimulationHistoryAndStats();
@@ -1,5 +1,9 @@
 // File Upload JavaScript functionality
 
+// Larger files go through the resumable chunked upload API
+const CHUNKED_UPLOAD_THRESHOLD = 10 * 1024 * 1024;
+const CHUNK_RETRIES = 3;
+
 document.addEventListener('DOMContentLoaded', function() {
     initializeUpload();
 });
@@ -55,13 +59,14 @@ function handleFileSelect(e) {
     if (!file) return;
     
     // Validate file type
-    if (!file.name.toLowerCase().endsWith('.csv')) {
+    const name = file.name.toLowerCase();
+    if (!['.csv', '.csv.gz', '.csv.zst'].some(ext => name.endsWith(ext))) {
         showAlert('Please select a CSV file.', 'error');
         return;
     }
     
-    // Validate file size (limit to 10MB)
-    if (file.size > 10 * 1024 * 1024) {
+    // Without chunked uploads (needs Web Crypto for the chunk checksums) files are limited to 10MB
+    if (file.size > CHUNKED_UPLOAD_THRESHOLD && !chunkedUploadSupported()) {
         showAlert('File size must be less than 10MB.', 'error');
         return;
     }
@@ -105,6 +110,13 @@ function handleFormSubmit(e) {
         return;
     }
     
+    // Large files: upload in checksummed chunks, resuming an earlier attempt if there is one
+    if (file.size > CHUNKED_UPLOAD_THRESHOLD && chunkedUploadSupported()) {
+        showLoadingState(false);
+        uploadInChunks(file);
+        return;
+    }
+    
     // Show loading state
     showLoadingState();
     
@@ -115,7 +127,7 @@ function handleFormSubmit(e) {
     submitFile(formData);
 }
 
-function showLoadingState() {
+function showLoadingState(simulate = true) {
     const loadingSpinner = document.getElementById('loadingSpinner');
     const uploadProgress = document.getElementById('uploadProgress');
     const submitBtn = document.getElementById('submitBtn');
@@ -134,7 +146,17 @@ function showLoadingState() {
     }
     
     // Simulate progress
-    simulateProgress();
+    if (simulate) {
+        simulateProgress();
+    }
+}
+
+function setProgress(percent) {
+    const progressBar = document.getElementById('progressBar');
+    if (!progressBar) return;
+    
+    progressBar.style.width = percent + '%';
+    progressBar.textContent = Math.round(percent) + '%';
 }
 
 function simulateProgress() {
@@ -191,6 +213,85 @@ function submitFile(formData) {
     });
 }
 
+function chunkedUploadSupported() {
+    return !!(window.crypto && window.crypto.subtle);
+}
+
+async function sha256Hex(buffer) {
+    const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function uploadRequest(url, options) {
+    const response = await fetch(url, options);
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        const error = new Error(data.error || `Upload failed (HTTP ${response.status})`);
+        error.status = response.status;
+        throw error;
+    }
+    return data;
+}
+
+async function withRetries(send) {
+    for (let attempt = 1; ; attempt++) {
+        try {
+            return await send();
+        } catch (error) {
+            // Retry network errors and server errors; client errors will not change on retry
+            if (attempt >= CHUNK_RETRIES || (error.status && error.status < 500)) throw error;
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** (attempt - 1)));
+        }
+    }
+}
+
+async function resumeUploadSession(sessionId) {
+    if (!sessionId) return null;
+    try {
+        const session = await uploadRequest(`/upload/sessions/${sessionId}`, { method: 'GET' });
+        return session.status === 'open' ? session : null;
+    } catch (error) {
+        return null;
+    }
+}
+
+async function uploadInChunks(file) {
+    const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+    try {
+        let session = await resumeUploadSession(localStorage.getItem(resumeKey));
+        if (!session) {
+            session = await uploadRequest('/upload/sessions', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ filename: file.name, size: file.size })
+            });
+            localStorage.setItem(resumeKey, session.id);
+        }
+        setProgress(session.received_bytes / file.size * 100);
+        
+        for (let index = session.next_chunk; index < session.chunk_count; index++) {
+            const start = index * session.chunk_size;
+            const buffer = await file.slice(start, Math.min(start + session.chunk_size, file.size)).arrayBuffer();
+            const checksum = await sha256Hex(buffer);
+            session = await withRetries(() => uploadRequest(`/upload/sessions/${session.id}/chunks/${index}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream', 'X-Chunk-SHA256': checksum },
+                body: buffer
+            }));
+            setProgress(session.received_bytes / file.size * 100);
+        }
+        
+        const finalized = await withRetries(() => uploadRequest(`/upload/sessions/${session.id}/finalize`, { method: 'POST' }));
+        localStorage.removeItem(resumeKey);
+        setProgress(100);
+        window.location.href = finalized.results_url;
+    } catch (error) {
+        console.error('Error uploading file:', error);
+        showAlert(`${error.message}. Select the same file again to resume the upload.`, 'error');
+        hideLoadingState();
+    }
+}
+
 function hideLoadingState() {
     const loadingSpinner = document.getElementById('loadingSpinner');
     const uploadProgress = document.getElementById('uploadProgress');
@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# Tests import the app's packages (config, ml, utils, ...) from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config reads the environment on import: use a scratch database and no background threads
+SCRATCH_DIR = tempfile.mkdtemp(prefix='btcsleuth-tests-')
+os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(SCRATCH_DIR, 'test.db')}",
+                  MAIL_SENDER_THREAD='0', WARM_UP_ON_START='0', RETENTION_INTERVAL_SECONDS='0',
+                  ORDER_BOOK_STREAM='0', MAIL_USERNAME='btcsleuth@example.com', MAIL_PASSWORD='secret')
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    # Upload and database directories are created relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(SCRATCH_DIR)
+    try:
+        application = create_app()
+    finally:
+        os.chdir(cwd)
+    application.config['TESTING'] = True
+    return application
@@ -0,0 +1,80 @@
+"""Upload analyses feed the drift monitor each row exactly once and report drift from any chunk."""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import FunctionTransformer
+from ml import memory
+from ml.analyzer import MLAnalyzer
+from ml.drift import get_monitor, reset_monitors
+from ml.memory import MemoryBudgetExceeded, MemoryTracker
+
+CHUNK_ROWS = 1000
+PRICE, QTY = 'Weight Mean', 'Difficulty Mean'  # the schema names of the first two feature columns
+
+
+class StubAnalyzer(MLAnalyzer):
+    """Identity scaler and a scorer that flags nothing, so only drift is exercised"""
+
+    def __init__(self):
+        self.models = {}
+        self.scaler = FunctionTransformer().fit(np.zeros((1, 6)))
+        self.manifest = None
+        self.ensemble = None
+        self.legacy_version = 'legacy-stub'
+
+    def score(self, X_scaled, **kwargs):
+        rows = len(X_scaled)
+        return {'scores': np.zeros(rows), 'prediction': np.zeros(rows, dtype=int), 'model_probabilities': {},
+                'cascade_rows': 0, 'mode': 'stub'}
+
+
+@pytest.fixture(autouse=True)
+def monitors():
+    reset_monitors()
+    yield
+    reset_monitors()
+
+
+def write_trades(path, chunks, shifted_chunk=None):
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(chunks):
+        shift = 6.0 if i == shifted_chunk else 0.0
+        frames.append(pd.DataFrame({'price': rng.normal(shift, 1.0, CHUNK_ROWS),
+                                    'qty': rng.normal(shift, 1.0, CHUNK_ROWS)}))
+    pd.concat(frames).to_csv(path, index=False)
+    return str(path)
+
+
+def test_drift_in_the_first_chunk_is_reported(tmp_path):
+    path = write_trades(tmp_path / 'trades.csv', chunks=3, shifted_chunk=0)
+    analyzer = StubAnalyzer()
+    with MemoryTracker() as tracker:
+        results = analyzer._analyze_csv_chunked(path, None, None, tracker, CHUNK_ROWS)
+    assert results['chunks'] == 3
+    drift = results['drift']
+    assert {PRICE, QTY} <= set(drift['new_drift'])
+    assert drift['samples'] == 3 * CHUNK_ROWS
+    # PSI is the monitor's after the last chunk
+    assert drift['psi'] == {name: round(value, 4) for name, value in
+                            get_monitor('upload', analyzer.drift_reference()).psi_values().items()}
+
+
+def test_budget_fallback_feeds_each_row_once(tmp_path, monkeypatch):
+    path = write_trades(tmp_path / 'trades.csv', chunks=3)
+    checks = {'count': 0}
+    real_check = MemoryTracker.check
+
+    def check(self):
+        # The full attempt runs four checks; fail its last one, after every stage has run
+        checks['count'] += 1
+        if checks['count'] == 4:
+            raise MemoryBudgetExceeded('over budget')
+        return real_check(self)
+
+    monkeypatch.setattr(memory.MemoryTracker, 'check', check)
+    monkeypatch.setattr(MLAnalyzer, '_chunk_rows', staticmethod(lambda budget: CHUNK_ROWS))
+    results = StubAnalyzer().analyze_csv(path, budget_mb=1024)
+    assert results['memory']['mode'] == 'chunked'
+    assert results['total_transactions'] == 3 * CHUNK_ROWS
+    assert results['drift']['samples'] == 3 * CHUNK_ROWS
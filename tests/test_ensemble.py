@@ -0,0 +1,58 @@
+"""The SVM cascade must actually run on rare-positive data and keep scores on one scale."""
+import numpy as np
+import pytest
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier
+from sklearn.svm import SVC
+from ml.ensemble import StackedEnsemble, CASCADE_FRACTIONS
+
+
+@pytest.fixture(scope='module')
+def fitted():
+    # About 5% positives, like the labelled dataset
+    X, y = make_classification(n_samples=3000, n_features=6, n_informative=4, weights=[0.95], flip_y=0.02,
+                               random_state=0)
+    train, cal, test = slice(0, 1800), slice(1800, 2400), slice(2400, None)
+    models = {
+        'random_forest': RandomForestClassifier(n_estimators=100, random_state=0),
+        'adaboost': AdaBoostClassifier(n_estimators=50, random_state=0),
+        # A weak SVM, so the cheap stacker can stand in for it on most rows
+        'svm': SVC(kernel='linear', C=0.01, probability=True, random_state=0),
+    }
+    for model in models.values():
+        model.fit(X[train], y[train])
+    ensemble = StackedEnsemble.fit(models, X[cal], y[cal])
+    return ensemble, models, X[cal], X[test], y[test]
+
+
+def test_fit_routes_a_minimum_share_to_the_svm(fitted):
+    ensemble, models, X_cal, _, _ = fitted
+    assert ensemble.can_cascade and ensemble.cheap_names == ['adaboost', 'random_forest']
+    scored = ensemble.predict(models, X_cal, cascade=True)
+    assert scored['cascade_rows'] >= int(CASCADE_FRACTIONS[0] * len(X_cal))
+
+
+def test_predict_scores_share_the_full_threshold(fitted):
+    ensemble, models, _, X_test, _ = fitted
+    cascaded = ensemble.predict(models, X_test, cascade=True)
+    full = ensemble.predict(models, X_test, cascade=False)
+    np.testing.assert_array_equal(cascaded['prediction'], cascaded['scores'] >= ensemble.full_threshold)
+    assert 0 < cascaded['cascade_rows'] < len(X_test)
+    svm = cascaded['model_probabilities']['svm']
+    assert np.isnan(svm).sum() == len(X_test) - cascaded['cascade_rows']
+    # Rows re-scored by the full stacker carry exactly its scores
+    routed = ~np.isnan(svm)
+    np.testing.assert_allclose(cascaded['scores'][routed], full['scores'][routed])
+    flagged = full['prediction'] == 1
+    assert np.mean(cascaded['prediction'][flagged] == 1) >= 0.9
+
+
+def test_evaluate_reports_both_modes(fitted):
+    ensemble, models, _, X_test, y_test = fitted
+    metrics = ensemble.evaluate(models, X_test, y_test)
+    assert metrics['threshold'] == ensemble.full_threshold
+    assert set(metrics['weights']) == set(models)
+    cascade = metrics['cascade']
+    assert 0 < cascade['expensive_fraction'] < 1
+    assert cascade['band'] == ensemble.band
+    assert abs(cascade['f1'] - metrics['full']['f1']) <= 0.1
@@ -0,0 +1,191 @@
+"""Outbox delivery against a local SMTP stand-in (a socketserver thread on a free port)."""
+import socketserver
+import threading
+from datetime import datetime, timedelta
+import pytest
+from utils import mailer
+
+
+class SMTPStandIn:
+    """Minimal SMTP server: counts connections, keeps messages and can fail chosen commands."""
+
+    def __init__(self):
+        self.connections = 0
+        self.messages = []  # (recipient, data)
+        self.failures = []  # (command, reply) pairs, each used once, in order
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.smtp = self
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def failure_for(self, command):
+        with self.lock:
+            if self.failures and self.failures[0][0] == command:
+                return self.failures.pop(0)[1]
+        return None
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        smtp = self.server.smtp
+        with smtp.lock:
+            smtp.connections += 1
+        self.reply('220 stand-in ESMTP')
+        recipients, data = [], None
+        for raw in self.rfile:
+            line = raw.decode().rstrip('\r\n')
+            if data is not None:
+                if line != '.':
+                    data.append(line)
+                    continue
+                failure = smtp.failure_for('DATA')
+                if failure:
+                    self.reply(failure)
+                else:
+                    with smtp.lock:
+                        smtp.messages.extend((recipient, '\n'.join(data)) for recipient in recipients)
+                    self.reply('250 OK')
+                recipients, data = [], None
+                continue
+            command = line.split(' ', 1)[0].upper()
+            failure = smtp.failure_for(command)
+            if failure:
+                self.reply(failure)
+            elif command == 'EHLO':
+                self.reply('250-stand-in')
+                self.reply('250 AUTH PLAIN LOGIN')
+            elif command == 'AUTH':
+                self.reply('235 Authentication successful')
+            elif command == 'RCPT':
+                recipients.append(line.split(':', 1)[1].strip().strip('<>'))
+                self.reply('250 OK')
+            elif command == 'DATA':
+                data = []
+                self.reply('354 Go ahead')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+@pytest.fixture
+def smtp():
+    server = SMTPStandIn()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def outbox(app):
+    from app import db
+    from models import EmailOutbox
+    with app.app_context():
+        EmailOutbox.query.delete()
+        db.session.commit()
+        yield EmailOutbox
+        db.session.rollback()
+
+
+@pytest.fixture
+def connection(smtp):
+    conn = mailer.SMTPConnection(host='127.0.0.1', port=smtp.port, use_tls=False,
+                                 credentials=('btcsleuth@example.com', 'secret'), timeout=5)
+    yield conn
+    conn.close()
+
+
+def deliver(connection):
+    return mailer.deliver_batch(connection, mailer.claim_batch('test-worker'))
+
+
+def make_due(outbox):
+    from app import db
+    outbox.query.update({'next_attempt_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def test_batch_is_sent_over_one_connection(outbox, smtp, connection):
+    for n in range(3):
+        mailer.queue_email(f"user{n}@example.com", f"Subject {n}", f"Body {n}")
+    assert deliver(connection) == 3
+    assert smtp.connections == 1
+    assert sorted(to for to, _ in smtp.messages) == ['user0@example.com', 'user1@example.com', 'user2@example.com']
+    assert {row.status for row in outbox.query.all()} == {'sent'}
+
+    # The next batch reuses the open connection
+    mailer.queue_email('user3@example.com', 'Subject 3', 'Body 3')
+    assert deliver(connection) == 1
+    assert smtp.connections == 1
+
+
+def test_messages_with_a_coalesce_key_are_merged(outbox, smtp, connection):
+    for n in range(3):
+        mailer.queue_email('alice@example.com', 'Anomalies detected', f"Alert {n}", coalesce_key='anomaly:1')
+    row = outbox.query.one()
+    assert row.message_count == 3
+    assert deliver(connection) == 1
+    assert len(smtp.messages) == 1
+    assert '3 alerts combined' in smtp.messages[0][1]
+
+    # Just sent: the next one for this key waits for the end of the window
+    later = mailer.queue_email('alice@example.com', 'Anomalies detected', 'Alert 3', coalesce_key='anomaly:1',
+                               window=300)
+    assert later.next_attempt_at >= row.sent_at + timedelta(seconds=299)
+    assert mailer.claim_batch('test-worker') == []
+
+
+def test_transient_error_is_retried_with_backoff(outbox, smtp, connection):
+    smtp.failures = [('DATA', '451 Try again later')]
+    row = mailer.queue_email('bob@example.com', 'Verify', 'Code 123456')
+    before = datetime.utcnow()
+    assert deliver(connection) == 0
+    assert row.status == 'pending'
+    assert row.attempts == 1
+    assert '451' in row.last_error
+    assert row.next_attempt_at >= before + timedelta(seconds=mailer.MAIL_RETRY_BACKOFF - 1)
+    assert mailer.claim_batch('test-worker') == []
+
+    make_due(outbox)
+    assert deliver(connection) == 1
+    assert row.status == 'sent'
+    # The failed connection was dropped and a new one opened
+    assert smtp.connections == 2
+
+
+def test_transient_recipient_refusal_is_retried(outbox, smtp, connection):
+    smtp.failures = [('RCPT', '450 Mailbox busy')]
+    row = mailer.queue_email('bob@example.com', 'Verify', 'Code 123456')
+    assert deliver(connection) == 0
+    assert row.status == 'pending'
+
+
+@pytest.mark.parametrize('command, reply', [('RCPT', '550 No such user'), ('DATA', '554 Rejected')])
+def test_permanent_error_fails_the_row(outbox, smtp, connection, command, reply):
+    smtp.failures = [(command, reply)]
+    row = mailer.queue_email('nobody@example.com', 'Verify', 'Code 123456')
+    assert deliver(connection) == 0
+    assert row.status == 'failed'
+    assert row.attempts == 1
+    assert reply.split()[0] in row.last_error
+
+
+def test_rows_stay_queued_without_credentials(outbox, smtp):
+    conn = mailer.SMTPConnection(host='127.0.0.1', port=smtp.port, use_tls=False, credentials=(None, None),
+                                 sender=None)
+    row = mailer.queue_email('carol@example.com', 'Verify', 'Code 123456')
+    assert deliver(conn) == 0
+    assert row.status == 'pending'
+    assert not row.attempts
+    assert row.last_error == mailer.NOT_CONFIGURED
+    assert smtp.connections == 0
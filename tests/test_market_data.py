@@ -0,0 +1,140 @@
+"""MarketDataClient against a local fake exchange (``http.server`` on a free port)."""
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import pytest
+from binance_routes.market_data import MarketDataClient, MarketDataError
+
+TICKER = {'symbol': 'BTCUSDT', 'lastPrice': '65000.00', 'priceChangePercent': '1.2'}
+DEPTH = {'lastUpdateId': 1, 'bids': [['64999.0', '1.5']], 'asks': [['65001.0', '0.7']]}
+KLINES = [[0, '64000', '65500', '63900', '65000', '120.5', 3599999, '0', 100, '0', '0', '0']]
+EXCHANGE_INFO = {'symbols': [{'symbol': 'BTCUSDT', 'status': 'TRADING'}, {'symbol': 'ETHUSDT', 'status': 'TRADING'},
+                             {'symbol': 'LUNAUSDT', 'status': 'BREAK'}]}
+
+
+class FakeExchange:
+    """Serves the three market-data endpoints; ``script`` queues responses per path."""
+
+    bodies = {'/api/v3/ticker/24hr': TICKER, '/api/v3/depth': DEPTH, '/api/v3/klines': KLINES,
+              '/api/v3/exchangeInfo': EXCHANGE_INFO}
+
+    def __init__(self):
+        self.script = {}  # path -> list of (status, headers) returned before the normal body
+        self.delay = {}  # path -> seconds to wait before answering
+        self.hits = {}
+        self.lock = threading.Lock()
+        exchange = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlparse(self.path).path
+                with exchange.lock:
+                    exchange.hits[path] = exchange.hits.get(path, 0) + 1
+                    queued = exchange.script.get(path)
+                    status, headers = queued.pop(0) if queued else (200, {})
+                time.sleep(exchange.delay.get(path, 0))
+                body = json.dumps(exchange.bodies[path] if status == 200 else {'code': -1}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def exchange():
+    fake = FakeExchange()
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def client(exchange):
+    market = MarketDataClient(base_url=exchange.url, api_key=None, timeout=5, retries=2, backoff=0.01)
+    yield market
+    market.close()
+
+
+def test_snapshot_fetches_concurrently(exchange, client):
+    for path in ('/api/v3/ticker/24hr', '/api/v3/depth', '/api/v3/klines'):
+        exchange.delay[path] = 0.3
+    started = time.monotonic()
+    results, errors = client.market_snapshot('BTCUSDT')
+    elapsed = time.monotonic() - started
+    assert errors == {}
+    assert results == {'ticker': TICKER, 'order_book': DEPTH, 'price_chart': KLINES}
+    # Three 0.3s calls in sequence would take 0.9s
+    assert elapsed < 0.75
+
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_retries_transient_status_honouring_retry_after(exchange, client, status):
+    exchange.script['/api/v3/ticker/24hr'] = [(status, {'Retry-After': '1'})]
+    started = time.monotonic()
+    assert client.ticker('BTCUSDT') == TICKER
+    assert exchange.hits['/api/v3/ticker/24hr'] == 2
+    assert time.monotonic() - started >= 1
+
+
+def test_gives_up_after_retries(exchange, client):
+    exchange.script['/api/v3/depth'] = [(502, {})] * 3
+    with pytest.raises(MarketDataError, match='HTTP 502 after 3 attempts'):
+        client.order_book('BTCUSDT')
+    assert exchange.hits['/api/v3/depth'] == 3
+
+
+def test_client_errors_are_not_retried(exchange, client):
+    exchange.script['/api/v3/klines'] = [(400, {})]
+    with pytest.raises(MarketDataError):
+        client.klines('BTCUSDT')
+    assert exchange.hits['/api/v3/klines'] == 1
+
+
+def test_partial_result_when_one_call_fails(exchange, client):
+    exchange.script['/api/v3/depth'] = [(500, {})] * 3
+    results, errors = client.market_snapshot('BTCUSDT')
+    assert results['ticker'] == TICKER
+    assert results['price_chart'] == KLINES
+    assert results['order_book'] is None
+    assert 'HTTP 500' in errors['order_book']
+    assert set(errors) == {'order_book'}
+
+
+def test_deadline_reports_slow_calls_as_timed_out(exchange, client):
+    exchange.delay['/api/v3/klines'] = 1.5
+    started = time.monotonic()
+    results, errors = client.market_snapshot('BTCUSDT', deadline=0.5)
+    assert time.monotonic() - started < 1.2
+    assert errors == {'price_chart': 'timed out'}
+    assert results['price_chart'] is None
+    assert results['ticker'] == TICKER and results['order_book'] == DEPTH
+
+
+def test_trading_symbols_are_cached_and_survive_a_failed_refresh(exchange, client):
+    assert client.trading_symbols() == {'BTCUSDT', 'ETHUSDT'}
+    assert client.trading_symbols() == {'BTCUSDT', 'ETHUSDT'}
+    assert exchange.hits['/api/v3/exchangeInfo'] == 1
+    exchange.script['/api/v3/exchangeInfo'] = [(503, {})] * 3
+    assert client.trading_symbols(max_age=0) == {'BTCUSDT', 'ETHUSDT'}
+    assert exchange.hits['/api/v3/exchangeInfo'] == 4
+
+
+def test_trading_symbols_raise_without_a_cached_list(exchange, client):
+    exchange.script['/api/v3/exchangeInfo'] = [(503, {})] * 3
+    with pytest.raises(MarketDataError):
+        client.trading_symbols()
@@ -0,0 +1,88 @@
+"""Order book sync and features, driven by a recorded depth-stream fixture.
+
+``fixtures/btcusdt_depth.jsonl`` holds, in recording order: a stale update
+and one straddling the snapshot (both received before it), the snapshot,
+two in-order updates, an update that skips ids (a gap), one more update
+and the snapshot taken to resync.
+"""
+import json
+import math
+import os
+import pytest
+from binance_routes.orderbook import OrderBook, OrderBookGap, replay
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'btcusdt_depth.jsonl')
+
+
+def recorded():
+    with open(FIXTURE) as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def book():
+    """The book after the first snapshot and the updates that follow it, before the gap"""
+    messages = recorded()
+    book = OrderBook('BTCUSDT', feature_levels=2, half_life=1)
+    book.load_snapshot(messages[2]['snapshot'])
+    assert [book.apply(event) for event in (messages[0], messages[1], messages[3], messages[4])] == \
+        [False, True, True, True]
+    return book
+
+
+def test_apply_before_snapshot_is_a_gap():
+    with pytest.raises(OrderBookGap):
+        OrderBook('BTCUSDT').apply(recorded()[1])
+
+
+def test_stale_events_are_dropped(book):
+    assert book.last_update_id == 106
+    # The stale event's 9.0 at 64990 never reached the book, and the level was later removed
+    assert book.depth_at(64990) == 0.0
+    assert book.updates == 3
+
+
+def test_gap_raises(book):
+    with pytest.raises(OrderBookGap, match='expected update 107, got 110'):
+        book.apply(recorded()[5])
+    assert book.last_update_id == 106
+
+
+def test_best_levels_and_depth(book):
+    assert book.best_bid() == (65005.0, 0.8)
+    assert book.best_ask() == (65012.0, 0.4)
+    assert book.depth_at('65000.00') == 1.5
+    assert book.depth_at(65015) == 1.0
+    assert book.depth_at(65010) == 0.0  # removed by the straddling update
+    assert book.bids.levels(3) == [(65005.0, 0.8), (65000.0, 1.5), (64995.0, 2.0)]
+    assert book.asks.levels(3) == [(65012.0, 0.4), (65015.0, 1.0), (65020.0, 2.0)]
+
+
+def test_imbalance(book):
+    assert book.imbalance() == pytest.approx((2.3 - 1.4) / 3.7)
+    assert book.imbalance(levels=3) == pytest.approx((4.3 - 3.4) / 7.7)
+
+
+def test_features(book):
+    features = book.features()
+    # Top-2 depth was 6.5, 3.7 and 3.7 after each update; with a half-life of one update
+    # the baseline went 6.5 -> 5.1 -> 4.4
+    assert features['best_bid'] == 65005.0
+    assert features['best_ask'] == 65012.0
+    assert features['spread_bps'] == pytest.approx(7 / 65008.5 * 1e4)
+    assert features['imbalance'] == pytest.approx(0.9 / 3.7)
+    assert features['depth'] == pytest.approx(3.7)
+    assert features['depth_shock'] == pytest.approx(math.log(3.7 / 4.4))
+    assert features['levels'] == 2
+    assert features['last_update_id'] == 106
+
+
+def test_replay_resyncs_after_a_gap():
+    book, applied, gaps = replay(FIXTURE, 'BTCUSDT')
+    assert gaps == 1
+    # Two updates after the first snapshot plus the straddling one, then the update held for the resync
+    assert applied == 4
+    assert book.last_update_id == 113
+    assert book.bids.levels(5) == [(65001.0, 1.0), (65000.0, 2.0), (64995.0, 1.0)]
+    assert book.asks.levels(5) == [(65010.0, 1.0), (65015.0, 1.0)]
+    assert book.depth_at(64999) == 0.0  # the update after the gap was lost with the old book
@@ -0,0 +1,62 @@
+"""Chunked ranking must agree with ranking the whole file at once."""
+import numpy as np
+import pytest
+from ml.ranking import rank_anomalies, StreamingRanking, SCORE_BINS
+
+
+def stream(scores, flagged, chunk_rows):
+    ranking = StreamingRanking()
+    for offset in range(0, len(scores), chunk_rows):
+        ranking.update(scores[offset:offset + chunk_rows], flagged[offset:offset + chunk_rows], offset)
+    thresholds = ranking.thresholds()
+    return thresholds, ranking.result()
+
+
+def tied_scores(n=300000, seed=7):
+    """Scores whose 95th and 99th percentiles fall on tied values inside one histogram bin"""
+    rng = np.random.default_rng(seed)
+    scores = rng.uniform(0.0, 0.06, n)
+    tied = rng.permutation(n)
+    low, high = 0.0621171, 0.0621174
+    assert int(low * SCORE_BINS) == int(high * SCORE_BINS)
+    scores[tied[:int(0.04 * n)]] = low
+    scores[tied[int(0.04 * n):int(0.06 * n)]] = high
+    scores[tied[int(0.06 * n):int(0.065 * n)]] = rng.uniform(0.07, 1.0, int(0.005 * n))
+    return scores, scores > 0.03
+
+
+@pytest.mark.parametrize('chunk_rows', [1000, 70000, 300000])
+def test_severity_counts_match_with_tied_scores(chunk_rows):
+    scores, flagged = tied_scores()
+    full = rank_anomalies(scores, flagged)
+    thresholds, chunked = stream(scores, flagged, chunk_rows)
+    np.testing.assert_array_equal(thresholds, np.quantile(scores, (0.95, 0.99, 0.999)))
+    assert chunked['severity_counts'] == full['severity_counts']
+    assert chunked['severity_thresholds'] == full['severity_thresholds']
+    assert full['severity_counts']['Medium'] > 0 and full['severity_counts']['High'] > 0
+
+
+def test_severity_counts_match_with_continuous_scores():
+    rng = np.random.default_rng(3)
+    scores = rng.beta(2, 5, 200000)
+    flagged = scores > 0.5
+    full = rank_anomalies(scores, flagged)
+    _, chunked = stream(scores, flagged, 30000)
+    assert chunked['severity_counts'] == full['severity_counts']
+
+
+def test_top_k_matches_and_ties_go_to_the_earlier_row():
+    rng = np.random.default_rng(5)
+    scores = np.round(rng.random(50000), 3)
+    flagged = scores > 0.2
+    full = rank_anomalies(scores, flagged, k=100)
+    _, chunked = stream(scores, flagged, 4096)
+    assert [e['score'] for e in chunked['top']] == [e['score'] for e in full['top']]
+    for first, second in zip(chunked['top'], chunked['top'][1:]):
+        assert (first['score'], -first['index']) > (second['score'], -second['index'])
+
+
+def test_empty_input():
+    _, chunked = stream(np.empty(0), np.empty(0, dtype=bool), 10)
+    assert chunked['top'] == []
+    assert sum(chunked['severity_counts'].values()) == 0
@@ -0,0 +1,57 @@
+"""Result cache eviction: only entries no analysis references are dropped."""
+from datetime import datetime, timedelta
+import pytest
+
+
+@pytest.fixture
+def cache(app):
+    from app import db
+    from models import Analysis, ResultCache, User
+    from utils import result_cache
+    with app.app_context():
+        Analysis.query.delete()
+        ResultCache.query.delete()
+        user = User.query.filter_by(username='cache-test').first()
+        if user is None:
+            user = User(username='cache-test', email='cache-test@example.com', is_verified=True)
+            user.set_password('password1')
+            db.session.add(user)
+        db.session.commit()
+        yield result_cache, user.id
+        db.session.rollback()
+
+
+def add_entry(cache, user_id, name, age_minutes, referenced):
+    from app import db
+    from models import Analysis
+    results = {'total_transactions': 10, 'anomalies_detected': 1, 'accuracy_score': 0.9, 'pad': 'x' * 1000}
+    entry = cache.store(name * 64, 'v1', '1', results)
+    entry.last_used_at = datetime.utcnow() - timedelta(minutes=age_minutes)
+    if referenced:
+        db.session.add(Analysis(user_id=user_id, analysis_type='upload', file_hash=entry.file_hash,
+                                result_cache_id=entry.id))
+    db.session.commit()
+    return entry
+
+
+def test_evicts_only_unreferenced_entries_least_recently_used_first(cache):
+    from models import Analysis, ResultCache
+    cache, user_id = cache
+    pinned = add_entry(cache, user_id, 'a', 50, referenced=True)
+    add_entry(cache, user_id, 'b', 40, referenced=False)
+    newer = add_entry(cache, user_id, 'c', 30, referenced=False)
+    size = newer.size_bytes
+
+    # Pinned entries do not count against the budget: one unreferenced entry fits
+    freed = cache.evict(max_bytes=size)
+    assert freed == size
+    remaining = {entry.id for entry in ResultCache.query.all()}
+    assert remaining == {pinned.id, newer.id}
+    assert cache.total_size(pinned=False) == size
+
+    # Evicting everything still keeps what analyses use, without copying it into them
+    cache.evict(max_bytes=0)
+    assert [entry.id for entry in ResultCache.query.all()] == [pinned.id]
+    analysis = Analysis.query.filter_by(result_cache_id=pinned.id).one()
+    assert analysis.results is None
+    assert analysis.get_results() == pinned.results
@@ -0,0 +1,72 @@
+"""TickDetector: warmup, refetched trades and a planted outlier."""
+import numpy as np
+import pytest
+from ml.streaming import TickDetector
+
+
+def trades(n, seed=0, start_id=1):
+    """Random-walk prices around 65k with log-normal sizes"""
+    rng = np.random.default_rng(seed)
+    prices = 65000.0 * np.exp(np.cumsum(rng.normal(0.0, 1e-4, n)))
+    qtys = np.exp(rng.normal(-3.0, 0.5, n))
+    return prices, qtys, np.arange(start_id, start_id + n)
+
+
+@pytest.fixture
+def detector():
+    return TickDetector(half_life=200, threshold=6.0, warmup=100)
+
+
+def test_no_scores_during_warmup(detector):
+    prices, qtys, ids = trades(150)
+    z = detector.update(prices, qtys, ids)
+    assert np.all(z[:100] == 0.0)
+    assert np.all(z[100:] > 0.0)
+    assert detector.count == 150
+    assert detector.snapshot()['warmed_up']
+
+
+def test_warmup_spans_batches(detector):
+    prices, qtys, ids = trades(150)
+    assert np.all(detector.update(prices[:60], qtys[:60], ids[:60]) == 0.0)
+    z = detector.update(prices[60:], qtys[60:], ids[60:])
+    assert np.all(z[:40] == 0.0)
+    assert np.all(z[40:] > 0.0)
+
+
+def test_refetched_trades_keep_their_score_and_are_not_learned_again(detector):
+    prices, qtys, ids = trades(300)
+    first = detector.update(prices[:200], qtys[:200], ids[:200])
+    state = (detector.count, list(detector.mean), list(detector.dev), detector.last_price)
+    # The next poll returns the last 50 trades again before the new ones
+    again = detector.update(prices[150:300], qtys[150:300], ids[150:300])
+    np.testing.assert_array_equal(again[:50], first[150:200])
+    assert detector.count == state[0] + 100
+
+    # A batch of nothing but refetched trades leaves the state untouched
+    state = (detector.count, list(detector.mean), list(detector.dev), detector.last_price)
+    repeat = detector.update(prices[250:300], qtys[250:300], ids[250:300])
+    np.testing.assert_array_equal(repeat, again[100:])
+    assert (detector.count, detector.mean, detector.dev, detector.last_price) == state
+
+
+def test_planted_outlier_crosses_the_threshold(detector):
+    prices, qtys, ids = trades(400)
+    qtys[300] *= 1000.0
+    prices[350:] *= 1.01  # a 1% jump between two consecutive trades
+    z = detector.update(prices, qtys, ids)
+    assert z[300] >= detector.threshold
+    assert z[350] >= detector.threshold
+    ordinary = np.delete(z[100:], [200, 201, 250])
+    assert ordinary.max() < detector.threshold
+    assert detector.anomalies == int(np.sum(z >= detector.threshold))
+    assert detector.probability(z[300]) > 0.5 > detector.probability(ordinary.max())
+
+
+def test_outlier_only_nudges_the_baseline(detector):
+    prices, qtys, ids = trades(400)
+    detector.update(prices[:300], qtys[:300], ids[:300])
+    location = detector.mean[1]
+    detector.update(prices[300:301], qtys[300:301] * 1000.0, ids[300:301])
+    # Winsorized at clip scales: the log-size mean moves far less than log(1000)
+    assert abs(detector.mean[1] - location) < 0.1
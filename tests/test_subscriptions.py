@@ -0,0 +1,99 @@
+"""Monitor subscriptions: only symbols the exchange trades, and a per-user cap."""
+import pytest
+from binance_routes import market_data
+from binance_routes.market_data import MarketDataError
+
+
+class StubExchange:
+    def __init__(self, symbols=None):
+        self.symbols = symbols
+
+    def trading_symbols(self):
+        if self.symbols is None:
+            raise MarketDataError('/api/v3/exchangeInfo: HTTP 503 after 3 attempts')
+        return self.symbols
+
+
+@pytest.fixture
+def client(app):
+    from app import db
+    from models import User, MonitorSubscription
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        user = User.query.filter_by(username='subs-test').first()
+        if user is None:
+            user = User(username='subs-test', email='subs-test@example.com', is_verified=True)
+            user.set_password('password1')
+            db.session.add(user)
+            db.session.commit()
+        MonitorSubscription.query.filter_by(user_id=user.id).delete()
+        db.session.commit()
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': 'subs-test', 'password': 'password1'})
+    assert response.status_code == 302
+    return client
+
+
+def subscribed(response):
+    return [sub['symbol'] for sub in response.get_json()['subscriptions']]
+
+
+def test_subscribes_to_a_trading_symbol(client, monkeypatch):
+    monkeypatch.setattr(market_data, '_client', StubExchange({'BTCUSDT', 'ETHUSDT'}))
+    response = client.post('/binance/subscriptions', json={'symbol': 'ethusdt'})
+    assert response.status_code == 200
+    assert subscribed(response) == ['ETHUSDT']
+
+
+def test_unknown_symbol_is_refused(client, monkeypatch):
+    monkeypatch.setattr(market_data, '_client', StubExchange({'BTCUSDT'}))
+    response = client.post('/binance/subscriptions', json={'symbol': 'ZZZUSDT'})
+    assert response.status_code == 400
+    assert 'not traded' in response.get_json()['error']
+    assert subscribed(client.get('/binance/subscriptions')) == []
+
+
+def test_refused_when_the_exchange_cannot_be_checked(client, monkeypatch):
+    monkeypatch.setattr(market_data, '_client', StubExchange(None))
+    response = client.post('/binance/subscriptions', json={'symbol': 'BTCUSDT'})
+    assert response.status_code == 503
+
+
+def test_per_user_subscription_cap(client, monkeypatch):
+    from binance_routes import routes
+    monkeypatch.setattr(market_data, '_client', StubExchange({'BTCUSDT', 'ETHUSDT', 'BNBUSDT'}))
+    monkeypatch.setattr(routes, 'MONITOR_MAX_SUBSCRIPTIONS', 2)
+    for symbol in ('BTCUSDT', 'ETHUSDT'):
+        assert client.post('/binance/subscriptions', json={'symbol': symbol}).status_code == 200
+    response = client.post('/binance/subscriptions', json={'symbol': 'BNBUSDT'})
+    assert response.status_code == 400
+    assert 'At most 2' in response.get_json()['error']
+    # Re-subscribing to a symbol the user already has is not a new subscription
+    assert client.post('/binance/subscriptions', json={'symbol': 'BTCUSDT'}).status_code == 200
+
+
+def test_after_id_pages_through_anomalies_oldest_first(app, client, monkeypatch):
+    from datetime import datetime
+    from app import db
+    from models import MonitorAnomaly
+    monkeypatch.setattr(market_data, '_client', StubExchange({'BTCUSDT'}))
+    client.post('/binance/subscriptions', json={'symbol': 'BTCUSDT'})
+    with app.app_context():
+        MonitorAnomaly.query.filter_by(symbol='BTCUSDT').delete()
+        db.session.add_all([MonitorAnomaly(symbol='BTCUSDT', trade_id=trade_id, price=65000.0, qty=1.0, score=0.9,
+                                           trade_time=datetime.utcnow()) for trade_id in range(5)])
+        db.session.commit()
+        ids = [a.id for a in MonitorAnomaly.query.filter_by(symbol='BTCUSDT').order_by(MonitorAnomaly.id)]
+
+    latest = client.get('/binance/monitor/anomalies?limit=2').get_json()
+    assert [a['id'] for a in latest['anomalies']] == [ids[4], ids[3]]
+
+    seen, cursor = [], ids[0] - 1
+    while True:
+        page = client.get(f'/binance/monitor/anomalies?after_id={cursor}&limit=2').get_json()
+        if not page['anomalies']:
+            break
+        seen += [a['id'] for a in page['anomalies']]
+        cursor = page['next_after_id']
+    assert seen == ids
+    assert cursor == ids[-1]
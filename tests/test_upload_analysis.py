@@ -0,0 +1,73 @@
+"""The synchronous upload path: the analysis has an id while it runs and is marked on failure."""
+import io
+import pytest
+from ml import analyzer
+from utils.logs import current_fields
+
+
+class StubAnalyzer:
+    """Records the log context analyze_csv runs in instead of scoring"""
+
+    seen = []
+    fail = False
+
+    def cache_identity(self):
+        return 'stub-model', 'stub-schema'
+
+    def analyze_csv(self, filepath, columns=None, compression=None):
+        StubAnalyzer.seen.append(current_fields().get('analysis_id'))
+        if StubAnalyzer.fail:
+            raise RuntimeError('scoring blew up')
+        return {'total_transactions': 3, 'anomalies_detected': 0, 'accuracy_score': 0.0,
+                'memory': {'growth_mb': 1.0, 'mode': 'full'}}
+
+
+@pytest.fixture
+def client(app, monkeypatch, tmp_path):
+    from app import db
+    from models import User
+    monkeypatch.setattr(analyzer, 'MLAnalyzer', StubAnalyzer)
+    monkeypatch.setattr(StubAnalyzer, 'seen', [])
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        if User.query.filter_by(username='upload-test').first() is None:
+            user = User(username='upload-test', email='upload-test@example.com', is_verified=True)
+            user.set_password('password1')
+            db.session.add(user)
+            db.session.commit()
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': 'upload-test', 'password': 'password1'})
+    assert response.status_code == 302
+    return client
+
+
+def upload(client, price):
+    body = f'price,qty\n{price},0.5\n{price},0.7\n{price},0.1\n'.encode()
+    return client.post('/upload', data={'file': (io.BytesIO(body), 'trades.csv')},
+                       content_type='multipart/form-data')
+
+
+def test_analysis_logs_carry_its_id(app, client):
+    from app import db
+    from models import Analysis
+    response = upload(client, 65000.25)
+    assert response.status_code == 302 and '/results/' in response.headers['Location']
+    analysis_id, = StubAnalyzer.seen
+    assert analysis_id is not None
+    with app.app_context():
+        analysis = db.session.get(Analysis, analysis_id)
+        assert analysis.status == 'complete'
+        assert analysis.total_transactions == 3
+
+
+def test_failed_analysis_is_marked_failed(app, client, monkeypatch):
+    from app import db
+    from models import Analysis
+    monkeypatch.setattr(StubAnalyzer, 'fail', True)
+    upload(client, 65000.5)
+    analysis_id, = StubAnalyzer.seen
+    with app.app_context():
+        analysis = db.session.get(Analysis, analysis_id)
+        assert analysis.status == 'failed'
+        assert 'scoring blew up' in analysis.error
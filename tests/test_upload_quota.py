@@ -0,0 +1,35 @@
+"""Uploads over the byte quota are refused before anything is written to disk."""
+import io
+import os
+import pytest
+from utils.governor import get_governor
+
+
+@pytest.fixture
+def client(app):
+    from app import db
+    from models import User
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        if User.query.filter_by(username='quota-test').first() is None:
+            user = User(username='quota-test', email='quota-test@example.com', is_verified=True)
+            user.set_password('password1')
+            db.session.add(user)
+            db.session.commit()
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': 'quota-test', 'password': 'password1'})
+    assert response.status_code == 302
+    return client
+
+
+def test_upload_over_byte_quota_is_refused_before_saving(app, client, monkeypatch, tmp_path):
+    monkeypatch.setattr(get_governor(), 'byte_quota', 1000)
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    body = b'price,qty\n' + b'65000.0,0.5\n' * 200
+    response = client.post('/upload', data={'file': (io.BytesIO(body), 'trades.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        messages = [message for _, message in session.get('_flashes', [])]
+    assert any('quota' in message for message in messages)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,171 @@
+"""Alert engine: one alert per incident instead of one per event.
+
+Live analysis polls every few seconds, the monitor scores every batch, and
+each used to insert its own ``Alert`` row (and possibly an email).  Here
+every event gets a fingerprint: user, alert type and either an explicit
+``key`` or the message with its numbers blanked out.  Events with the
+same fingerprint less than ``ALERT_WINDOW_SECONDS`` apart are one incident,
+and they update a single row.  The row counts the events and sums their
+quantity (e.g. anomalies), so its message reads "37 anomalies in the last
+5 minutes (12 detections)".
+
+* Severity goes up one level each time an incident's event count passes
+  an ``ALERT_ESCALATE_AFTER`` threshold.  An escalated alert is marked
+  unread again.
+* New incident rows are rate limited per user by a token bucket
+  (``ALERT_BURST`` rows, refilled at ``ALERT_RATE_PER_HOUR``).  Events over
+  the limit are folded into one "alerts suppressed" incident.
+* Emails go out only for a new incident or an escalation, through a
+  second, stricter bucket (``ALERT_EMAIL_*``).  The mailer's per-user
+  coalescing still applies on top.
+
+Buckets live in each process's memory, so the limits are per process.
+"""
+import re
+import math
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from config import (ALERT_WINDOW_SECONDS, ALERT_ESCALATE_AFTER, ALERT_RATE_PER_HOUR, ALERT_BURST,
+                    ALERT_EMAIL_RATE_PER_HOUR, ALERT_EMAIL_BURST)
+
+logger = logging.getLogger(__name__)
+
+SEVERITIES = ('low', 'medium', 'high', 'critical')
+_NUMBER = re.compile(r'\d+(?:\.\d+)?')
+_MAX_BUCKETS = 10000
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_counters = {'events': 0, 'created': 0, 'merged': 0, 'escalated': 0, 'suppressed': 0, 'emails': 0,
+             'emails_suppressed': 0}
+
+
+class TokenBucket:
+    """``capacity`` tokens, refilled continuously at ``rate`` per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now=None):
+        """Spend a token if one is available"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def _take(kind, user_id, per_hour, burst):
+    with _buckets_lock:
+        bucket = _buckets.get((kind, user_id))
+        if bucket is None:
+            if len(_buckets) > _MAX_BUCKETS:
+                _buckets.clear()
+            bucket = _buckets[(kind, user_id)] = TokenBucket(per_hour / 3600.0, burst)
+        return bucket.take()
+
+
+def fingerprint(user_id, alert_type, message, key=None):
+    """Identity of an incident: the same event with different numbers has the same fingerprint"""
+    identity = key if key is not None else _NUMBER.sub('#', message)
+    return hashlib.sha1(f"{user_id}|{alert_type}|{identity}".encode()).hexdigest()
+
+
+def _level(severity):
+    return SEVERITIES.index(severity) if severity in SEVERITIES else 1
+
+
+def escalated(severity, occurrences, thresholds=ALERT_ESCALATE_AFTER):
+    """``severity`` raised one level per threshold ``occurrences`` has reached"""
+    level = _level(severity) + sum(1 for threshold in thresholds if occurrences >= threshold)
+    return SEVERITIES[min(level, len(SEVERITIES) - 1)]
+
+
+def _summary(alert, message, noun, now):
+    minutes = max(1, math.ceil((now - alert.created_at).total_seconds() / 60))
+    period = 'minute' if minutes == 1 else f'{minutes} minutes'
+    if alert.quantity:
+        return f"{alert.quantity} {noun} in the last {period} ({alert.occurrences} detections). Latest: {message}"
+    return f"{message} (repeated {alert.occurrences} times in the last {period})"
+
+
+def raise_alert(user_id, alert_type, message, severity='medium', key=None, quantity=None, noun='events',
+                email=False, commit=True):
+    """Record an event as a new incident alert or fold it into the open one; returns the Alert.
+
+    ``quantity`` is what the event counts (e.g. anomalies, described by
+    ``noun``) and is summed over the incident.  With ``email``, a new or
+    escalated incident is also emailed to the user, within the email rate
+    limit.
+    """
+    from app import db
+    from models import Alert
+
+    now = datetime.utcnow()
+    _counters['events'] += 1
+    fp = fingerprint(user_id, alert_type, message, key)
+    alert = (Alert.query.filter(Alert.user_id == user_id, Alert.fingerprint == fp,
+                                Alert.last_seen_at >= now - timedelta(seconds=ALERT_WINDOW_SECONDS))
+             .order_by(Alert.id.desc()).first())
+    notify = False
+    if alert is not None:
+        alert.occurrences = (alert.occurrences or 1) + 1
+        if quantity:
+            alert.quantity = (alert.quantity or 0) + quantity
+        alert.last_seen_at = now
+        alert.message = _summary(alert, message, noun, now)
+        # Escalate from the event's own severity, so each threshold counts once
+        new_severity = max(alert.severity, escalated(severity, alert.occurrences), key=_level)
+        if _level(new_severity) > _level(alert.severity):
+            alert.is_read = False
+            notify = True
+            _counters['escalated'] += 1
+            logger.info(f"Alert {alert.id} escalated to {new_severity} after {alert.occurrences} events")
+        alert.severity = new_severity
+        _counters['merged'] += 1
+    elif alert_type == 'suppressed' or _take('alert', user_id, ALERT_RATE_PER_HOUR, ALERT_BURST):
+        alert = Alert(user_id=user_id, alert_type=alert_type, message=message, severity=severity, is_read=False,
+                      fingerprint=fp, occurrences=1, quantity=quantity, created_at=now, last_seen_at=now)
+        db.session.add(alert)
+        notify = True
+        _counters['created'] += 1
+    else:
+        # Over the user's alert budget: count it in one incident instead of a row of its own
+        _counters['suppressed'] += 1
+        return raise_alert(user_id, 'suppressed', 'Further alerts were rate limited', 'low',
+                           key='rate-limited', quantity=1, noun='alerts suppressed', commit=commit)
+    if commit:
+        db.session.commit()
+    if email and notify:
+        _email(user_id, alert)
+    return alert
+
+
+def _email(user_id, alert):
+    from app import db
+    from models import User
+    from utils.helpers import send_email
+
+    if not _take('email', user_id, ALERT_EMAIL_RATE_PER_HOUR, ALERT_EMAIL_BURST):
+        _counters['emails_suppressed'] += 1
+        return False
+    user = db.session.get(User, user_id)
+    if user is None:
+        return False
+    _counters['emails'] += 1
+    subject = f"Bitcoin Anomaly Detection Alert ({alert.severity})"
+    body = f"{alert.message}\n\nSee your dashboard for details."
+    return send_email(user.email, subject, body, user_id=user_id, kind='anomaly', coalesce_key=f'anomaly:{user_id}')
+
+
+def stats():
+    """Event, incident and email counts since this process started"""
+    return dict(_counters)
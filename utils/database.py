@@ -0,0 +1,119 @@
+"""Database maintenance helpers.
+
+The app has no migration tool: ``db.create_all()`` creates missing tables but
+never alters existing ones.  ``ensure_schema`` fills that gap for additive
+changes by adding the nullable columns and the indexes that a model declares
+but an existing table lacks.
+
+Deleted rows leave free pages inside a SQLite file.  With
+``auto_vacuum=INCREMENTAL`` (set on new databases by ``enable_incremental_vacuum``)
+``reclaim_space`` hands them back to the filesystem a few pages at a time,
+instead of a ``VACUUM`` that rewrites and locks the whole file.  PostgreSQL's
+autovacuum does this on its own.
+
+``configure_sqlite`` applies ``SQLITE_PRAGMAS`` (WAL journal, synchronous
+level, busy timeout, page cache and mmap size) to every new SQLite
+connection; ``python -m utils.dbbench`` measures what they buy.
+"""
+import time
+import logging
+from sqlalchemy import event, inspect, text
+from config import SQLITE_PRAGMAS
+
+logger = logging.getLogger(__name__)
+
+
+def configure_sqlite(engine, pragmas=None):
+    """Set ``pragmas`` (default ``SQLITE_PRAGMAS``) on each new connection of a SQLite engine"""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+def ensure_schema(db):
+    """Add columns and indexes missing from existing tables; returns the added column names"""
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {column['name'] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in present]
+        if missing:
+            added.extend(_add_columns(engine, table, missing))
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind=engine, checkfirst=True)
+                logger.info(f"Created index {index.name}")
+    if added:
+        logger.info(f"Added database columns: {', '.join(added)}")
+    return added
+
+
+def _add_columns(engine, table, missing):
+    added = []
+    with engine.begin() as conn:
+        for column in missing:
+            if not column.nullable and column.server_default is None:
+                logger.warning(f"Cannot add NOT NULL column {table.name}.{column.name} without a default")
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def enable_incremental_vacuum(engine, rebuild=False):
+    """Switch a SQLite database to ``auto_vacuum=INCREMENTAL``; returns True when it is on.
+
+    The mode only takes effect after a ``VACUUM``.  That is instant on a new
+    database; on an existing one ``rebuild`` runs it (once: it rewrites the
+    whole file).
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() == 2:
+            return True
+        conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+        if not inspect(conn).get_table_names():
+            conn.exec_driver_sql('VACUUM')
+        elif rebuild:
+            logger.info('Rebuilding the database with VACUUM to enable incremental vacuum')
+            conn.exec_driver_sql('VACUUM')
+        enabled = conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() == 2
+    if not enabled:
+        logger.info('Incremental vacuum is off for this database; `flask --app app init-db --vacuum` enables it')
+    return enabled
+
+
+def reclaim_space(engine, pages_per_step=2000, pause=0.05):
+    """Return free SQLite pages to the filesystem in short steps; returns the bytes freed"""
+    if engine.dialect.name != 'sqlite':
+        return 0
+    freed = 0
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+            return 0
+        page_size = conn.exec_driver_sql('PRAGMA page_size').scalar()
+        free = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+        while free:
+            # sqlite3's execute() steps this pragma once (one page); executescript runs it to completion
+            conn.connection.driver_connection.executescript(f'PRAGMA incremental_vacuum({min(free, pages_per_step)});')
+            remaining = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+            if remaining >= free:
+                break
+            freed += (free - remaining) * page_size
+            free = remaining
+            time.sleep(pause)
+    return freed
@@ -0,0 +1,289 @@
+"""Resource governor for analysis work: fair queuing, per-user limits and quotas.
+
+Uploads, live polls, testnet simulations and chunked-upload jobs all run
+the models, and any user could start as many as they liked.  Now each
+piece of work is admitted here first (``admit``):
+
+* Quotas: rows and bytes analysed per user over a sliding
+  ``GOVERNOR_QUOTA_WINDOW_SECONDS`` window.  Work from a user already over
+  quota is refused with ``QuotaExceeded``.
+* Concurrency: at most ``GOVERNOR_SLOTS`` analyses run at once, and at
+  most ``GOVERNOR_USER_CONCURRENCY`` of them for one user.
+* Fair queuing: when no slot is free, work waits in a start-time fair queue.
+  Each user's next item is tagged after their previous one by its cost
+  (estimated rows) divided by the user's weight, so a user who queues a
+  hundred large uploads gets their share, not the whole executor.
+* Admission control: interactive work (``defer=False``) is refused with
+  ``Overloaded`` and a ``retry_after`` when the queue is full or its
+  expected wait exceeds ``GOVERNOR_MAX_WAIT_SECONDS``.  Background jobs
+  (``defer=True``) wait their turn instead.
+
+Queue waits, admissions and refusals are counted per user (``stats``).
+State is per process, like the alert rate limits.
+"""
+import heapq
+import logging
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import (GOVERNOR_SLOTS, GOVERNOR_USER_CONCURRENCY, GOVERNOR_MAX_QUEUE, GOVERNOR_MAX_WAIT_SECONDS,
+                    GOVERNOR_QUOTA_WINDOW_SECONDS, GOVERNOR_ROW_QUOTA, GOVERNOR_BYTE_QUOTA, GOVERNOR_USER_WEIGHTS)
+
+logger = logging.getLogger(__name__)
+
+# Rough size of one CSV transaction row, to estimate an upload's rows from its bytes
+BYTES_PER_ROW = 100
+_RECENT_WAITS = 200
+
+
+class GovernorError(Exception):
+    """Work refused by the governor; ``retry_after`` is a suggested delay in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class QuotaExceeded(GovernorError):
+    """The user has analysed their row or byte quota for the current window."""
+
+
+class Overloaded(GovernorError):
+    """The executor is saturated and the work could not wait."""
+
+
+def estimate_rows(size_bytes):
+    return max(1, size_bytes // BYTES_PER_ROW)
+
+
+class _Waiter:
+    def __init__(self, user_id, start, finish):
+        self.user_id = user_id
+        self.start = start
+        self.finish = finish
+        self.granted = False
+
+
+class _UserStats:
+    def __init__(self):
+        self.admitted = 0
+        self.rejected = 0
+        self.quota_rejected = 0
+        self.waits = deque(maxlen=_RECENT_WAITS)
+        self.max_wait = 0.0
+        self.usage = deque()  # [time, rows, bytes] in the quota window
+
+    def to_dict(self):
+        waits = sorted(self.waits)
+        return {
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'quota_rejected': self.quota_rejected,
+            'wait_p50_seconds': round(waits[len(waits) // 2], 3) if waits else 0.0,
+            'wait_p95_seconds': round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 3) if waits else 0.0,
+            'wait_max_seconds': round(self.max_wait, 3),
+        }
+
+
+class Governor:
+    """Slots, a start-time fair queue over users, and per-user quotas."""
+
+    def __init__(self, slots=GOVERNOR_SLOTS, per_user=GOVERNOR_USER_CONCURRENCY, max_queue=GOVERNOR_MAX_QUEUE,
+                 max_wait=GOVERNOR_MAX_WAIT_SECONDS, window=GOVERNOR_QUOTA_WINDOW_SECONDS,
+                 row_quota=GOVERNOR_ROW_QUOTA, byte_quota=GOVERNOR_BYTE_QUOTA, weights=GOVERNOR_USER_WEIGHTS):
+        self.slots = max(1, slots)
+        self.per_user = max(1, per_user)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.window = window
+        self.row_quota = row_quota
+        self.byte_quota = byte_quota
+        self.weights = weights
+        self._cond = threading.Condition()
+        self._queue = []  # (start tag, sequence, waiter)
+        self._sequence = itertools.count()
+        self._virtual = 0.0
+        self._last_finish = {}
+        self._running = {}
+        self._busy = 0
+        self._service = 1.0  # moving average of seconds per admitted item
+        self._users = {}
+
+    def _user(self, user_id):
+        stats = self._users.get(user_id)
+        if stats is None:
+            stats = self._users[user_id] = _UserStats()
+        return stats
+
+    def _usage(self, user_id, now):
+        usage = self._user(user_id).usage
+        while usage and usage[0][0] < now - self.window:
+            usage.popleft()
+        return sum(entry[1] for entry in usage), sum(entry[2] for entry in usage), usage
+
+    def check_quota(self, user_id, rows=0, size=0):
+        """Raise ``QuotaExceeded`` if ``rows`` and ``size`` more would put the user over quota"""
+        now = time.monotonic()
+        with self._cond:
+            used_rows, used_bytes, usage = self._usage(user_id, now)
+            over = None
+            if self.row_quota and used_rows + rows > self.row_quota:
+                over = f"{self.row_quota} rows"
+            elif self.byte_quota and used_bytes + size > self.byte_quota:
+                over = f"{self.byte_quota} bytes"
+            if over is None:
+                return
+            self._user(user_id).quota_rejected += 1
+            retry_after = usage[0][0] + self.window - now if usage else self.window
+        raise QuotaExceeded(f"Analysis quota of {over} per {self.window:g} seconds reached", retry_after)
+
+    def charge(self, user_id, rows=0, size=0):
+        """Count analysed rows and bytes against the user's quota; returns the entry, which may be corrected"""
+        entry = [time.monotonic(), rows, size]
+        with self._cond:
+            self._user(user_id).usage.append(entry)
+        return entry
+
+    def expected_wait(self):
+        with self._cond:
+            return self._expected_wait()
+
+    def _expected_wait(self):
+        return (len(self._queue) + 1) * self._service / self.slots if self._busy >= self.slots else 0.0
+
+    def _eligible(self, waiter):
+        return self._running.get(waiter.user_id, 0) < self.per_user
+
+    def _dispatch(self):
+        """Grant free slots to the earliest-tagged waiters whose users are under their limit"""
+        if self._busy >= self.slots or not self._queue:
+            return
+        skipped = []
+        while self._queue and self._busy < self.slots:
+            item = heapq.heappop(self._queue)
+            waiter = item[2]
+            if not self._eligible(waiter):
+                skipped.append(item)
+                continue
+            waiter.granted = True
+            self._virtual = max(self._virtual, waiter.start)
+            self._running[waiter.user_id] = self._running.get(waiter.user_id, 0) + 1
+            self._busy += 1
+        for item in skipped:
+            heapq.heappush(self._queue, item)
+        self._cond.notify_all()
+
+    def acquire(self, user_id, cost=1, defer=False):
+        """Wait for a slot; returns seconds waited.  Without ``defer``, refuse rather than wait long"""
+        started = time.monotonic()
+        with self._cond:
+            stats = self._user(user_id)
+            expected = self._expected_wait()
+            saturated = self._busy >= self.slots
+            if not defer and saturated and (len(self._queue) >= self.max_queue or expected > self.max_wait):
+                stats.rejected += 1
+                raise Overloaded('The analysis service is busy, please retry shortly', expected or self._service)
+            weight = self.weights.get(user_id, 1.0)
+            start = max(self._virtual, self._last_finish.get(user_id, 0.0))
+            waiter = _Waiter(user_id, start, start + cost / weight)
+            self._last_finish[user_id] = waiter.finish
+            heapq.heappush(self._queue, (waiter.start, next(self._sequence), waiter))
+            self._dispatch()
+            deadline = None if defer else started + self.max_wait
+            while not waiter.granted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._queue = [item for item in self._queue if item[2] is not waiter]
+                    heapq.heapify(self._queue)
+                    if self._last_finish.get(user_id) == waiter.finish:
+                        self._last_finish[user_id] = waiter.start
+                    stats.rejected += 1
+                    raise Overloaded('The analysis service is busy, please retry shortly', self._service)
+                self._cond.wait(remaining)
+            waited = time.monotonic() - started
+            stats.admitted += 1
+            stats.waits.append(waited)
+            stats.max_wait = max(stats.max_wait, waited)
+            if len(self._last_finish) > 10000:
+                self._last_finish = {user: tag for user, tag in self._last_finish.items() if tag > self._virtual}
+        if waited > 1:
+            logger.info(f"User {user_id} waited {waited:.1f}s for an analysis slot")
+        return waited
+
+    def release(self, user_id, service_seconds):
+        with self._cond:
+            self._busy -= 1
+            self._running[user_id] -= 1
+            if not self._running[user_id]:
+                del self._running[user_id]
+            self._service = 0.8 * self._service + 0.2 * service_seconds
+            self._dispatch()
+
+    @contextmanager
+    def admit(self, user_id, cost=1, size=0, defer=False):
+        """Run a block of analysis work for ``user_id`` under the quotas and fair queue.
+
+        ``cost`` is the estimated rows, ``size`` the bytes read.  Both are
+        charged to the quota when the block is entered; the block may set
+        ``ticket['rows']`` to the actual row count to correct the estimate.
+        """
+        self.check_quota(user_id, cost, size)
+        waited = self.acquire(user_id, cost, defer)
+        entry = self.charge(user_id, cost, size)
+        ticket = {'waited': waited, 'rows': cost}
+        started = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            self.release(user_id, time.monotonic() - started)
+            with self._cond:
+                entry[1] = ticket['rows']
+
+    def stats(self, user_id=None):
+        """Queue and slot state, with per-user waits and quota use (one user's, or everyone's)"""
+        now = time.monotonic()
+        with self._cond:
+            users = [user_id] if user_id is not None else list(self._users)
+            per_user = {}
+            for user in users:
+                rows, size, _ = self._usage(user, now)
+                per_user[user] = {**self._user(user).to_dict(), 'running': self._running.get(user, 0),
+                                  'queued': sum(1 for _, _, waiter in self._queue if waiter.user_id == user),
+                                  'rows_used': rows, 'row_quota': self.row_quota,
+                                  'bytes_used': size, 'byte_quota': self.byte_quota}
+            return {
+                'slots': self.slots,
+                'busy': self._busy,
+                'queued': len(self._queue),
+                'expected_wait_seconds': round(self._expected_wait(), 3),
+                'users': per_user,
+            }
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = Governor()
+    return _governor
+
+
+def admit(user_id, cost=1, size=0, defer=False):
+    """``Governor.admit`` on the process-wide governor"""
+    return get_governor().admit(user_id, cost, size, defer)
+
+
+def refusal(e):
+    """JSON response for a refused request, with a Retry-After header"""
+    from flask import jsonify
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
@@ -1,29 +1,29 @@
 import os
+import logging
 from datetime import datetime
 from flask import current_app, request
-from models import ActivityLog, Alert
+from models import ActivityLog
 from app import db
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.lib import colors
 import json
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-from reportlab.platypus import Image
 from io import BytesIO
-from PIL import Image as PILImage
 import pytz
 
+logger = logging.getLogger(__name__)
+
+# reportlab, matplotlib and PIL are imported inside the report functions: they
+# take most of a worker's startup time and are only needed to build a PDF
+
+def _pyplot():
+    """matplotlib.pyplot on the non-interactive Agg backend, imported on first use"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
 def allowed_file(filename):
     """Check if file has allowed extension"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
+    name = filename.lower()
+    return any(name.endswith('.' + ext) for ext in current_app.config['ALLOWED_EXTENSIONS'])
 
 def log_activity(user_id, action, details=None):
     """Log user activity"""
@@ -38,26 +38,24 @@ def log_activity(user_id, action, details=None):
         db.session.add(activity)
         db.session.commit()
     except Exception as e:
-        print(f"Error logging activity: {str(e)}")
+        logger.error(f"Error logging activity: {str(e)}")
 
-def create_alert(user_id, alert_type, message, severity='medium'):
-    """Create alert for user"""
+def create_alert(user_id, alert_type, message, severity='medium', **kwargs):
+    """Create alert for user, or fold it into the same open incident (see utils/alerts.py)"""
     try:
-        alert = Alert(
-            user_id=user_id,
-            alert_type=alert_type,
-            message=message,
-            severity=severity,
-            is_read=False,
-            created_at=datetime.utcnow()
-        )
-        db.session.add(alert)
-        db.session.commit()
+        from utils.alerts import raise_alert
+        return raise_alert(user_id, alert_type, message, severity, **kwargs)
     except Exception as e:
-        print(f"Error creating alert: {str(e)}")
+        db.session.rollback()
+        logger.error(f"Error creating alert: {str(e)}")
 
 def generate_simple_report(analysis, user_email=None, download_time=None):
     """Generate a simple fallback PDF report if main generation fails"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.lib import colors
     try:
         reports_dir = 'reports'
         os.makedirs(reports_dir, exist_ok=True)
@@ -124,11 +122,31 @@ def generate_simple_report(analysis, user_email=None, download_time=None):
         return filepath
         
     except Exception as e:
-        print(f"Error generating simple report: {str(e)}")
+        logger.exception(f"Error generating simple report: {str(e)}")
         return None
 
+def alert_on_drift(drift):
+    """Log to the system log when a scoring path's features passed the drift threshold.
+
+    Drift monitors are shared by everyone on a path, so the user whose data
+    tipped the PSI over is not the one to alert.
+    """
+    if not drift or not drift.get('new_drift'):
+        return
+    worst = max(drift['psi'][name] for name in drift['new_drift'])
+    details = ', '.join(f"{name} (PSI {drift['psi'][name]:.2f})" for name in drift['new_drift'])
+    log = logger.error if worst >= 0.5 else logger.warning
+    log(f"Input drift on {drift['path']} data: {details} no longer match the training distribution")
+
 def generate_report(analysis, user_email=None, download_time=None):
     """Generate fully professional PDF report with comprehensive graphs and proper page flow"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak, Image
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.lib import colors
+    from PIL import Image as PILImage
+    plt = _pyplot()
     try:
         reports_dir = 'reports'
         os.makedirs(reports_dir, exist_ok=True)
@@ -325,14 +343,18 @@ def generate_report(analysis, user_email=None, download_time=None):
             story.append(Spacer(1, 20))
         
         # 2. Enhanced Bar Chart (Model Performance)
-        if analysis.results:
+        if analysis.get_results():
             try:
-                results_data = json.loads(analysis.results)
+                results_data = json.loads(analysis.get_results())
+                measured = measured_model_metrics(results_data)
                 
-                # Create comprehensive model performance chart
-                models = ['SVM', 'Random Forest', 'AdaBoost', 'XGBoost', 'Ensemble']
-                accuracies = [85, 87, 82, 89, round(analysis.accuracy_score * 100, 1)]
-                colors_bar = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFD93D']
+                # Create comprehensive model performance chart from the measured test accuracies
+                models = [label for key, label in MODEL_DISPLAY_NAMES if key in measured]
+                accuracies = [round(measured[key].get('accuracy', 0.0) * 100, 1)
+                              for key, label in MODEL_DISPLAY_NAMES if key in measured]
+                if not models:
+                    raise ValueError("no measured model metrics in analysis results")
+                colors_bar = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFD93D'][:len(models)]
                 
                 fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 8))
                 
@@ -354,7 +376,7 @@ def generate_report(analysis, user_email=None, download_time=None):
                 ax2.set_ylabel('Accuracy Trend (%)', fontweight='bold', fontsize=12)
                 ax2.set_title('Performance Trend Analysis', fontsize=12, fontweight='bold')
                 ax2.grid(True, alpha=0.3)
-                ax2.set_ylim(75, 95)
+                ax2.set_ylim(max(0, min(accuracies) - 10), min(100, max(accuracies) + 10))
                 
                 # Add trend annotations
                 for i, (model, acc) in enumerate(zip(models, accuracies)):
@@ -377,7 +399,7 @@ def generate_report(analysis, user_email=None, download_time=None):
                 story.append(Spacer(1, 20))
                 
             except Exception as e:
-                print(f"Error creating model performance chart: {str(e)}")
+                logger.error(f"Error creating model performance chart: {str(e)}")
         
         # Page break for detailed tables
         story.append(PageBreak())
@@ -390,15 +412,20 @@ def generate_report(analysis, user_email=None, download_time=None):
         story.append(model_header)
         story.append(Spacer(1, 20))
         
-        # Enhanced Model Performance Table
-        model_data = [
-            ['Model', 'Accuracy', 'Status', 'Strengths', 'Use Case'],
-            ['SVM', '85%', 'Good', 'Linear separation, Kernel flexibility', 'Linear pattern detection'],
-            ['Random Forest', '87%', 'Excellent', 'Handles non-linear data, Robust', 'Complex pattern recognition'],
-            ['AdaBoost', '82%', 'Good', 'Boosting, Sequential learning', 'Weak learner combination'],
-            ['XGBoost', '89%', 'Excellent', 'Gradient boosting, Regularization', 'High-performance prediction'],
-            ['Ensemble', f"{analysis.accuracy_score:.1%}", 'Optimal', 'Combined predictions, Robust', 'Final decision making']
-        ]
+        # Enhanced Model Performance Table (accuracies measured on the held-out test split)
+        measured = measured_model_metrics(json.loads(analysis.get_results()) if analysis.get_results() else {})
+        model_info = {
+            'svm': ('Linear separation, Kernel flexibility', 'Boundary cases (cascade)'),
+            'random_forest': ('Handles non-linear data, Robust', 'Complex pattern recognition'),
+            'adaboost': ('Boosting, Sequential learning', 'Weak learner combination'),
+            'xgboost': ('Gradient boosting, Regularization', 'High-performance prediction'),
+            'ensemble': ('Calibrated stacking of all models', 'Final decision making'),
+        }
+        model_data = [['Model', 'Accuracy', 'Balanced Acc.', 'Strengths', 'Use Case']]
+        for key, label in MODEL_DISPLAY_NAMES:
+            values = measured.get(key, {})
+            model_data.append([label, format_metric(values.get('accuracy')),
+                               format_metric(values.get('balanced_accuracy')), *model_info[key]])
         
         model_table = Table(model_data, colWidths=[1.2*inch, 1*inch, 1.2*inch, 2*inch, 2.2*inch])
         model_table.setStyle(TableStyle([
@@ -423,13 +450,14 @@ def generate_report(analysis, user_email=None, download_time=None):
         story.append(Spacer(1, 15))
         
         # Create metrics visualization
-        metrics_data = [
-            ['Metric', 'SVM', 'Random Forest', 'AdaBoost', 'XGBoost', 'Ensemble'],
-            ['Precision', '83%', '86%', '81%', '88%', f"{analysis.accuracy_score:.0%}"],
-            ['Recall', '82%', '85%', '80%', '87%', f"{analysis.accuracy_score:.0%}"],
-            ['F1-Score', '82.5%', '85.5%', '80.5%', '87.5%', f"{analysis.accuracy_score:.0%}"],
+        metrics_data = [['Metric'] + [label for key, label in MODEL_DISPLAY_NAMES]]
+        for metric, title in [('precision', 'Precision'), ('recall', 'Recall'), ('f1', 'F1-Score'), ('auc', 'ROC AUC')]:
+            fmt = '{:.3f}' if metric == 'auc' else '{:.1%}'
+            metrics_data.append([title] + [format_metric(measured.get(key, {}).get(metric), fmt)
+                                           for key, label in MODEL_DISPLAY_NAMES])
+        metrics_data += [
             ['Training Time', 'Fast', 'Medium', 'Fast', 'Slow', 'Medium'],
-            ['Prediction Time', 'Fast', 'Fast', 'Fast', 'Fast', 'Fast']
+            ['Prediction Time', 'Slow', 'Fast', 'Fast', 'Fast', 'Fast (cascade)']
         ]
         
         metrics_table = Table(metrics_data, colWidths=[1.5*inch, 1.2*inch, 1.2*inch, 1.2*inch, 1.2*inch, 1.2*inch])
@@ -460,13 +488,15 @@ def generate_report(analysis, user_email=None, download_time=None):
         story.append(anomaly_header)
         story.append(Spacer(1, 20))
         
-        if analysis.results:
+        if analysis.get_results():
             try:
-                results_data = json.loads(analysis.results)
+                results_data = json.loads(analysis.get_results())
                 
                 # Anomaly Summary Statistics
                 if 'anomaly_indices' in results_data and results_data['anomaly_indices']:
                     anomaly_indices = results_data['anomaly_indices']
+                    ranking = anomaly_ranking(results_data)
+                    severity_counts = ranking['severity_counts'] if ranking else None
                     
                     # Anomaly Overview
                     story.append(Paragraph("Anomaly Detection Summary", styles['Heading2']))
@@ -476,7 +506,9 @@ def generate_report(analysis, user_email=None, download_time=None):
                         ['Metric', 'Value', 'Description'],
                         ['Total Anomalies', f"{len(anomaly_indices):,}", 'Transactions flagged as suspicious'],
                         ['Anomaly Rate', f"{(len(anomaly_indices) / analysis.total_transactions * 100):.2f}%", 'Percentage of total transactions'],
-                        ['Detection Confidence', 'High', 'Multi-model ensemble validation'],
+                        ['Critical / High Severity',
+                         f"{severity_counts['Critical']:,} / {severity_counts['High']:,}" if ranking else 'n/a',
+                         'Scores in the top 0.1% / 1% of this file'],
                         ['Risk Level', 'Medium' if (len(anomaly_indices) / analysis.total_transactions) > 0.05 else 'Low', 'Based on anomaly rate']
                     ]
                     
@@ -501,33 +533,24 @@ def generate_report(analysis, user_email=None, download_time=None):
                         story.append(Paragraph("Anomaly Distribution Analysis", styles['Heading2']))
                         story.append(Spacer(1, 12))
                         
-                        # Create anomaly severity distribution
+                        # Severity distribution from the ensemble score quantiles
                         fig, ax = plt.subplots(figsize=(8, 5))
                         
-                        # Simulate severity levels based on position
-                        severities = ['Low', 'Medium', 'High', 'Critical']
-                        severity_counts = []
-                        
-                        for i, severity in enumerate(severities):
-                            if i == 0:  # Low
-                                count = max(1, len(anomaly_indices) // 4)
-                            elif i == 1:  # Medium
-                                count = max(1, len(anomaly_indices) // 3)
-                            elif i == 2:  # High
-                                count = max(1, len(anomaly_indices) // 4)
-                            else:  # Critical
-                                count = max(1, len(anomaly_indices) - sum(severity_counts))
-                            severity_counts.append(count)
-                        
-                        colors_severity = ['#28a745', '#ffc107', '#fd7e14', '#dc3545']
-                        bars = ax.bar(severities, severity_counts, color=colors_severity, alpha=0.8, edgecolor='black')
+                        if severity_counts:
+                            severities = list(severity_counts)
+                            counts = [severity_counts[level] for level in severities]
+                        else:
+                            # Results saved without row scores: severity is unknown
+                            severities, counts = ['Unscored'], [len(anomaly_indices)]
+                        bars = ax.bar(severities, counts, color=[SEVERITY_CHART_COLORS.get(level, '#6c757d') for level in severities],
+                                      alpha=0.8, edgecolor='black')
                         
                         ax.set_ylabel('Number of Anomalies', fontweight='bold', fontsize=12)
                         ax.set_title('Anomaly Severity Distribution', fontsize=14, fontweight='bold', pad=20)
                         ax.grid(True, alpha=0.3, axis='y')
                         
                         # Add value labels
-                        for bar, count in zip(bars, severity_counts):
+                        for bar, count in zip(bars, counts):
                             height = bar.get_height()
                             ax.text(bar.get_x() + bar.get_width()/2., height + 0.1,
                                     f'{count}', ha='center', va='bottom', fontweight='bold')
@@ -551,22 +574,28 @@ def generate_report(analysis, user_email=None, download_time=None):
                         story.append(Paragraph("Top Anomaly Details", styles['Heading3']))
                         story.append(Spacer(1, 12))
                         
-                        # Create detailed anomaly table
-                        anomaly_table_data = [['Index', 'Severity', 'Confidence', 'Detection Method', 'Risk Assessment']]
+                        # Highest-scoring anomalies from the stored top-k ranking
+                        anomaly_table_data = [['Rank', 'Index', 'Severity', 'Ensemble Score', 'Strongest Model', 'Its Probability']]
+                        probabilities = results_data.get('model_probabilities') or {}
+                        top = ranking['top'][:15] if ranking else [{'index': idx} for idx in anomaly_indices[:15]]
                         
-                        for i, idx in enumerate(anomaly_indices[:15]):  # Show top 15
-                            severity = severities[min(i % len(severities), 3)]
-                            confidence = f"{85 + (i % 15):.1f}%"
-                            detection_method = ['SVM', 'Random Forest', 'AdaBoost', 'XGBoost'][i % 4]
-                            risk = ['Low', 'Medium', 'High'][i % 3]
-                            
-                            anomaly_table_data.append([str(idx), severity, confidence, detection_method, risk])
+                        for rank, entry in enumerate(top, 1):
+                            idx = entry['index']
+                            # Models that scored this row (the SVM may have been skipped by the cascade)
+                            row_probs = {label: probabilities[key][idx] for key, label in MODEL_DISPLAY_NAMES
+                                         if key in probabilities and probabilities[key][idx] is not None}
+                            strongest = max(row_probs, key=row_probs.get) if row_probs else None
+                            anomaly_table_data.append([
+                                str(rank), str(idx), entry.get('severity', 'n/a'),
+                                f"{entry['score']:.3f}" if 'score' in entry else 'n/a',
+                                strongest or 'n/a',
+                                f"{row_probs[strongest]:.3f}" if strongest else 'n/a'
+                            ])
                         
-                        if len(anomaly_indices) > 15:
-                            anomaly_table_data.append(['...', '...', '...', '...', '...'])
-                            anomaly_table_data.append([f'Total: {len(anomaly_indices)}', '', '', '', ''])
+                        if len(anomaly_indices) > len(top):
+                            anomaly_table_data.append([f'Top {len(top)} of {len(anomaly_indices):,} anomalies by ensemble score', '', '', '', '', ''])
                         
-                        anomaly_table = Table(anomaly_table_data, colWidths=[1*inch, 1.2*inch, 1.2*inch, 1.5*inch, 1.5*inch])
+                        anomaly_table = Table(anomaly_table_data, colWidths=[0.6*inch, 0.9*inch, 1*inch, 1.2*inch, 1.3*inch, 1.4*inch])
                         anomaly_table.setStyle(TableStyle([
                             ('BACKGROUND', (0, 0), (-1, 0), colors.darkred),
                             ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
@@ -579,6 +608,8 @@ def generate_report(analysis, user_email=None, download_time=None):
                             ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
                             ('FONTSIZE', (0, 1), (-1, -1), 8),
                         ]))
+                        if len(anomaly_indices) > len(top):
+                            anomaly_table.setStyle(TableStyle([('SPAN', (0, -1), (-1, -1))]))
                         
                         story.append(anomaly_table)
                         story.append(Spacer(1, 20))
@@ -589,7 +620,7 @@ def generate_report(analysis, user_email=None, download_time=None):
                     story.append(Paragraph("This indicates that all transactions appear to be within normal parameters.", styles['Normal']))
                     
             except Exception as e:
-                print(f"Error processing anomaly data: {str(e)}")
+                logger.error(f"Error processing anomaly data: {str(e)}")
                 story.append(Paragraph("Error processing anomaly data. Please check the analysis results.", styles['Normal']))
         
         # Page break for final summary
@@ -687,15 +718,16 @@ def generate_report(analysis, user_email=None, download_time=None):
         return filepath
         
     except Exception as e:
-        print(f"Error generating report: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error generating report: {str(e)}")
         # Try to generate simple report as fallback
-        print("Attempting to generate simple fallback report...")
+        logger.info("Attempting to generate simple fallback report...")
         return generate_simple_report(analysis, user_email, download_time)
 
 def test_pdf_generation():
     """Test basic PDF generation to identify the issue"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet
     try:
         reports_dir = 'reports'
         os.makedirs(reports_dir, exist_ok=True)
@@ -720,13 +752,11 @@ def test_pdf_generation():
         story.append(Paragraph("This is a test report.", styles['Normal']))
         
         doc.build(story)
-        print(f"Test PDF generated successfully: {filepath}")
+        logger.info(f"Test PDF generated successfully: {filepath}")
         return filepath
         
     except Exception as e:
-        print(f"Test PDF generation failed: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Test PDF generation failed: {str(e)}")
         return None
 
 def format_timestamp(timestamp):
@@ -741,6 +771,43 @@ def calculate_anomaly_percentage(total, anomalies):
         return 0
     return (anomalies / total) * 100
 
+MODEL_DISPLAY_NAMES = [('svm', 'SVM'), ('random_forest', 'Random Forest'),
+                       ('adaboost', 'AdaBoost'), ('xgboost', 'XGBoost'), ('ensemble', 'Ensemble')]
+
+def measured_model_metrics(results_data):
+    """Test-set metrics recorded with the model artifact, keyed by model name.
+
+    The ensemble entry is the one for the mode the analysis actually ran in.
+    """
+    metrics = dict((results_data or {}).get('model_metrics') or {})
+    ensemble = metrics.pop('ensemble', None)
+    if ensemble:
+        mode = results_data.get('ensemble_mode')
+        metrics['ensemble'] = ensemble.get('cascade' if mode == 'cascade' else 'full') or ensemble.get('full', {})
+    return metrics
+
+def anomaly_ranking(results_data):
+    """Top-k anomaly ranking for an analysis.
+
+    Results saved before rankings were stored are ranked from their row scores
+    when they have them; otherwise None.
+    """
+    results_data = results_data or {}
+    if results_data.get('anomaly_ranking'):
+        return results_data['anomaly_ranking']
+    scores = results_data.get('ensemble_scores')
+    if not scores:
+        return None
+    from ml.ranking import rank_anomalies
+    flagged = results_data.get('ensemble_prediction') or [score >= 0.5 for score in scores]
+    return rank_anomalies(scores, flagged)
+
+def format_metric(value, fmt='{:.1%}'):
+    """Format a metric value, or 'n/a' when it was not measured"""
+    return fmt.format(value) if value is not None else 'n/a'
+
+SEVERITY_CHART_COLORS = {'Low': '#28a745', 'Medium': '#ffc107', 'High': '#fd7e14', 'Critical': '#dc3545'}
+
 def get_severity_color(severity):
     """Get color class for severity level"""
     colors = {
@@ -751,25 +818,12 @@ def get_severity_color(severity):
     }
     return colors.get(severity, 'text-secondary')
 
-def send_email(to_email, subject, body):
-    """Send an email using Gmail SMTP"""
+def send_email(to_email, subject, body, user_id=None, kind='generic', coalesce_key=None):
+    """Queue an email in the outbox; the background sender in utils/mailer.py delivers it"""
     try:
-        gmail_user = os.environ.get('GMAIL_USER') or 'no.reply.btcsleuth@gmail.com'
-        gmail_password = os.environ.get('GMAIL_PASSWORD') or 'mqow mcnn gubq ihvj'
-        
-        msg = MIMEMultipart()
-        msg['From'] = gmail_user
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
-
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(gmail_user, gmail_password)
-        text = msg.as_string()
-        server.sendmail(gmail_user, to_email, text)
-        server.quit()
+        from utils.mailer import queue_email
+        queue_email(to_email, subject, body, user_id=user_id, kind=kind, coalesce_key=coalesce_key)
         return True
     except Exception as e:
-        print(f"Error sending email: {str(e)}")
+        logger.error(f"Error queueing email: {str(e)}")
         return False
@@ -0,0 +1,50 @@
+"""Background jobs for work that should not hold a request open.
+
+Jobs run on a small thread pool in the web process (``JOB_WORKERS``
+threads), each inside its own app context with the database session removed
+afterwards.  Callers record progress on their own rows (e.g.
+``Analysis.status``), so a job only has to log what it could not record.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import JOB_WORKERS
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, JOB_WORKERS), thread_name_prefix='job')
+    return _executor
+
+
+def _run(app, fn, args, kwargs, log_fields):
+    from app import db
+    from utils.logs import log_context
+    with app.app_context(), log_context(**log_fields):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Background job {fn.__name__} failed: {str(e)}")
+        finally:
+            db.session.remove()
+
+
+def submit(fn, *args, app=None, **kwargs):
+    """Run ``fn(*args, **kwargs)`` on the job pool inside an app context; returns the future.
+
+    The job logs with the submitting request's ids (see ``utils.logs``).
+    """
+    from utils.logs import current_fields
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+    return get_executor().submit(_run, app, fn, args, kwargs, current_fields())
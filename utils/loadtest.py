@@ -0,0 +1,571 @@
+"""Load test: simulated dashboard users against a local app instance.
+
+Starts the app (``flask run``) in a scratch directory with its own SQLite
+database, a Binance REST stub and an SMTP stub, then runs ``--users``
+scripted sessions against it for ``--duration`` seconds.  Each session
+registers (reading its verification code from the SMTP stub), logs in and
+then behaves like a user with the dashboard open:
+
+* live analysis poll every 10s, and the anomaly email the page sends after it
+* market-data poll every 30s
+* dashboard reload every 60s
+* a testnet simulation every 90s
+* an upload every 120s (small, medium or large CSV drawn from Dataset.csv),
+  its results page and its PDF report
+
+Intervals are jittered and sessions start spread over ``--ramp-up``.  The
+report gives per-endpoint request counts, throughput, latency percentiles
+and error and throttling (429) rates, plus the server's CPU and RSS sampled
+every ``--sample-seconds``.  ``--json`` writes the same numbers to a file,
+so capacity can be compared release by release.
+
+    python -m utils.loadtest --users 20 --duration 300 --json loadtest.json
+
+Server metrics are read from ``/proc``, so they need Linux.
+"""
+import os
+import re
+import io
+import csv
+import sys
+import json
+import time
+import email
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import socketserver
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from config import BASE_DIR
+
+# Seconds between one session's actions, each jittered by +-20%
+SESSION_INTERVALS = {'live': 10, 'market': 30, 'dashboard': 60, 'testnet': 90, 'upload': 120}
+UPLOAD_ROWS = {'small': 200, 'medium': 2000, 'large': 20000}
+SYMBOLS = ('BTCUSDT', 'ETHUSDT')
+PASSWORD = 'loadtest-password'
+LEGACY_MODEL_FILE = re.compile(r'.+\.pkl$')
+_CSRF = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+_CODE = re.compile(r'verification code is: (\d+)')
+_RESULTS = re.compile(r'/results/(\d+)$')
+
+
+class FakeExchange:
+    """Binance REST stub: ping, recent trades, 24h ticker, order book and klines around a random walk."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._trade_id = 1
+        self._prices = {symbol: 60000.0 if symbol.startswith('BTC') else 3000.0 for symbol in SYMBOLS}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _ExchangeHandler)
+        self.server.daemon_threads = True
+        self.server.exchange = self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-exchange', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _price(self, symbol):
+        price = self._prices.get(symbol, 100.0) * (1 + random.gauss(0, 0.0005))
+        self._prices[symbol] = price
+        return price
+
+    def respond(self, path, params):
+        """JSON payload for a REST path, or None for an unknown one"""
+        symbol = params.get('symbol', 'BTCUSDT')
+        limit = int(params.get('limit', 500))
+        now = int(time.time() * 1000)
+        with self._lock:
+            self.requests += 1
+            price = self._price(symbol)
+            if path == '/api/v3/trades':
+                first = self._trade_id
+                self._trade_id += limit
+        if path in ('/api/v3/ping', '/api/v3/time'):
+            return {'serverTime': now}
+        if path == '/api/v3/trades':
+            trades = []
+            for i in range(limit):
+                # About one trade in 200 is a whale, so live analysis has something to find
+                qty = random.expovariate(20) * (200 if random.random() < 0.005 else 1)
+                trade_price = price * (1 + random.gauss(0, 0.0002))
+                trades.append({'id': first + i, 'price': f"{trade_price:.2f}", 'qty': f"{qty:.5f}",
+                               'quoteQty': f"{trade_price * qty:.2f}", 'time': now - (limit - i) * 50,
+                               'isBuyerMaker': random.random() < 0.5, 'isBestMatch': True})
+            return trades
+        if path == '/api/v3/ticker/24hr':
+            return {'symbol': symbol, 'lastPrice': f"{price:.2f}", 'openPrice': f"{price * 0.99:.2f}",
+                    'highPrice': f"{price * 1.02:.2f}", 'lowPrice': f"{price * 0.98:.2f}",
+                    'priceChange': f"{price * 0.01:.2f}", 'priceChangePercent': '1.01', 'weightedAvgPrice': f"{price:.2f}",
+                    'volume': '12345.678', 'quoteVolume': f"{price * 12345.678:.2f}", 'count': 100000,
+                    'openTime': now - 86400000, 'closeTime': now}
+        if path == '/api/v3/depth':
+            return {'lastUpdateId': now,
+                    'bids': [[f"{price - 0.5 * (i + 1):.2f}", f"{random.uniform(0.01, 2):.5f}"] for i in range(limit)],
+                    'asks': [[f"{price + 0.5 * (i + 1):.2f}", f"{random.uniform(0.01, 2):.5f}"] for i in range(limit)]}
+        if path == '/api/v3/klines':
+            step = 3600000
+            klines = []
+            for i in range(limit):
+                open_time = (now // step - limit + i + 1) * step
+                close = price * (1 + random.gauss(0, 0.005))
+                klines.append([open_time, f"{price:.2f}", f"{max(price, close) * 1.001:.2f}",
+                               f"{min(price, close) * 0.999:.2f}", f"{close:.2f}", '100.0', open_time + step - 1,
+                               f"{close * 100:.2f}", 1000, '50.0', f"{close * 50:.2f}", '0'])
+            return klines
+        return None
+
+
+class _ExchangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        exchange = self.server.exchange
+        if exchange.latency:
+            time.sleep(exchange.latency)
+        url = urlparse(self.path)
+        payload = exchange.respond(url.path, {key: values[0] for key, values in parse_qs(url.query).items()})
+        body = json.dumps(payload if payload is not None else {'code': -1, 'msg': 'Unknown path'}).encode()
+        self.send_response(200 if payload is not None else 404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeSMTP:
+    """SMTP stub that accepts any login and keeps every message it receives."""
+
+    def __init__(self):
+        self.messages = []
+        self._lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPHandler)
+        self.server.daemon_threads = True
+        self.server.smtp = self
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-smtp', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def received(self, recipient, data):
+        message = email.message_from_string(data)
+        body = ''.join(part.get_payload(decode=True).decode(errors='replace')
+                       for part in message.walk() if part.get_content_type() == 'text/plain')
+        with self._lock:
+            self.messages.append((recipient, message['Subject'], body))
+
+    def wait_for(self, recipient, pattern, timeout=30):
+        """First match of ``pattern`` in a message to ``recipient``, waiting up to ``timeout`` seconds"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                for to, _, body in self.messages:
+                    match = pattern.search(body) if to == recipient else None
+                    if match:
+                        return match
+            time.sleep(0.2)
+        return None
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        smtp = self.server.smtp
+        self.reply('220 loadtest ESMTP')
+        recipients, data = [], None
+        for raw in self.rfile:
+            line = raw.decode(errors='replace').rstrip('\r\n')
+            if data is not None:
+                if line == '.':
+                    for recipient in recipients:
+                        smtp.received(recipient, '\n'.join(data))
+                    recipients, data = [], None
+                    self.reply('250 OK queued')
+                else:
+                    data.append(line[1:] if line.startswith('..') else line)
+                continue
+            command = line.split(' ', 1)[0].upper()
+            if command == 'EHLO':
+                self.reply('250-loadtest')
+                self.reply('250 AUTH PLAIN LOGIN')
+            elif command == 'AUTH':
+                self.reply('235 Authentication successful')
+            elif command == 'RCPT':
+                recipients.append(line.split(':', 1)[1].strip().strip('<>'))
+                self.reply('250 OK')
+            elif command == 'DATA':
+                data = []
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            elif command in ('HELO', 'MAIL', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            else:
+                self.reply('502 Command not implemented')
+
+
+class Stats:
+    """Latencies and outcomes per endpoint, shared by all sessions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, name, seconds, outcome):
+        with self._lock:
+            entry = self.endpoints.setdefault(name, {'latencies': [], 'errors': 0, 'throttled': 0})
+            entry['latencies'].append(seconds)
+            if outcome != 'ok':
+                entry[outcome] += 1
+
+    def summary(self, duration):
+        rows = {}
+        with self._lock:
+            for name, entry in sorted(self.endpoints.items()):
+                latencies = sorted(entry['latencies'])
+                count = len(latencies)
+                rows[name] = {
+                    'requests': count,
+                    'per_second': count / duration,
+                    'p50_ms': _percentile(latencies, 0.5) * 1000,
+                    'p95_ms': _percentile(latencies, 0.95) * 1000,
+                    'p99_ms': _percentile(latencies, 0.99) * 1000,
+                    'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+                    'error_rate': entry['errors'] / count if count else 0.0,
+                    'throttled_rate': entry['throttled'] / count if count else 0.0,
+                }
+        return rows
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class ProcessSampler(threading.Thread):
+    """Samples a process's CPU use (percent of one core) and RSS from /proc."""
+
+    def __init__(self, pid, interval):
+        super().__init__(name='process-sampler', daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._ticks = os.sysconf('SC_CLK_TCK')
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+
+    def _read(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{self.pid}/statm') as f:
+            rss_pages = int(f.read().split()[1])
+        # utime and stime are fields 14 and 15 of stat, i.e. 11 and 12 after the command name
+        return (int(fields[11]) + int(fields[12])) / self._ticks, rss_pages * self._page_size
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            last_cpu, _ = self._read()
+        except OSError:
+            return
+        last = started
+        while not self._stop_event.wait(self.interval):
+            try:
+                cpu, rss = self._read()
+            except OSError:
+                return
+            now = time.monotonic()
+            self.samples.append({'t': round(now - started, 1), 'cpu_percent': round(100 * (cpu - last_cpu) / (now - last), 1),
+                                 'rss_mb': round(rss / 1024 / 1024, 1)})
+            last_cpu, last = cpu, now
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def summary(self):
+        if not self.samples:
+            return {}
+        cpu = sorted(sample['cpu_percent'] for sample in self.samples)
+        rss = [sample['rss_mb'] for sample in self.samples]
+        return {'cpu_percent_mean': round(sum(cpu) / len(cpu), 1), 'cpu_percent_p95': _percentile(cpu, 0.95),
+                'rss_mb_start': rss[0], 'rss_mb_max': max(rss), 'rss_mb_end': rss[-1]}
+
+
+def make_csv(rows, source=os.path.join(BASE_DIR, 'Dataset.csv')):
+    """An upload of ``rows`` transactions sampled from the training dataset"""
+    with open(source, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        data = list(reader)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(header)
+    writer.writerows(random.choice(data) for _ in range(rows))
+    return out.getvalue().encode()
+
+
+class Session(threading.Thread):
+    """One simulated user: register, log in, then poll and upload on the dashboard's schedule."""
+
+    def __init__(self, number, base_url, smtp, stats, uploads, stop_event, start_delay):
+        super().__init__(name=f'session-{number}', daemon=True)
+        self.username = f'load{number:04d}_{random.randrange(10 ** 6):06d}'
+        self.email = f'{self.username}@example.com'
+        self.base_url = base_url
+        self.smtp = smtp
+        self.stats = stats
+        self.uploads = uploads
+        self.stop_event = stop_event
+        self.start_delay = start_delay
+        self.http = requests.Session()
+        self.symbol = random.choice(SYMBOLS)
+        self.failed = None
+
+    def call(self, name, method, path, expect=(200,), check=None, **kwargs):
+        """Timed request, recorded under ``name``; returns the response or None.
+
+        It counts as an error unless its status is in ``expect`` and ``check``
+        (if given) accepts the response.
+        """
+        kwargs.setdefault('timeout', 120)
+        kwargs.setdefault('allow_redirects', False)
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, **kwargs)
+        except requests.RequestException:
+            self.stats.record(name, time.perf_counter() - started, 'errors')
+            return None
+        elapsed = time.perf_counter() - started
+        if response.status_code == 429:
+            outcome = 'throttled'
+        elif response.status_code in expect and (check is None or check(response)):
+            outcome = 'ok'
+        else:
+            outcome = 'errors'
+        self.stats.record(name, elapsed, outcome)
+        return response
+
+    def form(self, name, path, fields, expect=(302,)):
+        page = self.call(f'{name} (form)', 'GET', path)
+        token = _CSRF.search(page.text) if page is not None else None
+        if token is None:
+            return None
+        return self.call(name, 'POST', path, expect=expect, data={**fields, 'csrf_token': token.group(1)})
+
+    def sign_up(self):
+        response = self.form('register', '/auth/register', {'username': self.username, 'email': self.email,
+                                                            'password': PASSWORD, 'password2': PASSWORD})
+        if response is None or response.status_code != 302:
+            return False
+        code = self.smtp.wait_for(self.email, _CODE)
+        if code is None:
+            return False
+        response = self.form('verify', '/auth/verify', {'code': code.group(1)})
+        if response is None or response.status_code != 302:
+            return False
+        response = self.form('login', '/auth/login', {'username': self.username, 'password': PASSWORD})
+        return response is not None and 'dashboard' in response.headers.get('Location', '')
+
+    def live(self):
+        response = self.call('live-data', 'GET', '/binance/live-data', params={'symbol': self.symbol})
+        if response is None or response.status_code != 200:
+            return
+        anomalies = response.json().get('data', {}).get('anomalies_detected', 0)
+        if anomalies:
+            self.call('send-anomaly-email', 'POST', '/api/send-anomaly-email',
+                      json={'anomaly_count': anomalies, 'details': f'{self.symbol} live analysis'})
+
+    def market(self):
+        self.call('market-data', 'GET', '/binance/market-data', params={'symbol': self.symbol})
+
+    def dashboard(self):
+        self.call('dashboard', 'GET', '/dashboard')
+
+    def testnet(self):
+        self.call('testnet-simulate', 'POST', '/binance/testnet-simulate',
+                  json={'num_transactions': random.choice((50, 200, 1000))})
+
+    def upload(self):
+        size = random.choice(list(UPLOAD_ROWS))
+        # A redirect back to the form instead of to the results means the upload was refused or failed
+        response = self.call(f'upload ({size})', 'POST', '/upload', expect=(302,),
+                             check=lambda r: _RESULTS.search(r.headers.get('Location', '')),
+                             files={'file': (f'{size}.csv', self.uploads[size], 'text/csv')})
+        match = _RESULTS.search(response.headers.get('Location', '')) if response is not None else None
+        if match is None:
+            return
+        self.call('results', 'GET', f'/results/{match.group(1)}')
+        self.call('download-report', 'GET', f'/download-report/{match.group(1)}',
+                  check=lambda r: r.headers.get('Content-Type') == 'application/pdf')
+
+    def run(self):
+        if self.stop_event.wait(self.start_delay):
+            return
+        if not self.sign_up():
+            self.failed = 'sign-up failed'
+            return
+        self.dashboard()
+        now = time.monotonic()
+        # Staggered first runs, as if the pages were opened at different moments
+        due = {action: now + random.uniform(0, interval) for action, interval in SESSION_INTERVALS.items()}
+        while not self.stop_event.is_set():
+            action = min(due, key=due.get)
+            if self.stop_event.wait(max(0.0, due[action] - time.monotonic())):
+                break
+            getattr(self, action)()
+            due[action] = time.monotonic() + SESSION_INTERVALS[action] * random.uniform(0.8, 1.2)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_app(workdir, port, exchange, smtp, log_path):
+    """``flask run`` in ``workdir`` with a scratch database and the stubs; returns the process"""
+    # The legacy models are looked up in the working directory, as in the project root
+    for name in os.listdir(BASE_DIR):
+        if LEGACY_MODEL_FILE.match(name) and not os.path.exists(os.path.join(workdir, name)):
+            os.symlink(os.path.join(BASE_DIR, name), os.path.join(workdir, name))
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(filter(None, [BASE_DIR, os.environ.get('PYTHONPATH')])),
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+               BINANCE_API_URL=exchange.url, ORDER_BOOK_STREAM='0',
+               MAIL_SERVER='127.0.0.1', MAIL_PORT=str(smtp.port), MAIL_USE_TLS='0',
+               MAIL_USERNAME='loadtest@example.com', MAIL_PASSWORD='loadtest',
+               RETENTION_INTERVAL_SECONDS='0', LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'))
+    log = open(log_path, 'wb')
+    process = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'run', '--host', '127.0.0.1',
+                                '--port', str(port), '--no-reload', '--no-debugger', '--with-threads'],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with status {process.returncode}; see {log_path}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/auth/login", timeout=2)
+            return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"App did not start within 120s; see {log_path}")
+
+
+def run(users, duration, ramp_up, sample_seconds, exchange_latency, workdir):
+    """Run the load test; returns the report as a dict"""
+    exchange = FakeExchange(latency=exchange_latency).start()
+    smtp = FakeSMTP().start()
+    port = _free_port()
+    process = start_app(workdir, port, exchange, smtp, os.path.join(workdir, 'app.log'))
+    sampler = ProcessSampler(process.pid, sample_seconds)
+    sampler.start()
+    stats = Stats()
+    uploads = {size: make_csv(rows) for size, rows in UPLOAD_ROWS.items()}
+    stop_event = threading.Event()
+    sessions = [Session(n, f"http://127.0.0.1:{port}", smtp, stats, uploads, stop_event, ramp_up * n / max(1, users))
+                for n in range(users)]
+    started = time.monotonic()
+    try:
+        for session in sessions:
+            session.start()
+        stop_event.wait(duration)
+    finally:
+        stop_event.set()
+        for session in sessions:
+            session.join()
+        elapsed = time.monotonic() - started
+        sampler.stop()
+        process.terminate()
+        process.wait(30)
+        exchange.stop()
+        smtp.stop()
+    return {
+        'users': users,
+        'duration_seconds': round(elapsed, 1),
+        'sessions_failed': sum(1 for session in sessions if session.failed),
+        'endpoints': stats.summary(elapsed),
+        'server': sampler.summary(),
+        'server_samples': sampler.samples,
+        'exchange_requests': exchange.requests,
+        'emails_sent': len(smtp.messages),
+    }
+
+
+def print_report(report):
+    print(f"{report['users']} users for {report['duration_seconds']:g}s; "
+          f"{report['sessions_failed']} sessions failed to sign up; "
+          f"{report['exchange_requests']} exchange requests; {report['emails_sent']} emails")
+    print(f"{'endpoint':<26}{'requests':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'429s':>7}")
+    total = 0
+    for name, row in report['endpoints'].items():
+        total += row['requests']
+        print(f"{name:<26}{row['requests']:>9}{row['per_second']:>8.2f}{row['p50_ms']:>9.0f}{row['p95_ms']:>9.0f}"
+              f"{row['p99_ms']:>9.0f}{row['error_rate']:>8.1%}{row['throttled_rate']:>7.1%}")
+    print(f"{'total':<26}{total:>9}{total / report['duration_seconds']:>8.2f}")
+    server = report['server']
+    if server:
+        print(f"server: CPU mean {server['cpu_percent_mean']}% (p95 {server['cpu_percent_p95']}%), "
+              f"RSS {server['rss_mb_start']} -> {server['rss_mb_end']} MB (max {server['rss_mb_max']} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate concurrent dashboard users against a local app instance.')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=120, help='seconds of load after the first session starts')
+    parser.add_argument('--ramp-up', type=float, default=10, help='seconds over which sessions start')
+    parser.add_argument('--sample-seconds', type=float, default=1, help='server CPU/RSS sampling interval')
+    parser.add_argument('--exchange-latency', type=float, default=0.05, help='seconds the Binance stub takes per call')
+    parser.add_argument('--json', help='also write the report (with the CPU/RSS time series) to this file')
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory (database, files, app.log)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    try:
+        report = run(args.users, args.duration, args.ramp_up, args.sample_seconds, args.exchange_latency, workdir)
+    finally:
+        if args.keep:
+            print(f"Scratch directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Structured logging that stays off the request path.
+
+``setup_logging`` replaces the global ``basicConfig``: every logger hands its
+records to a ``QueueHandler``, and a ``QueueListener`` thread formats and
+writes them.  A request thread only does a queue put, never a write to
+stderr.  Records are JSON lines (``LOG_FORMAT=text`` for a readable console)
+carrying the request id, user id and analysis id of the code that logged
+them:
+
+* the request id comes from the ``X-Request-ID`` header or is generated, and
+  is echoed in the response;
+* the user id comes from the logged-in user;
+* ``log_context(analysis_id=...)`` binds fields for a block of code,
+  including background jobs, which run outside any request.
+
+Levels are set per logger with ``LOG_LEVELS`` (e.g. ``ml=DEBUG,werkzeug=WARNING``)
+on top of ``LOG_LEVEL``.  ``LOG_DEBUG_SAMPLE_EVERY=N`` keeps one in N DEBUG
+records per logger, so verbose per-row or per-model debugging can stay on.
+"""
+import sys
+import json
+import uuid
+import queue
+import atexit
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_DEBUG_SAMPLE_EVERY
+
+CONTEXT_FIELDS = ('request_id', 'user_id', 'analysis_id')
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_context = contextvars.ContextVar('log_context', default={})
+_listener = None
+_listener_lock = threading.Lock()
+
+
+@contextmanager
+def log_context(**fields):
+    """Add ``fields`` (e.g. analysis_id) to every record logged inside the block"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def _request_fields():
+    from flask import has_request_context, g
+    if not has_request_context():
+        return {}
+    # Only a user Flask-Login has already loaded: logging must never query the database
+    user = g.get('_login_user')
+    return {'request_id': g.get('request_id'), 'user_id': getattr(user, 'id', None)}
+
+
+def current_fields():
+    """The context fields in effect here, e.g. to carry a request's ids into a background job"""
+    fields = {**_request_fields(), **_context.get()}
+    return {name: value for name, value in fields.items() if value is not None}
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the request/job context of the thread that logged them."""
+
+    def filter(self, record):
+        for name, value in current_fields().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Keeps one in ``every`` DEBUG records per logger; other levels always pass."""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self.counters = {}
+
+    def filter(self, record):
+        if self.every == 1 or record.levelno != logging.DEBUG:
+            return True
+        counter = self.counters.get(record.name)
+        if counter is None:
+            counter = self.counters.setdefault(record.name, itertools.count())
+        return next(counter) % self.every == 0
+
+
+class StructuredQueueHandler(QueueHandler):
+    """Queues records with their message and traceback rendered but the fields intact.
+
+    ``QueueHandler.prepare`` would flatten everything into one formatted string.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        fields = ' '.join(f"{name}={getattr(record, name)}" for name in CONTEXT_FIELDS if hasattr(record, name))
+        return f"{text} [{fields}]" if fields else text
+
+
+def parse_levels(spec):
+    """'ml=DEBUG,werkzeug=WARNING' -> {'ml': 'DEBUG', 'werkzeug': 'WARNING'}"""
+    levels = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(app=None, stream=None):
+    """Route all logging through the queue; with ``app``, also tag requests with an id.
+
+    Safe to call more than once: the listener is only started once per process.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            records = queue.SimpleQueue()
+            output = logging.StreamHandler(stream or sys.stderr)
+            output.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter())
+            _listener = QueueListener(records, output, respect_handler_level=False)
+            _listener.start()
+            atexit.register(_listener.stop)
+
+            handler = StructuredQueueHandler(records)
+            handler.addFilter(ContextFilter())
+            if LOG_DEBUG_SAMPLE_EVERY > 1:
+                handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE_EVERY))
+            root = logging.getLogger()
+            for existing in root.handlers[:]:
+                root.removeHandler(existing)
+            root.addHandler(handler)
+            root.setLevel(LOG_LEVEL.upper())
+            for name, level in parse_levels(LOG_LEVELS).items():
+                logging.getLogger(name).setLevel(level)
+
+    if app is not None and not app.extensions.get('structured_logging'):
+        app.extensions['structured_logging'] = True
+
+        @app.before_request
+        def assign_request_id():
+            from flask import g, request
+            g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+        @app.after_request
+        def echo_request_id(response):
+            from flask import g
+            if g.get('request_id'):
+                response.headers['X-Request-ID'] = g.request_id
+            return response
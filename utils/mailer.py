@@ -0,0 +1,288 @@
+"""Persistent email outbox with a background sender.
+
+``queue_email`` only writes an ``EmailOutbox`` row, so request handlers
+(login, register, password reset, anomaly alerts) never wait on SMTP.  A
+sender thread, started lazily in each web process or run on its own with
+``python -m utils.mailer``, claims due rows in batches and delivers them
+over one authenticated SMTP connection it keeps open between batches.
+
+* Claiming is an atomic UPDATE with a lease, so several processes can share
+  one outbox and a crashed sender's rows are picked up again.
+* Failed sends are retried with exponential backoff up to
+  ``MAIL_MAX_ATTEMPTS`` times, then marked ``failed``.
+* Credentials come from ``MAIL_USERNAME``/``MAIL_PASSWORD``.  Without a
+  ``MAIL_USERNAME`` nothing is sent: claimed rows go back to the queue
+  with that error and are retried later.
+* Messages with a ``coalesce_key`` (e.g. anomaly alerts per user) are merged
+  into the pending row for that key, and at most one is sent per
+  ``MAIL_COALESCE_SECONDS`` window.
+"""
+import os
+import time
+import uuid
+import socket
+import logging
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from config import (MAIL_SERVER, MAIL_PORT, MAIL_USE_TLS, MAIL_SENDER_THREAD, MAIL_BATCH_SIZE,
+                    MAIL_MAX_ATTEMPTS, MAIL_RETRY_BACKOFF, MAIL_COALESCE_SECONDS,
+                    MAIL_CONNECTION_IDLE_SECONDS, MAIL_SMTP_TIMEOUT, MAIL_USERNAME, MAIL_PASSWORD,
+                    MAIL_DEFAULT_SENDER)
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 5
+LEASE_SECONDS = 300  # a claimed row is re-queued if its sender has not finished it by then
+PERMANENT_SMTP_CODES = range(500, 600)
+NOT_CONFIGURED_RETRY_SECONDS = 600
+NOT_CONFIGURED = 'Mail is not configured: set MAIL_USERNAME and MAIL_PASSWORD'
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+class MailNotConfigured(Exception):
+    """No SMTP account is configured, so nothing can be sent."""
+
+
+def smtp_credentials():
+    """SMTP login from config; an empty password skips AUTH (e.g. a local relay)"""
+    return MAIL_USERNAME, MAIL_PASSWORD
+
+
+def queue_email(to_email, subject, body, user_id=None, kind='generic', coalesce_key=None,
+                window=MAIL_COALESCE_SECONDS):
+    """Add a message to the outbox and wake the sender; returns the outbox row"""
+    from app import db
+    from models import EmailOutbox
+
+    now = datetime.utcnow()
+    row = None
+    due = now
+    if coalesce_key:
+        latest = (EmailOutbox.query.filter_by(coalesce_key=coalesce_key)
+                  .order_by(EmailOutbox.id.desc()).first())
+        if latest is not None and latest.status == 'pending':
+            # Fold into the message that is still waiting to go out
+            latest.message_count = (latest.message_count or 1) + 1
+            latest.subject = subject
+            latest.body = f"{body}\n\n({latest.message_count} alerts combined into this email)"
+            row = latest
+        elif latest is not None:
+            # A message for this key is going out right now or went out recently: hold until the window ends
+            last_sent = now if latest.status == 'sending' else latest.sent_at
+            if last_sent and last_sent > now - timedelta(seconds=window):
+                due = last_sent + timedelta(seconds=window)
+    if row is None:
+        row = EmailOutbox(user_id=user_id, to_email=to_email, subject=subject, body=body, kind=kind,
+                          coalesce_key=coalesce_key, next_attempt_at=due, created_at=now)
+        db.session.add(row)
+    db.session.commit()
+    if MAIL_SENDER_THREAD:
+        ensure_sender()
+    return row
+
+
+def build_message(sender, row):
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = row.to_email
+    msg['Subject'] = row.subject
+    msg.attach(MIMEText(row.body, 'plain'))
+    return msg.as_string()
+
+
+class SMTPConnection:
+    """One authenticated SMTP session, reopened on demand and closed when idle."""
+
+    def __init__(self, host=MAIL_SERVER, port=MAIL_PORT, use_tls=MAIL_USE_TLS, credentials=None,
+                 timeout=MAIL_SMTP_TIMEOUT, idle_seconds=MAIL_CONNECTION_IDLE_SECONDS, sender=MAIL_DEFAULT_SENDER):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.user, self.password = credentials or smtp_credentials()
+        self.sender = sender or self.user
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self.server = None
+        self.last_used = 0.0
+
+    @property
+    def configured(self):
+        return bool(self.sender)
+
+    def _open(self):
+        if not self.configured:
+            raise MailNotConfigured(NOT_CONFIGURED)
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()
+        if self.password:
+            server.login(self.user, self.password)
+        self.server = server
+        logger.info(f"Opened SMTP connection to {self.host}:{self.port}")
+
+    def _alive(self):
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, to_email, message):
+        if self.server is not None and time.monotonic() - self.last_used > self.idle_seconds and not self._alive():
+            self.close()
+        if self.server is None:
+            self._open()
+        try:
+            self.server.sendmail(self.sender, to_email, message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # The server dropped an idle connection; reconnect once and resend
+            self.close()
+            self._open()
+            self.server.sendmail(self.sender, to_email, message)
+        self.last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self.server is not None and time.monotonic() - self.last_used > self.idle_seconds:
+            self.close()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+
+def claim_batch(worker_id, limit=MAIL_BATCH_SIZE):
+    """Atomically lease up to ``limit`` due rows to ``worker_id`` and return them"""
+    from app import db
+    from models import EmailOutbox
+
+    now = datetime.utcnow()
+    due = (db.session.query(EmailOutbox.id)
+           .filter(EmailOutbox.status.in_(['pending', 'sending']), EmailOutbox.next_attempt_at <= now)
+           .order_by(EmailOutbox.next_attempt_at).limit(limit).all())
+    ids = [row[0] for row in due]
+    if not ids:
+        return []
+    # Re-check the due condition in the UPDATE so two senders never claim the same row
+    (EmailOutbox.query
+     .filter(EmailOutbox.id.in_(ids), EmailOutbox.status.in_(['pending', 'sending']),
+             EmailOutbox.next_attempt_at <= now)
+     .update({'status': 'sending', 'claimed_by': worker_id,
+              'next_attempt_at': now + timedelta(seconds=LEASE_SECONDS)}, synchronize_session=False))
+    db.session.commit()
+    return EmailOutbox.query.filter(EmailOutbox.id.in_(ids), EmailOutbox.claimed_by == worker_id,
+                                    EmailOutbox.status == 'sending').order_by(EmailOutbox.id).all()
+
+
+def deliver_batch(connection, rows):
+    """Send claimed rows over ``connection`` and record each outcome; returns the number sent"""
+    from app import db
+
+    if not connection.configured:
+        # Keep the rows queued with the reason, without spending their attempts
+        logger.error(f"{NOT_CONFIGURED}; {len(rows)} emails left queued")
+        for row in rows:
+            row.status = 'pending'
+            row.claimed_by = None
+            row.last_error = NOT_CONFIGURED
+            row.next_attempt_at = datetime.utcnow() + timedelta(seconds=NOT_CONFIGURED_RETRY_SECONDS)
+        db.session.commit()
+        return 0
+    sent = 0
+    for row in rows:
+        try:
+            connection.send(row.to_email, build_message(connection.sender, row))
+            row.status = 'sent'
+            row.sent_at = datetime.utcnow()
+            row.last_error = None
+            sent += 1
+        except Exception as e:
+            connection.close()
+            row.attempts = (row.attempts or 0) + 1
+            row.last_error = str(e)[:1000]
+            if isinstance(e, smtplib.SMTPRecipientsRefused):
+                # 4xx refusals (e.g. a busy mailbox) are worth retrying, 5xx ones are not
+                permanent = all(code in PERMANENT_SMTP_CODES for code, _ in e.recipients.values())
+            else:
+                permanent = isinstance(e, smtplib.SMTPResponseException) and e.smtp_code in PERMANENT_SMTP_CODES
+            if permanent or row.attempts >= MAIL_MAX_ATTEMPTS:
+                row.status = 'failed'
+                logger.error(f"Giving up on email {row.id} to {row.to_email}: {str(e)}")
+            else:
+                row.status = 'pending'
+                row.next_attempt_at = datetime.utcnow() + timedelta(seconds=MAIL_RETRY_BACKOFF * 2 ** (row.attempts - 1))
+                logger.warning(f"Email {row.id} failed (attempt {row.attempts}): {str(e)}")
+        row.claimed_by = None
+        db.session.commit()
+    return sent
+
+
+class MailSender(threading.Thread):
+    """Background thread draining the outbox for one process."""
+
+    def __init__(self, app, poll_seconds=POLL_SECONDS):
+        super().__init__(name='mail-sender', daemon=True)
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.connection = SMTPConnection()
+
+    def run(self):
+        from app import db
+        with self.app.app_context():
+            while not self.stopping.is_set():
+                try:
+                    rows = claim_batch(self.worker_id)
+                    if rows:
+                        deliver_batch(self.connection, rows)
+                        continue  # there may be more due rows
+                    self.connection.close_if_idle()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Mail sender error: {str(e)}")
+                finally:
+                    db.session.remove()
+                self.wakeup.wait(self.poll_seconds)
+                self.wakeup.clear()
+            self.connection.close()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+
+def ensure_sender(app=None):
+    """Start this process's sender thread if needed and wake it up"""
+    global _sender
+    if _sender is None or not _sender.is_alive():
+        with _sender_lock:
+            if _sender is None or not _sender.is_alive():
+                if app is None:
+                    from flask import current_app
+                    app = current_app._get_current_object()
+                _sender = MailSender(app)
+                _sender.start()
+    _sender.wakeup.set()
+    return _sender
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    from app import app
+    sender = MailSender(app)
+    sender.start()
+    try:
+        while sender.is_alive():
+            sender.join(1)
+    except KeyboardInterrupt:
+        sender.stop()
+        sender.join()
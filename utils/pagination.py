@@ -0,0 +1,63 @@
+"""Keyset (seek) pagination.
+
+OFFSET pagination makes the database read and discard every row before the
+requested page, so deep pages get slower as a table grows.  Keyset
+pagination remembers the sort key of the last row shown and asks for the
+rows after it (``WHERE (timestamp, id) < (:t, :i)``), which an index on the
+sort columns answers in one range seek whatever the page.
+
+Pages are newest first.  A cursor is the sort key of a page's first or last
+row, encoded for a URL.
+"""
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+class KeysetPage:
+    """One page of rows plus the cursors for its neighbours."""
+
+    def __init__(self, items, has_next, has_prev, key):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = encode_cursor(key(items[-1])) if items and has_next else None
+        self.prev_cursor = encode_cursor(key(items[0])) if items and has_prev else None
+
+
+def encode_cursor(values):
+    """(datetime, id) -> '2026-01-31T12:00:00.123456_42'"""
+    timestamp, row_id = values
+    return f"{timestamp.isoformat()}_{row_id}"
+
+
+def decode_cursor(cursor):
+    """Inverse of ``encode_cursor``; None for a missing or malformed cursor"""
+    try:
+        timestamp, row_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def keyset_paginate(query, timestamp_column, id_column, per_page=20, after=None, before=None):
+    """Page of ``query`` ordered by (timestamp, id) descending.
+
+    ``after`` is a cursor from ``next_cursor`` (older rows), ``before`` one from
+    ``prev_cursor`` (newer rows); with neither, the newest page is returned.
+    """
+    def key(row):
+        return getattr(row, timestamp_column.key), getattr(row, id_column.key)
+
+    sort_key = tuple_(timestamp_column, id_column)
+    newer = decode_cursor(before)
+    if newer is not None:
+        rows = (query.filter(sort_key > newer)
+                .order_by(timestamp_column.asc(), id_column.asc())
+                .limit(per_page + 1).all())
+        has_prev = len(rows) > per_page
+        return KeysetPage(rows[:per_page][::-1], has_next=True, has_prev=has_prev, key=key)
+    older = decode_cursor(after)
+    if older is not None:
+        query = query.filter(sort_key < older)
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(per_page + 1).all()
+    return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_prev=older is not None, key=key)
@@ -0,0 +1,204 @@
+"""Background purges for clearing history and deleting accounts.
+
+Clearing analyses, activity logs or testnet history, and deleting an
+account, used to be one bulk ``DELETE`` inside the request.  For a user with
+millions of rows that held the SQLite write lock until the request timed out.
+``start`` now records a ``PurgeJob`` and returns at once; a job on the
+background pool deletes matching rows ``PURGE_BATCH_SIZE`` ids at a time,
+committing after each batch and pausing briefly so other writers get the
+lock.  The purge row carries the progress (rows and files deleted, bytes
+freed), which ``/api/purges/<id>`` reports.
+
+Files that belong only to deleted analyses go with them: PDF reports, saved
+live transactions, and uploaded files that no remaining analysis shares
+(uploads are stored once per content hash).  When the rows are gone,
+``reclaim_space`` returns the freed SQLite pages to the filesystem.
+
+Purges are idempotent, so one interrupted by a restart can be finished with
+``python -m utils.purge``.
+"""
+import os
+import time
+import logging
+from datetime import datetime
+from config import PURGE_BATCH_SIZE, PURGE_BATCH_PAUSE_SECONDS, PURGE_VACUUM_PAGES
+from utils.retention import REPORTS_DIR, LIVE_TRANSACTIONS_DIR, REPORT_FILE, LIVE_TRANSACTIONS_FILE, UPLOAD_FILE
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ('analyses', 'activity_logs', 'testnet', 'account')
+
+
+class Artifacts:
+    """Files left by analyses, found with one scan of each directory per purge."""
+
+    def __init__(self, upload_dir):
+        self.by_analysis = {}
+        self.by_hash = {}
+        self._scan(REPORTS_DIR, REPORT_FILE, self.by_analysis, int)
+        self._scan(LIVE_TRANSACTIONS_DIR, LIVE_TRANSACTIONS_FILE, self.by_analysis, int)
+        self._scan(upload_dir, UPLOAD_FILE, self.by_hash, str)
+
+    @staticmethod
+    def _scan(directory, pattern, index, key_type):
+        if not os.path.isdir(directory):
+            return
+        for entry in os.scandir(directory):
+            match = pattern.match(entry.name)
+            if match and entry.is_file():
+                index.setdefault(key_type(match.group(1)), []).append(entry.path)
+
+    def for_analyses(self, ids):
+        return [path for analysis_id in ids for path in self.by_analysis.pop(analysis_id, ())]
+
+    def for_hashes(self, hashes):
+        return [path for file_hash in hashes for path in self.by_hash.pop(file_hash, ())]
+
+
+def remove_files(paths):
+    """Delete files, skipping ones already gone; returns ``(count, bytes)``"""
+    count = size = 0
+    for path in paths:
+        try:
+            file_size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logger.warning(f"Could not delete {path}: {str(e)}")
+            continue
+        count += 1
+        size += file_size
+    return count, size
+
+
+def start(user_id, scope):
+    """Queue a purge of ``scope`` for ``user_id``, or return the one already pending"""
+    from flask import current_app
+    from app import db
+    from models import PurgeJob
+    from utils import jobs
+
+    purge = PurgeJob.query.filter(PurgeJob.user_id == user_id, PurgeJob.scope == scope,
+                                  PurgeJob.status.in_(('queued', 'running'))).first()
+    if purge is None:
+        purge = PurgeJob(user_id=user_id, scope=scope)
+        db.session.add(purge)
+        db.session.commit()
+        jobs.submit(run, purge.id, current_app.config['UPLOAD_FOLDER'])
+    return purge
+
+
+def _delete_rows(purge, model, *criteria, before_delete=None):
+    """Delete rows matching ``criteria`` in batches, one short transaction each.
+
+    ``before_delete(ids)`` runs inside each batch's transaction and may return
+    a callback that runs once the batch is committed, returning
+    ``(files, bytes)`` removed.
+    """
+    from app import db
+
+    while True:
+        ids = [row[0] for row in db.session.query(model.id).filter(*criteria).limit(PURGE_BATCH_SIZE)]
+        if not ids:
+            return
+        after_commit = before_delete(ids) if before_delete else None
+        model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        purge.rows_deleted += len(ids)
+        purge.updated_at = datetime.utcnow()
+        db.session.commit()
+        if after_commit is not None:
+            files, size = after_commit()
+            purge.files_deleted += files
+            purge.bytes_freed += size
+        time.sleep(PURGE_BATCH_PAUSE_SECONDS)
+
+
+def _delete_analyses(purge, artifacts, *criteria):
+    from app import db
+    from models import Analysis, UploadSession
+
+    def before_delete(ids):
+        hashes = {file_hash for (file_hash,) in db.session.query(Analysis.file_hash).filter(
+            Analysis.id.in_(ids), Analysis.file_hash.isnot(None)).distinct()}
+        UploadSession.query.filter(UploadSession.analysis_id.in_(ids)).update(
+            {UploadSession.analysis_id: None}, synchronize_session=False)
+
+        def after_commit():
+            # An uploaded file is stored once per hash; keep it while another analysis uses it
+            shared = {file_hash for (file_hash,) in db.session.query(Analysis.file_hash).filter(
+                Analysis.file_hash.in_(hashes)).distinct()} if hashes else set()
+            return remove_files(artifacts.for_analyses(ids) + artifacts.for_hashes(hashes - shared))
+        return after_commit
+
+    _delete_rows(purge, Analysis, *criteria, before_delete=before_delete)
+
+
+def _delete_account(purge, artifacts, upload_dir):
+    from models import User, Analysis, ActivityLog, Alert, MonitorSubscription, EmailOutbox, UploadSession
+    from utils.uploads import part_path
+
+    user_id = purge.user_id
+
+    def remove_parts(ids):
+        return lambda: remove_files(part_path(upload_dir, session_id) for session_id in ids)
+
+    _delete_rows(purge, UploadSession, UploadSession.user_id == user_id, before_delete=remove_parts)
+    # Analyses before alerts, so a job still finishing one of them fails instead of alerting
+    _delete_analyses(purge, artifacts, Analysis.user_id == user_id)
+    for model in (Alert, ActivityLog, MonitorSubscription, EmailOutbox):
+        _delete_rows(purge, model, model.user_id == user_id)
+    _delete_rows(purge, User, User.id == user_id)
+
+
+def run(purge_id, upload_dir):
+    """Job: carry out a purge batch by batch, recording progress on its row"""
+    from app import db
+    from models import PurgeJob, Analysis, ActivityLog
+    from utils.database import reclaim_space
+
+    purge = db.session.get(PurgeJob, purge_id)
+    if purge is None or not purge.pending:
+        return
+    purge.status = 'running'
+    db.session.commit()
+    try:
+        artifacts = Artifacts(upload_dir)
+        if purge.scope == 'analyses':
+            _delete_analyses(purge, artifacts, Analysis.user_id == purge.user_id)
+        elif purge.scope == 'testnet':
+            _delete_analyses(purge, artifacts, Analysis.user_id == purge.user_id, Analysis.analysis_type == 'testnet')
+        elif purge.scope == 'activity_logs':
+            _delete_rows(purge, ActivityLog, ActivityLog.user_id == purge.user_id)
+        elif purge.scope == 'account':
+            _delete_account(purge, artifacts, upload_dir)
+        else:
+            raise ValueError(f"Unknown purge scope {purge.scope!r}")
+        db.session.commit()
+        purge.bytes_freed += reclaim_space(db.engine, PURGE_VACUUM_PAGES, PURGE_BATCH_PAUSE_SECONDS)
+        purge.status = 'complete'
+    except Exception as e:
+        db.session.rollback()
+        purge.status = 'failed'
+        purge.error = str(e)
+        logger.error(f"Purge {purge_id} ({purge.scope}) failed: {str(e)}")
+    purge.finished_at = purge.updated_at = datetime.utcnow()
+    db.session.commit()
+    logger.info(f"Purge {purge_id} ({purge.scope}) {purge.status}: {purge.rows_deleted} rows, "
+                f"{purge.files_deleted} files, {purge.bytes_freed} bytes freed")
+
+
+def run_pending(upload_dir):
+    """Finish every queued or interrupted purge in this process; returns how many ran"""
+    from models import PurgeJob
+
+    pending = [purge.id for purge in PurgeJob.query.filter(PurgeJob.status.in_(('queued', 'running')))]
+    for purge_id in pending:
+        run(purge_id, upload_dir)
+    return len(pending)
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        print(f"Ran {run_pending(app.config['UPLOAD_FOLDER'])} pending purges")
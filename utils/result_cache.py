@@ -0,0 +1,89 @@
+"""Result cache for uploaded files.
+
+Results are keyed by (file SHA-256, model version, feature-schema version),
+so re-uploading an export that was already analysed by the same models
+skips inference and links the new ``Analysis`` to the stored results rather
+than writing another copy.  An entry that an ``Analysis`` references is
+that analysis's only copy of its results, so it is pinned: never evicted
+and not counted against ``RESULT_CACHE_MAX_BYTES``.  Entries whose analyses
+have all been deleted are kept for re-uploads within that budget and
+evicted least recently used first.
+"""
+import json
+import logging
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import Analysis, ResultCache
+from config import RESULT_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+def lookup(file_hash, model_version, schema_version):
+    """Return the cached entry for the key (marking it used), or None"""
+    entry = ResultCache.query.filter_by(file_hash=file_hash, model_version=model_version,
+                                        schema_version=schema_version).first()
+    if entry is not None:
+        entry.hit_count = (entry.hit_count or 0) + 1
+        entry.last_used_at = datetime.utcnow()
+        db.session.commit()
+    return entry
+
+
+def store(file_hash, model_version, schema_version, results):
+    """Cache a results dict and return its entry, evicting old entries if over budget"""
+    payload = json.dumps(results)
+    entry = ResultCache(file_hash=file_hash, model_version=model_version, schema_version=schema_version,
+                        results=payload, size_bytes=len(payload),
+                        total_transactions=results['total_transactions'],
+                        anomalies_detected=results['anomalies_detected'],
+                        accuracy_score=results['accuracy_score'])
+    db.session.add(entry)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request analysed the same file concurrently; use its entry
+        db.session.rollback()
+        return lookup(file_hash, model_version, schema_version)
+    evict(keep_id=entry.id)
+    return entry
+
+
+def _unpinned():
+    """Filter for entries no analysis references"""
+    referenced = db.session.query(Analysis.result_cache_id).filter(Analysis.result_cache_id.isnot(None))
+    return ResultCache.id.notin_(referenced)
+
+
+def total_size(pinned=True):
+    """Bytes of cached results; with ``pinned=False``, only of entries eviction may drop"""
+    query = db.session.query(db.func.coalesce(db.func.sum(ResultCache.size_bytes), 0))
+    if not pinned:
+        query = query.filter(_unpinned())
+    return int(query.scalar())
+
+
+def evict(max_bytes=RESULT_CACHE_MAX_BYTES, keep_id=None):
+    """Drop least-recently-used unreferenced entries until they fit in ``max_bytes``; returns bytes freed"""
+    excess = total_size(pinned=False) - max_bytes
+    if excess <= 0:
+        return 0
+    # Pick victims from (id, size) only, so the results blobs are not loaded
+    candidates = (db.session.query(ResultCache.id, ResultCache.size_bytes).filter(_unpinned())
+                  .order_by(ResultCache.last_used_at.asc(), ResultCache.id.asc()))
+    if keep_id is not None:
+        candidates = candidates.filter(ResultCache.id != keep_id)
+    victims = []
+    freed = 0
+    for entry_id, size in candidates:
+        if freed >= excess:
+            break
+        victims.append(entry_id)
+        freed += size or 0
+    if victims:
+        # Re-check at delete time, in case an analysis started sharing a victim meanwhile
+        ResultCache.query.filter(ResultCache.id.in_(victims), _unpinned()).delete(synchronize_session=False)
+    db.session.commit()
+    logger.info(f"Evicted {len(victims)} result cache entries ({freed} bytes)")
+    return freed
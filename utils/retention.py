@@ -0,0 +1,340 @@
+"""Retention and compaction for uploads, reports and live captures.
+
+Every upload, report download and live poll writes a file, and nothing used
+to remove them.  Each directory now has a policy (``RETENTION_UPLOADS``,
+``RETENTION_REPORTS``, ``RETENTION_LIVE_TRANSACTIONS``) such as
+``max_age_days=30,max_total_mb=2048,keep_last=1,compress_after_days=1``,
+where 0 turns a rule off.  A sweep applies the rules in order:
+
+* ``keep_last``: only the newest N files of each analysis are kept;
+* ``max_age_days``: older files are removed;
+* ``max_total_mb``: the oldest files go until the directory fits;
+* ``compress_after_days``: older ``.csv`` files are gzipped in place
+  (``.csv`` -> ``.csv.gz``, which uploads and pandas both read).
+
+A sweep first indexes each directory: file names carry the analysis id
+(reports, live captures) or content hash (uploads), and the database says
+which analyses still exist and which are queued or running.  Files of a
+pending analysis are never touched.  Uploads that any analysis references
+are never removed (the upload policy only removes orphans), only compressed.
+
+A background thread sweeps every ``RETENTION_INTERVAL_SECONDS``.  A lock file
+keeps several web processes from sweeping at once.  ``python -m
+utils.retention`` runs one sweep, e.g. from cron with the thread turned off.
+``storage_stats`` (``/api/storage-stats``) reports disk usage per directory
+and what the last sweep did.
+"""
+import os
+import re
+import gzip
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime
+from config import (UPLOAD_FOLDER, RETENTION_UPLOADS, RETENTION_REPORTS, RETENTION_LIVE_TRANSACTIONS,
+                    RETENTION_INTERVAL_SECONDS, RETENTION_COMPRESS_LEVEL)
+
+logger = logging.getLogger(__name__)
+
+REPORTS_DIR = 'reports'
+LIVE_TRANSACTIONS_DIR = 'live_transactions'
+# What each stored file belongs to, from its name
+REPORT_FILE = re.compile(r'^(?:analysis|simple)_report_(\d+)_.*\.pdf$')
+LIVE_TRANSACTIONS_FILE = re.compile(r'^live_transactions_.*_analysis_(\d+)_user_\d+\.csv(?:\.gz)?$')
+UPLOAD_FILE = re.compile(r'^([0-9a-f]{64})\.')
+LOCK_FILE = '.retention.lock'
+LOCK_STALE_SECONDS = 3600  # a lock older than this was left by a crashed sweep
+DAY = 86400
+
+_last_sweep = {}
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+class Policy:
+    """Retention rules for one directory; 0 turns a rule off."""
+
+    RULES = ('max_age_days', 'max_total_mb', 'keep_last', 'compress_after_days')
+
+    def __init__(self, name, directory, max_age_days=0, max_total_mb=0, keep_last=0, compress_after_days=0,
+                 protect_referenced=False):
+        self.name = name
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.max_total_mb = max_total_mb
+        self.keep_last = keep_last
+        self.compress_after_days = compress_after_days
+        self.protect_referenced = protect_referenced
+
+    @classmethod
+    def parse(cls, name, directory, spec, **kwargs):
+        """Policy from 'max_age_days=7,keep_last=1'"""
+        for item in spec.split(','):
+            if '=' not in item:
+                continue
+            rule, value = (part.strip() for part in item.split('=', 1))
+            if rule not in cls.RULES:
+                raise ValueError(f"Unknown retention rule {rule!r} for {name}")
+            kwargs[rule] = float(value) if '.' in value else int(value)
+        return cls(name, directory, **kwargs)
+
+    def to_dict(self):
+        return {'directory': self.directory, 'protect_referenced': self.protect_referenced,
+                **{rule: getattr(self, rule) for rule in self.RULES}}
+
+
+def default_policies(upload_dir=UPLOAD_FOLDER):
+    return [
+        Policy.parse('uploads', upload_dir, RETENTION_UPLOADS, protect_referenced=True),
+        Policy.parse('reports', REPORTS_DIR, RETENTION_REPORTS),
+        Policy.parse('live_transactions', LIVE_TRANSACTIONS_DIR, RETENTION_LIVE_TRANSACTIONS),
+    ]
+
+
+class StoredFile:
+    __slots__ = ('path', 'size', 'mtime', 'analysis_id', 'file_hash', 'referenced', 'in_use')
+
+    def __init__(self, path, size, mtime, analysis_id=None, file_hash=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.analysis_id = analysis_id
+        self.file_hash = file_hash
+        self.referenced = False
+        self.in_use = False
+
+
+def scan(directory):
+    """Stored files of ``directory`` with the analysis id or content hash in their names"""
+    files = []
+    if not os.path.isdir(directory):
+        return files
+    for entry in os.scandir(directory):
+        # Dot files are in-progress uploads, temporary files and the lock
+        if entry.name.startswith('.') or not entry.is_file():
+            continue
+        stat = entry.stat()
+        stored = StoredFile(entry.path, stat.st_size, stat.st_mtime)
+        match = REPORT_FILE.match(entry.name) or LIVE_TRANSACTIONS_FILE.match(entry.name)
+        if match:
+            stored.analysis_id = int(match.group(1))
+        else:
+            match = UPLOAD_FILE.match(entry.name)
+            stored.file_hash = match.group(1) if match else None
+        files.append(stored)
+    return files
+
+
+def _in_chunks(values, size=500):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def mark_references(files):
+    """Flag files whose analysis (or, for uploads, any analysis of their hash) exists or is pending"""
+    from app import db
+    from models import Analysis
+
+    pending = ('queued', 'running')
+    for attribute, column in (('analysis_id', Analysis.id), ('file_hash', Analysis.file_hash)):
+        keys = {getattr(stored, attribute) for stored in files} - {None}
+        referenced, in_use = set(), set()
+        for chunk in _in_chunks(keys):
+            for key, status in db.session.query(column, Analysis.status).filter(column.in_(chunk)).distinct():
+                referenced.add(key)
+                if status in pending:
+                    in_use.add(key)
+        for stored in files:
+            key = getattr(stored, attribute)
+            if key is not None:
+                stored.referenced = stored.referenced or key in referenced
+                stored.in_use = stored.in_use or key in in_use
+    return files
+
+
+def compress_file(path, level=RETENTION_COMPRESS_LEVEL):
+    """gzip ``path`` to ``path.gz`` keeping its modification time; returns the bytes saved"""
+    size = os.path.getsize(path)
+    target = f"{path}.gz"
+    if not os.path.exists(target):
+        directory, name = os.path.split(path)
+        tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.gz.tmp")
+        try:
+            with open(path, 'rb') as src, open(tmp_path, 'wb') as raw, \
+                    gzip.GzipFile(filename=name, mode='wb', fileobj=raw, compresslevel=level) as out:
+                shutil.copyfileobj(src, out, 1024 * 1024)
+            stat = os.stat(path)
+            os.utime(tmp_path, (stat.st_atime, stat.st_mtime))
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    # Uploads are named by content hash, so an existing .gz holds the same bytes
+    os.remove(path)
+    return size - os.path.getsize(target)
+
+
+def plan(policy, files, now=None):
+    """Split ``files`` into ``(remove, compress)`` lists under ``policy``"""
+    now = now or time.time()
+    removable = [stored for stored in files
+                 if not stored.in_use and not (policy.protect_referenced and stored.referenced)]
+    expired = set()
+    if policy.keep_last:
+        kept = {}
+        for stored in sorted(files, key=lambda stored: stored.mtime, reverse=True):
+            if stored.analysis_id is not None:
+                kept[stored.analysis_id] = kept.get(stored.analysis_id, 0) + 1
+                if kept[stored.analysis_id] > policy.keep_last:
+                    expired.add(stored.path)
+    if policy.max_age_days:
+        cutoff = now - policy.max_age_days * DAY
+        expired.update(stored.path for stored in files if stored.mtime < cutoff)
+    remove = [stored for stored in removable if stored.path in expired]
+    removed = {stored.path for stored in remove}
+    if policy.max_total_mb:
+        total = sum(stored.size for stored in files if stored.path not in removed)
+        for stored in sorted(removable, key=lambda stored: stored.mtime):
+            if total <= policy.max_total_mb * 1024 * 1024:
+                break
+            if stored.path not in removed:
+                remove.append(stored)
+                removed.add(stored.path)
+                total -= stored.size
+    compress = []
+    if policy.compress_after_days:
+        cutoff = now - policy.compress_after_days * DAY
+        compress = [stored for stored in files if not stored.in_use and stored.path not in removed
+                    and stored.path.endswith('.csv') and stored.mtime < cutoff]
+    return remove, compress
+
+
+def _acquire_lock(path):
+    for _ in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) < LOCK_STALE_SECONDS:
+                    return False
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return False
+
+
+def sweep(upload_dir=UPLOAD_FOLDER, policies=None, dry_run=False):
+    """One retention pass over every directory; returns its stats, or None when another process is sweeping"""
+    from utils.purge import remove_files
+    from utils.uploads import expire_sessions
+
+    os.makedirs(upload_dir, exist_ok=True)
+    lock_path = os.path.join(upload_dir, LOCK_FILE)
+    if not _acquire_lock(lock_path):
+        logger.info('Retention sweep skipped: another process is sweeping')
+        return None
+    started = time.time()
+    stats = {'started_at': datetime.utcnow().isoformat(), 'dry_run': dry_run, 'directories': {}}
+    try:
+        if not dry_run:
+            stats['expired_upload_sessions'] = expire_sessions(upload_dir)
+        for policy in policies or default_policies(upload_dir):
+            files = mark_references(scan(policy.directory))
+            remove, compress = plan(policy, files)
+            result = {
+                'files': len(files),
+                'bytes': sum(stored.size for stored in files),
+                'referenced_bytes': sum(stored.size for stored in files if stored.referenced),
+                'removed_files': len(remove),
+                'removed_bytes': sum(stored.size for stored in remove),
+                'compressed_files': len(compress),
+                'compressed_saved_bytes': 0,
+            }
+            if not dry_run:
+                result['removed_files'], result['removed_bytes'] = remove_files(stored.path for stored in remove)
+                for stored in compress:
+                    try:
+                        result['compressed_saved_bytes'] += compress_file(stored.path)
+                    except OSError as e:
+                        result['compressed_files'] -= 1
+                        logger.warning(f"Could not compress {stored.path}: {str(e)}")
+            stats['directories'][policy.name] = result
+    finally:
+        os.remove(lock_path)
+    stats['seconds'] = round(time.time() - started, 3)
+    if not dry_run:
+        _last_sweep.clear()
+        _last_sweep.update(stats)
+    logger.info('Retention sweep finished', extra={'retention': stats['directories']})
+    return stats
+
+
+def storage_stats(upload_dir=UPLOAD_FOLDER):
+    """Current disk usage per directory, free space, policies and the last sweep"""
+    directories = {}
+    for policy in default_policies(upload_dir):
+        files = scan(policy.directory)
+        directories[policy.name] = {
+            'files': len(files),
+            'bytes': sum(stored.size for stored in files),
+            'compressed_files': sum(1 for stored in files if stored.path.endswith('.gz')),
+            'oldest': datetime.utcfromtimestamp(min(stored.mtime for stored in files)).isoformat() if files else None,
+            'policy': policy.to_dict()
+        }
+    disk = shutil.disk_usage(upload_dir if os.path.isdir(upload_dir) else '.')
+    return {'directories': directories, 'disk': {'total': disk.total, 'used': disk.used, 'free': disk.free},
+            'last_sweep': dict(_last_sweep) or None}
+
+
+class RetentionSweeper(threading.Thread):
+    """Background thread sweeping every ``interval`` seconds for one process."""
+
+    def __init__(self, app, interval=RETENTION_INTERVAL_SECONDS):
+        super().__init__(name='retention-sweeper', daemon=True)
+        self.app = app
+        self.interval = interval
+        self.stopping = threading.Event()
+
+    def run(self):
+        from app import db
+        # Let startup and the first requests go first
+        self.stopping.wait(min(60, self.interval))
+        with self.app.app_context():
+            while not self.stopping.is_set():
+                try:
+                    sweep(self.app.config['UPLOAD_FOLDER'])
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Retention sweep failed: {str(e)}")
+                finally:
+                    db.session.remove()
+                self.stopping.wait(self.interval)
+
+    def stop(self):
+        self.stopping.set()
+
+
+def ensure_sweeper(app):
+    """Start this process's sweeper thread if needed"""
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None or not _sweeper.is_alive():
+            _sweeper = RetentionSweeper(app)
+            _sweeper.start()
+    return _sweeper
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Run one retention sweep over uploads, reports and live captures.')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be removed or compressed.')
+    args = parser.parse_args()
+    from app import app
+    with app.app_context():
+        print(json.dumps(sweep(app.config['UPLOAD_FOLDER'], dry_run=args.dry_run), indent=2))
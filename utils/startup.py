@@ -0,0 +1,96 @@
+"""Fast worker startup: deferred heavy imports, warm-up and a startup profile.
+
+Importing the app only loads Flask, SQLAlchemy and the blueprints.  pandas,
+scikit-learn/XGBoost (via ``ml.analyzer``), python-binance, reportlab,
+matplotlib and PIL are imported where they are used, so a new worker can
+take requests in well under a second.  With ``WARM_UP_ON_START`` a
+background thread then imports them and loads the model artifact, so the
+first upload or live analysis does not pay for it either.
+
+``python -m utils.startup`` imports the app in a fresh interpreter with
+``-X importtime`` and prints the slowest imports; it exits with status 1
+when startup takes longer than ``STARTUP_TARGET_SECONDS``.
+"""
+import os
+import sys
+import time
+import logging
+import importlib
+import threading
+import subprocess
+from config import STARTUP_TARGET_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Imported by the warm-up thread; everything else the first request needs is already loaded
+WARM_UP_MODULES = ('pandas', 'ml.analyzer', 'binance.client', 'reportlab.platypus', 'PIL.Image')
+
+
+def warm_up():
+    """Import the deferred modules and load the model artifact; returns the seconds taken"""
+    started = time.perf_counter()
+    for name in WARM_UP_MODULES:
+        importlib.import_module(name)
+    from utils.helpers import _pyplot
+    _pyplot()
+    from ml.analyzer import MLAnalyzer
+    MLAnalyzer()
+    return time.perf_counter() - started
+
+
+def _warm_up_thread():
+    try:
+        logger.info(f"Warm-up finished in {warm_up():.2f}s")
+    except Exception as e:
+        # Nothing is lost: the modules load on first use instead
+        logger.warning(f"Warm-up failed: {str(e)}")
+
+
+def start_warm_up():
+    thread = threading.Thread(target=_warm_up_thread, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def profile(depth=2):
+    """Import the app and build it in a new interpreter.
+
+    Returns (import seconds, create_app seconds, [(cumulative seconds, module)])
+    for the imports at most ``depth`` levels below the top, slowest first.
+    """
+    code = ("import time; t = time.perf_counter(); import app; i = time.perf_counter(); app.app; "
+            "print(i - t, time.perf_counter() - i)")
+    env = dict(os.environ, WARM_UP_ON_START='0', MAIL_SENDER_THREAD='0')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, env=env)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'app import failed')
+    import_seconds, create_seconds = map(float, result.stdout.strip().splitlines()[-1].split())
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # the header line
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level <= depth:
+            imports.append((int(cumulative) / 1e6, '  ' * level + name.strip()))
+    return import_seconds, create_seconds, sorted(imports, reverse=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Profile app startup (imports and create_app)')
+    parser.add_argument('--top', type=int, default=25, help='slowest imports to list')
+    parser.add_argument('--depth', type=int, default=2, help='import nesting levels to include')
+    parser.add_argument('--target', type=float, default=STARTUP_TARGET_SECONDS, help='seconds; exit 1 above this')
+    args = parser.parse_args()
+
+    import_seconds, create_seconds, slowest = profile(args.depth)
+    for seconds, name in slowest[:args.top]:
+        print(f"{seconds:8.3f}s  {name}")
+    total = import_seconds + create_seconds
+    print(f"Startup: {total:.3f}s (imports {import_seconds:.3f}s, create_app {create_seconds:.3f}s; "
+          f"target {args.target:.3f}s)")
+    sys.exit(0 if total <= args.target else 1)
@@ -0,0 +1,211 @@
+"""Content-addressed storage for uploaded files.
+
+Uploads are streamed to disk in chunks and hashed on the way, so the
+SHA-256 is known without a second read.  The file is then stored under its
+hash; uploading the same bytes again reuses the existing file instead of
+writing another copy.  An optional ``check`` (e.g. ``ml.ingest.HeaderCheck``)
+sees every chunk and can reject the upload before the rest is written.
+
+Large files use resumable chunked uploads instead: the client sends ordered
+chunks with their checksums, each written in place into one part file, and
+finalizing hashes the part file, moves it into storage and queues the
+analysis (``process_chunked_upload``).
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from config import UPLOAD_SESSION_TTL_HOURS
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ChunkError(ValueError):
+    """Raised for a chunk that does not match its declared size or checksum."""
+
+
+def blob_path(upload_dir, file_hash, extension='csv'):
+    return os.path.join(upload_dir, f"{file_hash}.{extension}")
+
+
+def store_file(tmp_path, upload_dir, file_hash, extension='csv'):
+    """Move a fully written file to its content address; returns ``(path, created)``"""
+    path = blob_path(upload_dir, file_hash, extension)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        # Retention ages files by modification time, so a reused file counts as new
+        os.utime(path)
+        return path, False
+    os.replace(tmp_path, path)
+    return path, True
+
+
+def save_upload(file_storage, upload_dir, extension='csv', chunk_size=CHUNK_SIZE, check=None):
+    """Stream an uploaded file to content-addressed storage.
+
+    Returns ``(path, sha256, size, created)``; ``created`` is False when an
+    identical file was already stored (the new copy is discarded).  With a
+    ``check``, the stored extension is ``check.extension``.
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, prefix='.upload-', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file_storage.stream.read(chunk_size), b''):
+                if check is not None:
+                    check.feed(chunk)
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        if check is not None:
+            check.finish()
+            extension = check.extension
+        file_hash = digest.hexdigest()
+        path, created = store_file(tmp_path, upload_dir, file_hash, extension)
+        return path, file_hash, size, created
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def part_path(upload_dir, session_id):
+    return os.path.join(upload_dir, f".chunked-{session_id}.part")
+
+
+def write_chunk(path, offset, stream, length, sha256, check=None, chunk_size=CHUNK_SIZE):
+    """Stream one chunk of a chunked upload into the part file at ``offset``.
+
+    The chunk must be exactly ``length`` bytes with the given SHA-256; on any
+    failure the file is cut back to ``offset`` so the chunk can be resent.
+    """
+    digest = hashlib.sha256()
+    written = 0
+    with open(path, 'r+b') as out:
+        # Drop whatever an interrupted attempt at this chunk left behind
+        out.truncate(offset)
+        out.seek(offset)
+        try:
+            for block in iter(lambda: stream.read(chunk_size), b''):
+                written += len(block)
+                if written > length:
+                    raise ChunkError(f'Chunk is larger than the expected {length} bytes')
+                if check is not None:
+                    check.feed(block)
+                digest.update(block)
+                out.write(block)
+            if written != length:
+                raise ChunkError(f'Expected {length} bytes, received {written}')
+            if digest.hexdigest() != sha256.lower():
+                raise ChunkError('Chunk checksum mismatch')
+        except BaseException:
+            out.truncate(offset)
+            raise
+    return written
+
+
+def expire_sessions(upload_dir, max_age_hours=UPLOAD_SESSION_TTL_HOURS):
+    """Discard open upload sessions idle for longer than ``max_age_hours``; returns how many"""
+    from app import db
+    from models import UploadSession
+
+    cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+    stale = UploadSession.query.filter(UploadSession.status == 'open', UploadSession.updated_at < cutoff).all()
+    for upload in stale:
+        path = part_path(upload_dir, upload.id)
+        if os.path.exists(path):
+            os.remove(path)
+        upload.status = 'aborted'
+    db.session.commit()
+    return len(stale)
+
+
+def analyze_upload(analysis, filepath, columns=None, compression=None):
+    """Fill ``analysis`` with results for a stored upload, reusing cached results for identical files.
+
+    Returns ``(summary, cache_hit)``; the caller commits.
+    """
+    from flask import current_app
+    from ml.analyzer import MLAnalyzer
+    from utils import result_cache
+    from utils.logs import log_context
+
+    use_cache = current_app.config['RESULT_CACHE_ENABLED']
+    analyzer = MLAnalyzer()
+    model_version, schema_version = analyzer.cache_identity()
+    cached = result_cache.lookup(analysis.file_hash, model_version, schema_version) if use_cache else None
+    hit = cached is not None
+    if hit:
+        # Same bytes, same models: reuse the stored results without running inference
+        summary = {'total_transactions': cached.total_transactions,
+                   'anomalies_detected': cached.anomalies_detected,
+                   'accuracy_score': cached.accuracy_score}
+        analysis.results = None
+    else:
+        with log_context(analysis_id=analysis.id):
+            summary = analyzer.analyze_csv(filepath, columns=columns, compression=compression)
+        if use_cache:
+            cached = result_cache.store(analysis.file_hash, model_version, schema_version, summary)
+        analysis.results = None if cached is not None else json.dumps(summary)
+        analysis.memory_mb = summary['memory']['growth_mb']
+        analysis.analysis_mode = summary['memory']['mode']
+    analysis.total_transactions = summary['total_transactions']
+    analysis.anomalies_detected = summary['anomalies_detected']
+    analysis.accuracy_score = summary['accuracy_score']
+    analysis.result_cache_id = cached.id if cached is not None else None
+    return summary, hit
+
+
+def process_chunked_upload(analysis_id, session_id, upload_dir):
+    """Job: store a finalized chunked upload under its hash and run its analysis"""
+    from app import db
+    from models import Analysis, UploadSession
+    from ml.ingest import sniff_file
+    from utils.helpers import create_alert, alert_on_drift
+    from utils.governor import admit, estimate_rows
+
+    analysis = db.session.get(Analysis, analysis_id)
+    upload = db.session.get(UploadSession, session_id)
+    analysis.status = 'running'
+    db.session.commit()
+    try:
+        path = part_path(upload_dir, session_id)
+        header = sniff_file(path)
+        file_hash = hash_file(path)
+        if upload.sha256 and upload.sha256.lower() != file_hash:
+            os.remove(path)
+            raise ChunkError('File checksum does not match the one given when the upload started')
+        filepath, _ = store_file(path, upload_dir, file_hash, header.extension)
+        analysis.file_hash = file_hash
+        # Stays 'running' while it waits its fair turn for an analysis slot
+        with admit(analysis.user_id, estimate_rows(upload.total_size), upload.total_size, defer=True) as ticket:
+            summary, _ = analyze_upload(analysis, filepath, header.columns, header.compression)
+            ticket['rows'] = summary['total_transactions']
+        analysis.status = 'complete'
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        analysis.status = 'failed'
+        analysis.error = str(e)
+        db.session.commit()
+        logger.error(f"Analysis {analysis_id} of chunked upload {session_id} failed: {str(e)}")
+        return
+    if summary['anomalies_detected'] > 0:
+        create_alert(analysis.user_id, 'anomaly',
+                     f"Detected {summary['anomalies_detected']} anomalies in uploaded file", 'high',
+                     key=f'upload:{analysis.id}', quantity=summary['anomalies_detected'], noun='anomalies')
+    alert_on_drift(summary.get('drift'))